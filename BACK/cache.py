@@ -0,0 +1,168 @@
+"""Caché en memoria de respuestas por usuario (LRU con caducidad).
+
+Las entradas se guardan por (usuario, ámbito, parámetros normalizados, huella del
+ETag) y, si el endpoint trabaja sobre fechas, con el rango de fechas que cubren.
+Las escrituras anotan en la sesión qué ámbitos y fechas de un usuario cambian y
+la caché se invalida cuando se confirma la transacción (evento after_commit).
+
+Cada invalidación incrementa la generación del usuario: una respuesta calculada
+antes de una invalidación no se guarda, de modo que una lectura concurrente no
+vuelve a guardar datos anteriores al commit. Tampoco se guardan las respuestas
+leídas de una réplica, que pueden ser anteriores a la última escritura; las
+peticiones enviadas a una réplica sí pueden servirse desde la caché.
+
+La caché es local a cada proceso, pero la huella del ETag incluye las versiones
+de user_settings, que cada escritura incrementa en la base de datos: tras una
+escritura confirmada en otro proceso la clave cambia y no se sirve la respuesta
+anterior. Las vistas sin @conditional no se cachean.
+"""
+
+import os
+import time
+import threading
+from collections import OrderedDict
+from functools import wraps
+from flask import current_app, g, request, Response
+from flask_jwt_extended import get_jwt_identity
+from sqlalchemy import event
+from models import session, RoutingSession
+
+# Ámbitos cacheados
+CATEGORIES = 'categories'
+SUMMARY = 'summary'
+MONTHLY_HISTORY = 'history_monthly'
+YEARLY_HISTORY = 'history_yearly'
+
+# Ámbitos que dependen de las transacciones
+TRANSACTION_SCOPES = (SUMMARY, MONTHLY_HISTORY, YEARLY_HISTORY)
+ALL_SCOPES = (CATEGORIES,) + TRANSACTION_SCOPES
+
+
+class ResponseCache:
+    def __init__(self, max_entries=None, ttl=None):
+        self.max_entries = max_entries or int(os.getenv('CACHE_MAX_ENTRIES', 1024))
+        self.ttl = ttl if ttl is not None else float(os.getenv('CACHE_TTL_SECONDS', 60))
+        # clave -> (caduca, rango de fechas, cuerpo, mimetype)
+        self.entries = OrderedDict()
+        # usuario -> número de invalidaciones
+        self.generations = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def cached(self, scope, date_range=None):
+        """Decorador para vistas GET con usuario autenticado (va debajo de @jwt_required y de @conditional).
+
+        Sin la huella de @conditional (g.etag_fingerprint) la respuesta no se cachea.
+
+        date_range(args) devuelve el rango (desde, hasta) que cubre la respuesta, con None
+        en los extremos abiertos; si lanza ValueError la petición se sirve sin caché.
+        """
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                fingerprint = g.get('etag_fingerprint')
+                if fingerprint is None:
+                    return view(*args, **kwargs)
+                try:
+                    dates = date_range(request.args) if date_range else (None, None)
+                except ValueError:
+                    return view(*args, **kwargs)
+
+                user_id = str(get_jwt_identity())
+                params = tuple(sorted(request.args.items(multi=True)))
+                # Con la huella del ETag en la clave, un cuerpo guardado antes de una escritura (de
+                # este o de otro proceso) no se sirve con el ETag posterior a ella
+                key = (user_id, scope, dates, params, fingerprint)
+
+                entry = self._get(key)
+                if entry:
+                    return Response(entry[2], mimetype=entry[3])
+
+                generation = self._generation(user_id)
+                response = current_app.make_response(view(*args, **kwargs))
+                if response.status_code == 200 and not response.is_streamed and not session.info.get('replica'):
+                    self._set(key, generation, dates, response.get_data(), response.mimetype)
+                return response
+            return wrapper
+        return decorator
+
+    def _get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry[0] > time.monotonic():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            if entry:
+                del self.entries[key]
+            self.misses += 1
+            return None
+
+    def _generation(self, user_id):
+        with self.lock:
+            return self.generations.get(user_id, 0)
+
+    def _set(self, key, generation, dates, body, mimetype):
+        """Guarda la respuesta salvo que el usuario se haya invalidado desde que empezó a calcularse"""
+        with self.lock:
+            if self.generations.get(key[0], 0) != generation:
+                return
+            self.entries[key] = (time.monotonic() + self.ttl, dates, body, mimetype)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, user_id, scopes=ALL_SCOPES, date_from=None, date_to=None):
+        """Elimina las entradas del usuario en esos ámbitos cuyo rango se solapa con [date_from, date_to]"""
+        user_id = str(user_id)
+        with self.lock:
+            self.generations[user_id] = self.generations.get(user_id, 0) + 1
+            stale = [
+                key for key, (_, (start, end), _, _) in self.entries.items()
+                if key[0] == user_id and key[1] in scopes
+                and (date_to is None or start is None or start <= date_to)
+                and (date_from is None or end is None or end >= date_from)
+            ]
+            for key in stale:
+                del self.entries[key]
+            self.invalidations += len(stale)
+
+    def invalidate_on_commit(self, session, user_id, scopes=ALL_SCOPES, date_from=None, date_to=None):
+        """Programa la invalidación para cuando se confirme la transacción de la sesión"""
+        session.info.setdefault('cache_invalidations', []).append((user_id, scopes, date_from, date_to))
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else None,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations
+            }
+
+
+response_cache = ResponseCache()
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _apply_invalidations(session):
+    for invalidation in session.info.pop('cache_invalidations', []):
+        response_cache.invalidate(*invalidation)
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def _discard_invalidations(session):
+    session.info.pop('cache_invalidations', None)
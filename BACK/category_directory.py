@@ -0,0 +1,129 @@
+"""Directorio en memoria de las categorías de cada usuario.
+
+Las rutas de transacciones resuelven categorías (por id o por nombre) con el
+directorio del usuario en lugar de consultar o hacer JOIN con la tabla category.
+Cada directorio se guarda con la versión de categorías del usuario
+(user_settings.categories_version), que toda escritura de categorías incrementa
+en la base de datos, y se vuelve a cargar cuando la petición conoce una versión
+posterior, aunque el cambio se confirmara en otro proceso. Las vistas con
+@conditional ya leen la versión en la consulta de su huella (g.categories_version),
+así que con el directorio en memoria no hacen ninguna consulta más; el resto la
+leen una vez por petición del primario. CategoryController (o una importación que
+crea categorías) además descarta el directorio del proceso al confirmar o deshacer.
+
+Las categorías se leen siempre del primario: el directorio sirve para comprobar la
+propiedad de las categorías al escribir y una réplica retrasada dejaría fuera las
+recién creadas. Una versión leída de una réplica puede ser anterior a la del
+directorio, que entonces sigue siendo válido; las versiones solo aumentan.
+"""
+
+import os
+import time
+import threading
+from collections import OrderedDict
+from flask import g, has_app_context
+from sqlalchemy import event, select
+from models import session, engine, RoutingSession, Category, UserSettings
+
+
+class CategoryDirectory:
+    """Categorías de un usuario: by_id (id -> fila) y by_name (nombre en minúsculas -> fila)"""
+
+    def __init__(self, rows):
+        self.by_id = {row.id: row for row in rows}
+        self.by_name = {row.name.lower(): row for row in rows}
+        # Representación JSON de cada categoría, la misma que GET /categories
+        self.payloads = {row.id: row._asdict() for row in rows}
+
+    def get(self, category_id):
+        try:
+            return self.by_id.get(int(category_id))
+        except (TypeError, ValueError):
+            return None
+
+    def find(self, name):
+        return self.by_name.get(name.strip().lower()) if name else None
+
+
+class CategoryDirectoryCache:
+    def __init__(self, max_users=None, ttl=None):
+        self.max_users = max_users or int(os.getenv('CATEGORY_DIRECTORY_MAX_USERS', 4096))
+        self.ttl = ttl if ttl is not None else float(os.getenv('CATEGORY_DIRECTORY_TTL_SECONDS', 60))
+        # usuario -> (caduca, versión de categorías, directorio)
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id):
+        user_id = str(user_id)
+        version = self._version(user_id)
+
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if entry and entry[0] > time.monotonic() and entry[1] >= version:
+                self.entries.move_to_end(user_id)
+                self.hits += 1
+                return entry[2]
+            self.misses += 1
+
+        rows = session.execute(select(
+            Category.id, Category.name, Category.color, Category.type, Category.created_at
+        ).where(Category.user_id == user_id), bind_arguments={'bind': engine}).all()
+        directory = CategoryDirectory(rows)
+
+        with self.lock:
+            self.entries[user_id] = (time.monotonic() + self.ttl, version, directory)
+            self.entries.move_to_end(user_id)
+            while len(self.entries) > self.max_users:
+                self.entries.popitem(last=False)
+        return directory
+
+    @staticmethod
+    def _version(user_id):
+        """Versión de categorías conocida en la petición o, si no hay, leída del primario (una vez por petición)"""
+        if has_app_context() and g.get('categories_version') is not None:
+            return g.categories_version
+        version = session.execute(
+            select(UserSettings.categories_version).where(UserSettings.user_id == user_id),
+            bind_arguments={'bind': engine}
+        ).scalar() or 0
+        if has_app_context():
+            g.categories_version = version
+        return version
+
+    def invalidate(self, user_id):
+        with self.lock:
+            self.entries.pop(str(user_id), None)
+
+    def invalidate_on_commit(self, session, user_id):
+        """Programa la invalidación para cuando se confirme la transacción de la sesión"""
+        session.info.setdefault('category_invalidations', set()).add(str(user_id))
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'users': len(self.entries),
+                'max_users': self.max_users,
+                'ttl_seconds': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else None
+            }
+
+
+category_directory = CategoryDirectoryCache()
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _apply_invalidations(session):
+    for user_id in session.info.pop('category_invalidations', ()):
+        category_directory.invalidate(user_id)
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def _discard_invalidations(session):
+    # El directorio pudo cargarse dentro de la transacción deshecha, con categorías que no llegan a existir
+    for user_id in session.info.pop('category_invalidations', ()):
+        category_directory.invalidate(user_id)
@@ -1,13 +1,13 @@
 import re
 from flask import jsonify, request
 from sqlalchemy.sql import exists
-import bcrypt
 from flask_jwt_extended import (
     create_access_token, set_access_cookies,
     jwt_required, get_jwt_identity, unset_jwt_cookies
 )
-from contextlib import contextmanager
 from models import session, User, UserSettings
+from passwords import password_hasher, PasswordHasherBusy
+from query_audit import query_budget
 
 class AuthController:
     def __init__(self, app):
@@ -27,19 +27,6 @@ class AuthController:
         # Comprobar autenticación
         self.app.add_url_rule('/check-auth', view_func=self.check_auth, methods=['GET'])
 
-
-    @contextmanager
-    def _session_scope(self):
-        """Proporciona un contexto transaccional para la sesión."""
-        try:
-            yield session
-            session.commit()
-        except Exception as e:
-            session.rollback()
-            raise e
-        finally:
-            session.remove()
-            
     def register(self):
             data = request.get_json()
             username = data.get('username')
@@ -107,32 +94,31 @@ class AuthController:
 
             try:
                 user_id = None
-                with self._session_scope() as session:
-                    # Verificar si el usuario o email ya existen
-                    if session.query(exists().where(User.email == email)).scalar():
-                        return jsonify({"msg": "El email ya está registrado"}), 409
-
-                    if session.query(exists().where(User.username == username)).scalar():
-                        return jsonify({"msg": "El nombre de usuario ya está en uso"}), 409
-
-                    # Hashear la contraseña
-                    hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
-
-                    # Crear nuevo usuario
-                    new_user = User(
-                        username=username,
-                        email=email,
-                        password=hashed_password.decode('utf-8')
-                    )
-                    session.add(new_user)
-                    session.flush()  # Asegurarse de que el ID se genere
-                    user_id = new_user.id
-
-                    # Crear configuración de usuario con USD como moneda predeterminada
-                    user_settings = UserSettings(
-                        user_id=user_id,
-                    )
-                    session.add(user_settings)
+                # Verificar si el usuario o email ya existen
+                if session.query(exists().where(User.email == email)).scalar():
+                    return jsonify({"msg": "El email ya está registrado"}), 409
+
+                if session.query(exists().where(User.username == username)).scalar():
+                    return jsonify({"msg": "El nombre de usuario ya está en uso"}), 409
+
+                # Hashear la contraseña
+                hashed_password = password_hasher.hash(password)
+
+                # Crear nuevo usuario
+                new_user = User(
+                    username=username,
+                    email=email,
+                    password=hashed_password
+                )
+                session.add(new_user)
+                session.flush()  # Asegurarse de que el ID se genere
+                user_id = new_user.id
+
+                # Crear configuración de usuario con USD como moneda predeterminada
+                user_settings = UserSettings(
+                    user_id=user_id,
+                )
+                session.add(user_settings)
 
                 access_token = create_access_token(identity=str(user_id))
 
@@ -147,62 +133,79 @@ class AuthController:
                 set_access_cookies(response, access_token)
                 return response, 201
 
+            except PasswordHasherBusy:
+                return self._busy_response()
             except Exception as e:
                 print(f"Error en el registro: {str(e)}")
                 return jsonify({"msg": f"Error en el servidor: {str(e)}"}), 500
             
+    @query_budget(2)
     def login(self):
         data = request.get_json()
         email = data.get('email')
         password = data.get('password')
 
         try:
-            with self._session_scope():
-                user = session.query(User).filter_by(email=email).first()
-                if not user:
-                    return jsonify({"msg": "Credenciales inválidas"}), 401
-
-                # Comparar la contraseña
-                if not bcrypt.checkpw(password.encode('utf-8'), user.password.encode('utf-8')):
-                    return jsonify({"msg": "Credenciales inválidas"}), 401
-
-                access_token = create_access_token(identity=str(user.id))
-
-                response = jsonify({
-                    "msg": "Login exitoso",
-                    "user": {
-                        "id": user.id,
-                        "username": user.username,
-                        "email": user.email
-                    }
-                })
-                set_access_cookies(response, access_token)
-                return response
-
+            user = session.query(User).filter_by(email=email).first()
+            if not user:
+                return jsonify({"msg": "Credenciales inválidas"}), 401
+
+            # Comparar la contraseña
+            if not password_hasher.check(password, user.password):
+                return jsonify({"msg": "Credenciales inválidas"}), 401
+
+            # Rehacer el hash si se cambió BCRYPT_ROUNDS (se guarda en el commit de la petición)
+            if password_hasher.needs_rehash(user.password):
+                try:
+                    user.password = password_hasher.hash(password)
+                except PasswordHasherBusy:
+                    pass
+
+            access_token = create_access_token(identity=str(user.id))
+
+            response = jsonify({
+                "msg": "Login exitoso",
+                "user": {
+                    "id": user.id,
+                    "username": user.username,
+                    "email": user.email
+                }
+            })
+            set_access_cookies(response, access_token)
+            return response
+
+        except PasswordHasherBusy:
+            return self._busy_response()
         except Exception as e:
             print(f"Error en el login: {str(e)}")
             return jsonify({"msg": "Error en el servidor"}), 500
 
+    @staticmethod
+    def _busy_response():
+        response = jsonify({"msg": "Servidor ocupado, inténtalo de nuevo en unos segundos"})
+        response.headers['Retry-After'] = '1'
+        return response, 503
+
     def logout(self):
         response = jsonify({'msg': 'Sesión cerrada con éxito!'})
         unset_jwt_cookies(response)
         return response
     
     @jwt_required()
+    @query_budget(1)
     def profile(self):
         user_id = get_jwt_identity()
         try:
-            with self._session_scope():
-                user = session.get(User, user_id)
-                if not user:
-                    return jsonify({'msg': 'Usuario no encontrado'}), 404
-
-                return jsonify({
-                    'id': user.id,
-                    'username': user.username,
-                    'email': user.email,
-                    'created_at': user.created_at.isoformat()
-                })
+            user = session.get(User, user_id)
+            if not user:
+                return jsonify({'msg': 'Usuario no encontrado'}), 404
+
+            return jsonify({
+                'id': user.id,
+                'username': user.username,
+                'email': user.email,
+                'created_at': user.created_at.isoformat()
+            })
         except Exception as e:
             print(f"Error al obtener el perfil: {str(e)}")
             return jsonify({"msg": "Error en el servidor"}), 500
@@ -221,9 +224,8 @@ class AuthController:
             return jsonify({"msg": "El campo 'email' es requerido"}), 400
         
         try:
-            with self._session_scope():
-                exists_email = session.query(exists().where(User.email == email)).scalar()
-                return jsonify({"exists": exists_email})
+            exists_email = session.query(exists().where(User.email == email)).scalar()
+            return jsonify({"exists": exists_email})
         except Exception as e:
             return jsonify({"msg": "Error en el servidor"}), 500
     
@@ -234,8 +236,7 @@ class AuthController:
             return jsonify({"msg": "El campo 'username' es requerido"}), 400
         
         try:
-            with self._session_scope():
-                exists_username = session.query(exists().where(User.username == username)).scalar()
-                return jsonify({"exists": exists_username})
+            exists_username = session.query(exists().where(User.username == username)).scalar()
+            return jsonify({"exists": exists_username})
         except Exception as e:
             return jsonify({"msg": "Error en el servidor"}), 500
\ No newline at end of file
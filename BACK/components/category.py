@@ -1,9 +1,13 @@
 from flask import jsonify, request
+from datetime import datetime
 from flask_jwt_extended import (
     jwt_required, get_jwt_identity
 )
-from models import session, Category, CategoryType
-from contextlib import contextmanager
+from models import session, Category, CategoryType, UserSettings, Transaction
+from cache import response_cache, CATEGORIES, SUMMARY
+from etags import conditional, bump_versions, categories_fingerprint, transactions_version
+from category_directory import category_directory
+from query_audit import query_budget
 
 
 class CategoryController:
@@ -23,37 +27,25 @@ class CategoryController:
         self.app.add_url_rule('/categories/<int:category_id>', view_func=self.update_category, methods=['PUT'])
         # Eliminar categoría
         self.app.add_url_rule('/categories/<int:category_id>', view_func=self.delete_category, methods=['DELETE'])
-
-    @contextmanager
-    def _session_scope(self):
-        """Proporciona un contexto transaccional para la sesión."""
-        try:
-            yield session
-            session.commit()
-        except Exception as e:
-            session.rollback()
-            raise e
-        finally:
-            session.remove()
     
     @jwt_required()
+    @conditional(categories_fingerprint)
+    @response_cache.cached(CATEGORIES)
+    @query_budget(2)
     def get_categories(self):
         user_id = get_jwt_identity()
         try:
-            with self._session_scope():
-                categories = session.query(Category).filter_by(user_id=user_id).all()
-                
-                return jsonify([{
-                    'id': cat.id,
-                    'name': cat.name,
-                    'color': cat.color,
-                    'type': cat.type.value,
-                    'created_at': cat.created_at.isoformat()
-                } for cat in categories])
+            categories = session.query(
+                Category.id, Category.name, Category.color, Category.type, Category.created_at
+            ).filter_by(user_id=user_id).all()
+            
+            # Las filas se serializan tal cual (orjson codifica el Enum y la fecha)
+            return jsonify([category._asdict() for category in categories])
         except Exception as e:
             return jsonify({'msg': 'Error al obtener categorías'}), 500
     
     @jwt_required()
+    @query_budget(2)
     def create_category(self):
         user_id = get_jwt_identity()
         data = request.get_json()
@@ -67,98 +59,121 @@ class CategoryController:
             return jsonify({'msg': f'La categoría no puede exceder los {self.MAX_NAME_LENGTH} caracteres ({len(data['name'])})'}), 400
         
         try:
-            with self._session_scope():
-                category = Category(
-                    name=data['name'],
-                    color=data.get('color'),
-                    type=category_type,
-                    user_id=user_id
-                )
-                
-                session.add(category)
-                session.flush() # Para obtener el ID generado automáticamente
-                
-                return jsonify({
-                    'msg': 'Categoría creada',
-                    'category': {
-                        'id': category.id,
-                        'name': category.name,
-                        'color': category.color,
-                        'type': category.type.value
-                    }
-                }), 201
+            category = Category(
+                name=data['name'],
+                color=data.get('color'),
+                type=category_type,
+                user_id=user_id
+            )
+            
+            session.add(category)
+            session.flush() # Para obtener el ID generado automáticamente
+            response_cache.invalidate_on_commit(session, user_id, [CATEGORIES])
+            category_directory.invalidate_on_commit(session, user_id)
+            bump_versions(user_id, UserSettings.categories_version)
+            
+            return jsonify({
+                'msg': 'Categoría creada',
+                'category': {
+                    'id': category.id,
+                    'name': category.name,
+                    'color': category.color,
+                    'type': category.type.value
+                }
+            }), 201
         except Exception as e:
             print("Error al crear categoría:", e)
             return jsonify({'msg': 'Error al crear categoría'}), 500
     
     @jwt_required()
+    @query_budget(1)
     def get_category(self, category_id):
         user_id = get_jwt_identity()
         try:
-            with self._session_scope():
-                category = session.query(Category).filter_by(id=category_id, user_id=user_id).first()
+            category = session.query(Category).filter_by(id=category_id, user_id=user_id).first()
+            
+            if not category:
+                return jsonify({'msg': 'Categoría no encontrada'}), 404
                 
-                if not category:
-                    return jsonify({'msg': 'Categoría no encontrada'}), 404
-                    
-                return jsonify({
-                    'id': category.id,
-                    'name': category.name,
-                    'color': category.color,
-                    'type': category.type.value,
-                    'created_at': category.created_at.isoformat()
-                })
+            return jsonify({
+                'id': category.id,
+                'name': category.name,
+                'color': category.color,
+                'type': category.type.value,
+                'created_at': category.created_at.isoformat()
+            })
         except Exception as e:
             return jsonify({'msg': 'Error al obtener categoría'}), 500
     
     @jwt_required()
+    @query_budget(4)
     def update_category(self, category_id):
         user_id = get_jwt_identity()
         data = request.get_json()
         
         try:
-            with self._session_scope():
-                category = session.query(Category).filter_by(id=category_id, user_id=user_id).first()
-                
-                if not category:
-                    return jsonify({'msg': 'Categoría no encontrada'}), 404
-                
-                if 'name' in data:
-                    if len(data['name']) > self.MAX_NAME_LENGTH:
-                        return jsonify({'msg': f'La categoría no puede exceder los {self.MAX_NAME_LENGTH} caracteres ({len(data['name'])})'}), 400
-                    category.name = data['name']
-                if 'color' in data:
-                    category.color = data['color']
-                if 'type' in data:
-                    try:
-                        category.type = CategoryType(data['type'])
-                    except ValueError:
-                        return jsonify({'msg': 'Tipo de categoría inválido'}), 400
-                                
-                return jsonify({
-                    'msg': 'Categoría actualizada',
-                    'category': {
-                        'id': category.id,
-                        'name': category.name,
-                        'color': category.color,
-                        'type': category.type.value
-                    }
-                })
+            category = session.query(Category).filter_by(id=category_id, user_id=user_id).first()
+            
+            if not category:
+                return jsonify({'msg': 'Categoría no encontrada'}), 404
+            
+            if 'name' in data:
+                if len(data['name']) > self.MAX_NAME_LENGTH:
+                    return jsonify({'msg': f'La categoría no puede exceder los {self.MAX_NAME_LENGTH} caracteres ({len(data['name'])})'}), 400
+                category.name = data['name']
+            if 'color' in data:
+                category.color = data['color']
+            if 'type' in data:
+                try:
+                    category.type = CategoryType(data['type'])
+                except ValueError:
+                    return jsonify({'msg': 'Tipo de categoría inválido'}), 400
+            
+            # El resumen muestra el nombre y el color de la categoría
+            response_cache.invalidate_on_commit(session, user_id, [CATEGORIES, SUMMARY])
+            category_directory.invalidate_on_commit(session, user_id)
+            
+            # Las transacciones incluyen los datos de su categoría: cambian su ETag y se marcan
+            # como modificadas para que /transactions/changes las vuelva a enviar
+            bump_versions(user_id, UserSettings.categories_version, UserSettings.transactions_version)
+            session.query(Transaction).filter_by(user_id=user_id, category_id=category.id).update(
+                {Transaction.updated_at: datetime.now(), Transaction.sync_version: transactions_version(user_id)},
+                synchronize_session=False
+            )
+                            
+            return jsonify({
+                'msg': 'Categoría actualizada',
+                'category': {
+                    'id': category.id,
+                    'name': category.name,
+                    'color': category.color,
+                    'type': category.type.value
+                }
+            })
         except Exception as e:
             return jsonify({'msg': 'Error al actualizar categoría'}), 500
     
     @jwt_required()
+    @query_budget(5)
     def delete_category(self, category_id):
         user_id = get_jwt_identity()
         try:
-            with self._session_scope():
-                category = session.query(Category).filter_by(id=category_id, user_id=user_id).first()
-                
-                if not category:
-                    return jsonify({'msg': 'Categoría no encontrada'}), 404
-                
-                session.delete(category)
-                
-                return jsonify({'msg': 'Categoría eliminada'})
+            category = session.query(Category).filter_by(id=category_id, user_id=user_id).first()
+            
+            if not category:
+                return jsonify({'msg': 'Categoría no encontrada'}), 404
+            
+            # Sus transacciones se quedan sin categoría y /transactions/changes las vuelve a enviar
+            bump_versions(user_id, UserSettings.categories_version, UserSettings.transactions_version)
+            session.query(Transaction).filter_by(user_id=user_id, category_id=category.id).update({
+                Transaction.category_id: None,
+                Transaction.updated_at: datetime.now(),
+                Transaction.sync_version: transactions_version(user_id)
+            }, synchronize_session=False)
+            session.delete(category)
+            response_cache.invalidate_on_commit(session, user_id, [CATEGORIES, SUMMARY])
+            category_directory.invalidate_on_commit(session, user_id)
+            
+            return jsonify({'msg': 'Categoría eliminada'})
         except Exception as e:
             return jsonify({'msg': 'Error al eliminar categoría'}), 500
@@ -1,9 +1,13 @@
 from flask import jsonify, request
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from models import session, MonthHistory, YearHistory, Transaction, TransactionKind
-from sqlalchemy import and_
-from contextlib import contextmanager
-from datetime import timedelta
+from models import session, MonthHistory, YearHistory, TransactionKind, upsert
+from components.settings import UserSettingsController
+from cache import response_cache, MONTHLY_HISTORY, YEARLY_HISTORY
+from etags import conditional, transactions_fingerprint
+from query_audit import query_budget
+from datetime import date
+import calendar
+import pandas as pd
 
 class HistoryController:
     def __init__(self, app):
@@ -15,44 +19,47 @@ class HistoryController:
         self.app.add_url_rule('/history/monthly', view_func=self.get_monthly_history, methods=['GET'])
         # Historial por año
         self.app.add_url_rule('/history/yearly', view_func=self.get_yearly_history, methods=['GET'])
-
-    @contextmanager
-    def _session_scope(self):
-        """Proporciona un contexto transaccional para la sesión."""
-        try:
-            yield session
-            session.commit()
-        except Exception as e:
-            session.rollback()
-            raise e
-        finally:
-            session.remove()
+    
+    @staticmethod
+    def _history_range(args):
+        """Rango de fechas que cubren los filtros year y month del historial"""
+        if not args.get('year'):
+            return None, None
+        year = int(args['year'])
+        if args.get('month'):
+            month = int(args['month'])
+            return date(year, month, 1), date(year, month, calendar.monthrange(year, month)[1])
+        return date(year, 1, 1), date(year, 12, 31)
     
     @jwt_required()
+    @conditional(transactions_fingerprint)
+    @response_cache.cached(MONTHLY_HISTORY, date_range=lambda args: HistoryController._history_range(args))
+    @query_budget(4)
     def get_monthly_history(self):
         user_id = get_jwt_identity()
         year = request.args.get('year')
         month = request.args.get('month')
         
         try:
-            with self._session_scope():
-                query = session.query(MonthHistory).filter_by(user_id=user_id)
-                
-                if year:
-                    query = query.filter(MonthHistory.year == int(year))
-                if month:
-                    query = query.filter(MonthHistory.month == int(month))
-                    
-                history = query.order_by(MonthHistory.year, MonthHistory.month).all()
+            query = session.query(MonthHistory).filter_by(user_id=user_id)
+            
+            if year:
+                query = query.filter(MonthHistory.year == int(year))
+            if month:
+                query = query.filter(MonthHistory.month == int(month))
                 
-                return jsonify([{
-                    'day': h.day,
-                    'month': h.month,
-                    'year': h.year,
-                    'income': h.income,
-                    'expense': h.expense,
-                    'balance': h.income - h.expense
-                } for h in history])
+            history = query.order_by(MonthHistory.year, MonthHistory.month, MonthHistory.day).all()
+            _, convert = UserSettingsController._conversion_factors(user_id)
+            totals = self._convert_history(history, lambda h: (h.year, h.month, h.day), convert)
+            
+            return jsonify([{
+                'day': day,
+                'month': month,
+                'year': year,
+                'income': income,
+                'expense': expense,
+                'balance': income - expense
+            } for (year, month, day), (income, expense) in totals.items()])
         
         except ValueError:
             return jsonify({'msg': 'Parámetros year/month deben ser números enteros'}), 400
@@ -61,26 +68,30 @@ class HistoryController:
             return jsonify({'msg': 'Error al obtener historial mensual'}), 500
     
     @jwt_required()
+    @conditional(transactions_fingerprint)
+    @response_cache.cached(YEARLY_HISTORY, date_range=lambda args: HistoryController._history_range(args))
+    @query_budget(4)
     def get_yearly_history(self):
         user_id = get_jwt_identity()
         year = request.args.get('year')
         
         try:
-            with self._session_scope():
-                query = session.query(YearHistory).filter_by(user_id=user_id)
+            query = session.query(YearHistory).filter_by(user_id=user_id)
+            
+            if year:
+                query = query.filter(YearHistory.year == int(year))
                 
-                if year:
-                    query = query.filter(YearHistory.year == int(year))
-                    
-                history = query.order_by(YearHistory.year, YearHistory.month).all()
-                
-                return jsonify([{
-                    'month': h.month,
-                    'year': h.year,
-                    'income': h.income,
-                    'expense': h.expense,
-                    'balance': h.income - h.expense
-                } for h in history])
+            history = query.order_by(YearHistory.year, YearHistory.month).all()
+            _, convert = UserSettingsController._conversion_factors(user_id)
+            totals = self._convert_history(history, lambda h: (h.year, h.month), convert)
+            
+            return jsonify([{
+                'month': month,
+                'year': year,
+                'income': income,
+                'expense': expense,
+                'balance': income - expense
+            } for (year, month), (income, expense) in totals.items()])
         
         except ValueError:
             return jsonify({'msg': 'El parámetro year debe ser un número entero'}), 400
@@ -90,71 +101,72 @@ class HistoryController:
         
 
     @staticmethod
-    def _update_month_history(user_id, date):
-        day_transactions = session.query(Transaction).filter_by(
-            user_id=user_id,
-            date=date
-        ).all()
-
-        month_history = session.query(MonthHistory).filter_by(
-            user_id=user_id,
-            day=date.day,
-            month=date.month,
-            year=date.year
-        ).first()
-
-        if not month_history:
-            month_history = MonthHistory(
-                user_id=user_id,
-                day=date.day,
-                month=date.month,
-                year=date.year,
-                income=0,
-                expense=0
-            )
-            session.add(month_history)
-
-        month_history.income = sum(
-            t.amount for t in day_transactions 
-            if t.kind == TransactionKind.income
+    def _convert_history(history, period, convert):
+        """Suma las filas de un mismo periodo en distintas monedas, convertidas a la moneda del usuario"""
+        totals = {}
+        for h in history:
+            factor = convert(h.currency)
+            income, expense = totals.get(period(h), (0, 0))
+            totals[period(h)] = (income + h.income * factor, expense + h.expense * factor)
+        return totals
+    
+    @staticmethod
+    def _apply_transaction(user_id, date, kind, amount, currency):
+        """Suma (o resta, con una cantidad negativa) una transacción a los historiales del día y del mes"""
+        amount = float(amount)
+        income = amount if kind == TransactionKind.income else 0
+        expense = amount if kind == TransactionKind.expense else 0
+        
+        session.execute(HistoryController._upsert_delta(MonthHistory, ['user_id', 'day', 'month', 'year', 'currency']), {
+            'user_id': user_id,
+            'day': date.day,
+            'month': date.month,
+            'year': date.year,
+            'currency': currency,
+            'income': income,
+            'expense': expense
+        })
+        session.execute(HistoryController._upsert_delta(YearHistory, ['user_id', 'month', 'year', 'currency']), {
+            'user_id': user_id,
+            'month': date.month,
+            'year': date.year,
+            'currency': currency,
+            'income': income,
+            'expense': expense
+        })
+    
+    @staticmethod
+    def _apply_daily_totals(user_id, daily_totals, currency):
+        """Suma a los historiales un DataFrame de totales por día (índice fecha, columnas income y expense)"""
+        if daily_totals.empty:
+            return
+        
+        dates = pd.DatetimeIndex(daily_totals.index)
+        days = pd.DataFrame({
+            'user_id': user_id,
+            'day': dates.day,
+            'month': dates.month,
+            'year': dates.year,
+            'currency': currency,
+            'income': daily_totals['income'].to_numpy(dtype=float),
+            'expense': daily_totals['expense'].to_numpy(dtype=float)
+        })
+        months = days.groupby(['user_id', 'month', 'year', 'currency'], as_index=False)[['income', 'expense']].sum()
+        
+        # Un único executemany por tabla
+        session.execute(
+            HistoryController._upsert_delta(MonthHistory, ['user_id', 'day', 'month', 'year', 'currency']),
+            days.to_dict('records')
         )
-        month_history.expense = sum(
-            t.amount for t in day_transactions 
-            if t.kind == TransactionKind.expense
+        session.execute(
+            HistoryController._upsert_delta(YearHistory, ['user_id', 'month', 'year', 'currency']),
+            months.to_dict('records')
         )
-
+    
     @staticmethod
-    def _update_year_history(user_id, date):
-        first_day = date.replace(day=1)
-        last_day = (first_day + timedelta(days=32)).replace(day=1) - timedelta(days=1)
-
-        month_transactions = session.query(Transaction).filter(
-            Transaction.user_id == user_id,
-            Transaction.date >= first_day,
-            Transaction.date <= last_day
-        ).all()
-
-        year_history = session.query(YearHistory).filter_by(
-            user_id=user_id,
-            month=date.month,
-            year=date.year
-        ).first()
-
-        if not year_history:
-            year_history = YearHistory(
-                user_id=user_id,
-                month=date.month,
-                year=date.year,
-                income=0,
-                expense=0
-            )
-            session.add(year_history)
-
-        year_history.income = sum(
-            t.amount for t in month_transactions 
-            if t.kind == TransactionKind.income
-        )
-        year_history.expense = sum(
-            t.amount for t in month_transactions 
-            if t.kind == TransactionKind.expense
-        )
\ No newline at end of file
+    def _upsert_delta(model, keys):
+        """Upsert que acumula income y expense de forma atómica"""
+        return upsert(model, keys, lambda table, new: {
+            'income': table.c.income + new.income,
+            'expense': table.c.expense + new.expense
+        })
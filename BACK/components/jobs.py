@@ -0,0 +1,294 @@
+import os
+import re
+import json
+import time
+import uuid
+import tempfile
+import threading
+import multiprocessing
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from flask import jsonify, send_file
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from unit_of_work import session_scope
+
+JOB_ID = re.compile(r'[0-9a-f]{32}')
+
+
+class Job:
+    """Estado de un trabajo en segundo plano (importación o exportación).
+
+    El estado se guarda como <id>.json en el directorio de trabajos, compartido por todos
+    los procesos del servidor: cualquiera de ellos puede consultarlo y servir la descarga.
+    La fecha de modificación del archivo hace de latido (JobManager la renueva mientras
+    el trabajo está pendiente o en curso).
+    """
+
+    FIELDS = ('id', 'user_id', 'kind', 'status', 'progress', 'result', 'errors',
+              'file_path', 'upload_path', 'download_name', 'mimetype', 'created_at', 'finished_at')
+    # Segundos mínimos entre dos escrituras del progreso (el estado final se escribe siempre)
+    PROGRESS_INTERVAL = 0.5
+
+    def __init__(self, user_id, kind, directory):
+        self.id = uuid.uuid4().hex
+        self.user_id = str(user_id)
+        self.kind = kind
+        self.status = 'pending'
+        self.progress = {}
+        self.result = None
+        self.errors = None
+        self.file_path = None
+        self.upload_path = None
+        self.download_name = None
+        self.mimetype = None
+        self.created_at = datetime.now()
+        self.finished_at = None
+        self.directory = directory
+        self.saved_at = 0.0
+        self.heartbeat_at = time.time()
+
+    @property
+    def path(self):
+        return os.path.join(self.directory, f'{self.id}.json')
+
+    def update_progress(self, **progress):
+        self.progress = {**self.progress, **progress}
+        if time.monotonic() - self.saved_at >= self.PROGRESS_INTERVAL:
+            self.save()
+
+    def save(self):
+        """Escribe el estado en un temporal y lo sustituye de una vez: nunca se lee un archivo a medias"""
+        state = {field: getattr(self, field) for field in self.FIELDS}
+        state['created_at'] = self.created_at.isoformat()
+        state['finished_at'] = self.finished_at.isoformat() if self.finished_at else None
+        descriptor, temporary = tempfile.mkstemp(dir=self.directory, prefix=f'{self.id}.', suffix='.tmp')
+        with os.fdopen(descriptor, 'w', encoding='utf-8') as output:
+            json.dump(state, output, ensure_ascii=False)
+        os.replace(temporary, self.path)
+        self.saved_at = time.monotonic()
+
+    @classmethod
+    def load(cls, directory, job_id):
+        """Estado guardado del trabajo, o None si no existe (o ya se ha eliminado)"""
+        try:
+            with open(os.path.join(directory, f'{job_id}.json'), encoding='utf-8') as file:
+                state = json.load(file)
+                heartbeat_at = os.fstat(file.fileno()).st_mtime
+        except FileNotFoundError:
+            return None
+
+        job = cls(state['user_id'], state['kind'], directory)
+        for field in cls.FIELDS:
+            setattr(job, field, state.get(field))
+        job.heartbeat_at = heartbeat_at
+        job.created_at = datetime.fromisoformat(state['created_at'])
+        job.finished_at = datetime.fromisoformat(state['finished_at']) if state['finished_at'] else None
+        return job
+
+    @property
+    def unfinished(self):
+        return self.status in ('pending', 'running')
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'progress': self.progress,
+            'result': self.result,
+            'error_count': len(self.errors) if self.errors else 0,
+            'download_ready': self.file_path is not None,
+            'created_at': self.created_at.isoformat(),
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
+
+
+class JobManager:
+    """Ejecuta trabajos pesados en un pool de hilos local y guarda su estado en JOB_DIRECTORY.
+
+    El directorio (estado y archivos de las exportaciones) lo comparten todos los procesos del
+    servidor, de modo que un trabajo se puede consultar desde cualquiera. Las partes en Python
+    puro que retienen el GIL (openpyxl) se delegan con run_in_process a un pool de procesos,
+    que se crea la primera vez que se usa.
+
+    Un proceso que termina (gunicorn los recicla y mata los que no acaban a tiempo) deja sus
+    trabajos sin terminar. Mientras un trabajo está pendiente o en curso, un hilo de latido
+    renueva cada HEARTBEAT_SECONDS la fecha de su archivo de estado; si pasa stale_after sin
+    renovarse, cualquier proceso lo marca como fallido y se purga, con sus archivos, como
+    cualquier otro trabajo terminado.
+    """
+
+    HEARTBEAT_SECONDS = 10
+
+    def __init__(self, max_workers=None, max_processes=None, retention=timedelta(hours=1), directory=None,
+                 stale_after=timedelta(minutes=1)):
+        max_workers = max_workers or int(os.getenv('JOB_WORKERS', os.cpu_count() or 2))
+        self.max_processes = max_processes or int(os.getenv('JOB_PROCESSES', os.cpu_count() or 2))
+        self.directory = directory or os.getenv('JOB_DIRECTORY') or os.path.join(tempfile.gettempdir(), 'trirule-jobs')
+        os.makedirs(self.directory, exist_ok=True)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job')
+        self.processes = None
+        self.retention = retention
+        self.stale_after = stale_after
+        # Trabajos pendientes o en curso en este proceso, cuyo latido renueva el hilo heartbeat
+        self.active = set()
+        self.heartbeat = None
+        self.lock = threading.Lock()
+
+    def submit(self, user_id, kind, func, *args, upload_path=None):
+        """Encola func(job, *args); upload_path (la subida que lee el trabajo) se elimina al terminar"""
+        self._purge_expired()
+        job = Job(user_id, kind, self.directory)
+        job.upload_path = upload_path
+        job.save()
+        with self.lock:
+            self.active.add(job.id)
+            # Se crea en el primer trabajo: los hilos no sobreviven al fork de los procesos de gunicorn
+            if self.heartbeat is None:
+                self.heartbeat = threading.Thread(target=self._beat, name='job-heartbeat', daemon=True)
+                self.heartbeat.start()
+        self.executor.submit(self._run, job, func, args)
+        return job
+
+    def temporary_file(self, suffix, job=None):
+        """Archivo de un trabajo (subida o exportación) en el directorio compartido.
+
+        Con job el nombre empieza por el id del trabajo y la purga lo elimina aunque el trabajo
+        se interrumpa antes de anotarlo en su estado.
+        """
+        prefix = f'{job.id}.' if job else 'upload.'
+        return tempfile.NamedTemporaryFile(delete=False, prefix=prefix, suffix=suffix, dir=self.directory)
+
+    def run_in_process(self, func, *args):
+        """Ejecuta func(*args) en el pool de procesos y espera el resultado (func debe poder importarse)"""
+        with self.lock:
+            if self.processes is None:
+                # spawn: un fork desde un proceso con hilos puede heredar bloqueos tomados
+                self.processes = ProcessPoolExecutor(
+                    max_workers=self.max_processes, mp_context=multiprocessing.get_context('spawn')
+                )
+        return self.processes.submit(func, *args).result()
+
+    def get(self, user_id, job_id):
+        # El id forma parte del nombre del archivo: solo se aceptan ids generados por submit
+        if not JOB_ID.fullmatch(job_id):
+            return None
+        job = Job.load(self.directory, job_id)
+        if not job or job.user_id != str(user_id):
+            return None
+        self._fail_if_abandoned(job)
+        return job
+
+    def _beat(self):
+        while True:
+            time.sleep(self.HEARTBEAT_SECONDS)
+            with self.lock:
+                active = list(self.active)
+            for job_id in active:
+                try:
+                    os.utime(os.path.join(self.directory, f'{job_id}.json'))
+                except FileNotFoundError:
+                    pass
+
+    def _fail_if_abandoned(self, job):
+        """Marca como fallido un trabajo sin terminar cuyo latido ha caducado (su proceso ya no existe)"""
+        with self.lock:
+            if job.id in self.active:
+                return
+        if not job.unfinished or time.time() - job.heartbeat_at <= self.stale_after.total_seconds():
+            return
+        job.status = 'failed'
+        job.result = job.result or {'msg': 'El trabajo se interrumpió al terminar el proceso que lo ejecutaba'}
+        job.finished_at = datetime.now()
+        job.save()
+
+    def _run(self, job, func, args):
+        job.status = 'running'
+        job.save()
+        try:
+            # Cada trabajo es una unidad de trabajo propia, con su sesión en el hilo del pool
+            with session_scope():
+                func(job, *args)
+            job.status = 'finished' if job.status == 'running' else job.status
+        except Exception as e:
+            print(f"Error en el trabajo {job.id} ({job.kind}): {e}")
+            job.status = 'failed'
+            job.result = job.result or {'msg': 'Error al procesar el trabajo'}
+        finally:
+            job.finished_at = datetime.now()
+            try:
+                job.save()
+            except Exception as e:
+                print(f"Error al guardar el estado del trabajo {job.id}: {e}")
+            with self.lock:
+                self.active.discard(job.id)
+            _remove_files(job.upload_path)
+
+    def _purge_expired(self):
+        """Elimina el estado y los archivos de los trabajos terminados hace más de retention, de cualquier proceso"""
+        limit = datetime.now() - self.retention
+        for name in os.listdir(self.directory):
+            job_id, extension = os.path.splitext(name)
+            if extension != '.json' or not JOB_ID.fullmatch(job_id):
+                continue
+            job = Job.load(self.directory, job_id)
+            if not job:
+                continue
+            self._fail_if_abandoned(job)
+            if not job.finished_at or job.finished_at >= limit:
+                continue
+            _remove_files(job.file_path, job.upload_path)
+            # Estado, temporales y archivos a medio escribir del trabajo
+            _remove_files(*(os.path.join(self.directory, other) for other in os.listdir(self.directory)
+                            if other.startswith(f'{job.id}.')))
+
+
+def _remove_files(*paths):
+    """Elimina los archivos que existan, con el de bloques intermedio (<ruta>.chunks) de un trabajo interrumpido"""
+    for path in paths:
+        if not path:
+            continue
+        for candidate in (path, f'{path}.chunks'):
+            # Otro proceso puede estar purgando a la vez
+            try:
+                os.remove(candidate)
+            except FileNotFoundError:
+                pass
+
+
+class JobController:
+    def __init__(self, app, job_manager):
+        self.app = app
+        self.jobs = job_manager
+        self._register_routes()
+
+    def _register_routes(self):
+        # Estado y progreso de un trabajo
+        self.app.add_url_rule('/jobs/<job_id>', view_func=self.get_job, methods=['GET'])
+        # Errores por fila de una importación
+        self.app.add_url_rule('/jobs/<job_id>/errors', view_func=self.get_job_errors, methods=['GET'])
+        # Descargar el archivo de una exportación
+        self.app.add_url_rule('/jobs/<job_id>/download', view_func=self.download_job, methods=['GET'])
+
+    @jwt_required()
+    def get_job(self, job_id):
+        job = self.jobs.get(get_jwt_identity(), job_id)
+        if not job:
+            return jsonify({'msg': 'Trabajo no encontrado'}), 404
+        return jsonify(job.to_dict())
+
+    @jwt_required()
+    def get_job_errors(self, job_id):
+        job = self.jobs.get(get_jwt_identity(), job_id)
+        if not job:
+            return jsonify({'msg': 'Trabajo no encontrado'}), 404
+        return jsonify({'errors': job.errors or []})
+
+    @jwt_required()
+    def download_job(self, job_id):
+        job = self.jobs.get(get_jwt_identity(), job_id)
+        if not job:
+            return jsonify({'msg': 'Trabajo no encontrado'}), 404
+        if job.status != 'finished' or not job.file_path:
+            return jsonify({'msg': 'El archivo todavía no está disponible', 'status': job.status}), 409
+        return send_file(job.file_path, mimetype=job.mimetype, as_attachment=True, download_name=job.download_name)
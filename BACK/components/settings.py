@@ -1,9 +1,13 @@
 import re
 from flask import jsonify, request
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from models import session, UserSettings, User, Transaction
-from contextlib import contextmanager
-import bcrypt
+from models import session, UserSettings, User, Transaction, ExchangeRate, DEFAULT_CURRENCY, upsert
+from datetime import datetime
+from sqlalchemy import case
+from cache import response_cache
+from etags import bump_versions
+from passwords import password_hasher, PasswordHasherBusy
+from query_audit import query_budget
 
 class UserSettingsController:
     def __init__(self, app):
@@ -20,37 +24,26 @@ class UserSettingsController:
         self.app.add_url_rule('/settings/profile', view_func=self.update_profile, methods=['PUT'])
         # Actualizar contraseña
         self.app.add_url_rule('/settings/password', view_func=self.update_password, methods=['PUT'])
-
-    @contextmanager
-    def _session_scope(self):
-        """Proporciona un contexto transaccional para la sesión."""
-        try:
-            yield session
-            session.commit()
-        except Exception as e:
-            session.rollback()
-            raise e
-        finally:
-            session.remove()
     
     @jwt_required()
+    @query_budget(1)
     def get_settings(self):
         user_id = get_jwt_identity()
         try:
-            with self._session_scope():
-                settings = session.query(UserSettings).filter_by(user_id=user_id).first()
+            settings = session.query(UserSettings).filter_by(user_id=user_id).first()
+            
+            if not settings:
+                return jsonify({'msg': 'Configuración no encontrada'}), 404
                 
-                if not settings:
-                    return jsonify({'msg': 'Configuración no encontrada'}), 404
-                    
-                return jsonify({
-                    'currency': settings.currency
-                })
+            return jsonify({
+                'currency': settings.currency
+            })
         except Exception as e:
             print(f"Error al obtener configuración: {e}")
             return jsonify({'msg': 'Error al obtener configuración'}), 500
     
     @jwt_required()
+    @query_budget(7)
     def update_settings(self):
         user_id = get_jwt_identity()
         data = request.get_json()
@@ -59,40 +52,79 @@ class UserSettingsController:
             return jsonify({'msg': 'El campo currency es requerido'}), 400
         
         try:
-            with self._session_scope():
-                # Obtener la configuración actual del usuario
-                settings = session.query(UserSettings).filter_by(user_id=user_id).first()
-                old_currency = settings.currency if settings else 'EUR'
-                new_currency = data.get('currency', old_currency)
-                
-                # Si hay cambio de moneda y se proporciona un factor de conversión
-                if 'conversion_rate' in data and old_currency != new_currency:
-                    conversion_rate = float(data['conversion_rate'])
-                    
-                    # Actualizar todos los montos de las transacciones
-                    transactions = session.query(Transaction).filter_by(user_id=user_id).all()
-                    for transaction in transactions:
-                        transaction.amount = round(transaction.amount * conversion_rate, 2)
+            # Obtener la configuración actual del usuario
+            settings = session.query(UserSettings).filter_by(user_id=user_id).first()
+            old_currency = settings.currency if settings else DEFAULT_CURRENCY
+            new_currency = data.get('currency', old_currency)
+            
+            # Las cantidades no se reescriben: se guarda el tipo de cambio y se convierte al leer
+            if 'conversion_rate' in data and old_currency != new_currency:
+                conversion_rate = float(data['conversion_rate'])
+                old_rate = session.query(ExchangeRate.rate).filter_by(user_id=user_id, currency=old_currency).scalar()
+                now = datetime.now()
                 
-                # Actualizar o crear la configuración
-                if not settings:
-                    settings = UserSettings(
-                        user_id=user_id, 
-                        currency=new_currency
-                    )
-                    session.add(settings)
-                else:
-                    settings.currency = new_currency
-                                
-                return jsonify({
-                    'msg': 'Configuración y transacciones actualizadas',
-                    'settings': {
-                        'currency': settings.currency
-                    }
-                })
+                # Upserts: dos peticiones simultáneas no chocan al crear la misma fila
+                if old_rate is None:
+                    old_rate = 1.0
+                    session.execute(upsert(ExchangeRate, ['user_id', 'currency'], lambda table, new: {
+                        'rate': table.c.rate
+                    }), {'user_id': user_id, 'currency': old_currency, 'rate': old_rate, 'updated_at': now})
+                session.execute(upsert(ExchangeRate, ['user_id', 'currency'], lambda table, new: {
+                    'rate': new.rate, 'updated_at': new.updated_at
+                }), {'user_id': user_id, 'currency': new_currency, 'rate': old_rate * conversion_rate, 'updated_at': now})
+            
+            # Actualizar o crear la configuración
+            if not settings:
+                settings = UserSettings(
+                    user_id=user_id, 
+                    currency=new_currency
+                )
+                session.add(settings)
+            else:
+                settings.currency = new_currency
+            
+            # La moneda cambia la conversión de resúmenes e historiales
+            response_cache.invalidate_on_commit(session, user_id)
+            bump_versions(user_id, UserSettings.transactions_version)
+                            
+            return jsonify({
+                'msg': 'Configuración actualizada',
+                'settings': {
+                    'currency': settings.currency
+                }
+            })
         except Exception as e:
             print(f"Error al actualizar configuración: {e}")
             return jsonify({'msg': 'Error al actualizar configuración'}), 500
+    
+    @staticmethod
+    def _exchange_rates(user_id):
+        """Moneda del usuario y sus tipos de cambio registrados (moneda -> tipo)"""
+        currency = session.query(UserSettings.currency).filter_by(user_id=user_id).scalar() or DEFAULT_CURRENCY
+        rates = dict(session.query(ExchangeRate.currency, ExchangeRate.rate).filter_by(user_id=user_id).all())
+        return currency, rates
+    
+    @staticmethod
+    def _conversion_factors(user_id):
+        """Moneda del usuario y función que da el factor para convertir a ella desde otra moneda"""
+        currency, rates = UserSettingsController._exchange_rates(user_id)
+        target_rate = rates.get(currency, 1.0)
+        return currency, lambda source: target_rate / rates.get(source, 1.0)
+    
+    @staticmethod
+    def _converted_amount(user_id):
+        """Moneda del usuario y expresión SQL con Transaction.amount convertida a ella"""
+        currency, rates = UserSettingsController._exchange_rates(user_id)
+        target_rate = rates.get(currency, 1.0)
+        if not rates:
+            return currency, Transaction.amount
+        
+        factor = case(
+            {source: target_rate / rate for source, rate in rates.items()},
+            value=Transaction.currency,
+            else_=target_rate
+        )
+        return currency, Transaction.amount * factor
         
     @jwt_required()
     def update_profile(self):
@@ -108,37 +140,36 @@ class UserSettingsController:
             return jsonify({'msg': 'Se requiere al menos uno de los campos: username o email'}), 400
         
         try:
-            with self._session_scope():
-                user = session.query(User).filter_by(id=user_id).first()
-                if not user:
-                    return jsonify({'msg': 'Usuario no encontrado'}), 404
-                
-                updated_fields = {}
-                if len(data['username']) > self.MAX_USERNAME_LENGTH:
-                    return jsonify({'msg': f'El nombre de usuario no puede exceder los {self.MAX_USERNAME_LENGTH} caracteres ({len(data['username'])})'}), 400
-                
-                if 'username' in data and data['username']:
-                    user.username = data['username']
-                    updated_fields['username'] = user.username
-                
-                if 'email' in data and data['email']:
-                    existing_user = session.query(User).filter(
-                        User.email == data['email'],
-                        User.id != user_id
-                    ).first()
-                    if existing_user:
-                        return jsonify({'msg': 'El email ya está en uso por otro usuario'}), 400
-                    user.email = data['email']
-                    updated_fields['email'] = user.email
-                
-                if not updated_fields:
-                    return jsonify({'msg': 'No se proporcionaron campos válidos para actualizar'}), 400
-                
-                return jsonify({
-                    'msg': 'Perfil actualizado correctamente',
-                    'updated_fields': updated_fields
-                })
-                
+            user = session.query(User).filter_by(id=user_id).first()
+            if not user:
+                return jsonify({'msg': 'Usuario no encontrado'}), 404
+            
+            updated_fields = {}
+            if len(data['username']) > self.MAX_USERNAME_LENGTH:
+                return jsonify({'msg': f'El nombre de usuario no puede exceder los {self.MAX_USERNAME_LENGTH} caracteres ({len(data['username'])})'}), 400
+            
+            if 'username' in data and data['username']:
+                user.username = data['username']
+                updated_fields['username'] = user.username
+            
+            if 'email' in data and data['email']:
+                existing_user = session.query(User).filter(
+                    User.email == data['email'],
+                    User.id != user_id
+                ).first()
+                if existing_user:
+                    return jsonify({'msg': 'El email ya está en uso por otro usuario'}), 400
+                user.email = data['email']
+                updated_fields['email'] = user.email
+            
+            if not updated_fields:
+                return jsonify({'msg': 'No se proporcionaron campos válidos para actualizar'}), 400
+            
+            return jsonify({
+                'msg': 'Perfil actualizado correctamente',
+                'updated_fields': updated_fields
+            })
+            
         except Exception as e:
             print(f"Error al actualizar perfil: {e}")
             return jsonify({'msg': 'Error al actualizar perfil'}), 500
@@ -232,31 +263,33 @@ class UserSettingsController:
             }), 400
         
         try:
-            with self._session_scope() as session:
-                user = session.query(User).filter_by(id=user_id).first()
-                if not user:
-                    return jsonify({'msg': 'Usuario no encontrado'}), 404
-                
-                # Verificar contraseña actual
-                if not bcrypt.checkpw(current_password.encode('utf-8'), user.password.encode('utf-8')):
-                    return jsonify({'msg': 'La contraseña actual es incorrecta'}), 401
-                
-                # Hashear nueva contraseña
-                hashed_password = bcrypt.hashpw(new_password.encode('utf-8'), bcrypt.gensalt())
-                user.password = hashed_password.decode('utf-8')
-                
-                return jsonify({
-                    'msg': 'Contraseña actualizada correctamente',
-                    'validation': {
-                        'length': True,
-                        'lowercase': True,
-                        'number': True,
-                        'specialChar': True,
-                        'passwordsMatch': True,
-                        'notSameAsCurrent': True
-                    }
-                }), 200
-                
+            user = session.query(User).filter_by(id=user_id).first()
+            if not user:
+                return jsonify({'msg': 'Usuario no encontrado'}), 404
+            
+            # Verificar contraseña actual
+            if not password_hasher.check(current_password, user.password):
+                return jsonify({'msg': 'La contraseña actual es incorrecta'}), 401
+            
+            # Hashear nueva contraseña
+            user.password = password_hasher.hash(new_password)
+            
+            return jsonify({
+                'msg': 'Contraseña actualizada correctamente',
+                'validation': {
+                    'length': True,
+                    'lowercase': True,
+                    'number': True,
+                    'specialChar': True,
+                    'passwordsMatch': True,
+                    'notSameAsCurrent': True
+                }
+            }), 200
+            
+        except PasswordHasherBusy:
+            response = jsonify({'msg': 'Servidor ocupado, inténtalo de nuevo en unos segundos'})
+            response.headers['Retry-After'] = '1'
+            return response, 503
         except Exception as e:
             print(f"Error al actualizar contraseña: {e}")
             return jsonify({'msg': 'Error al actualizar contraseña'}), 500
\ No newline at end of file
@@ -1,17 +1,73 @@
-from flask import jsonify, request, send_file
+from flask import g, jsonify, request, Response, stream_with_context
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from datetime import datetime
-from models import session, Category, Transaction, TransactionKind, CategoryType
-from contextlib import contextmanager
-from sqlalchemy import func
+from datetime import datetime, timedelta
+from models import session, Category, Transaction, TransactionKind, CategoryType, UserSettings, TransactionTombstone
+from sqlalchemy import func, or_, and_, cast, String, insert
 from components.history import HistoryController
-from io import BytesIO
+from components.settings import UserSettingsController
+from cache import response_cache, SUMMARY, CATEGORIES, TRANSACTION_SCOPES
+from etags import conditional, bump_versions, transactions_fingerprint, transactions_version
+from category_directory import category_directory
+from query_audit import query_budget
+from serialization import columnar, dumps
+from spreadsheets import read_xlsx_chunks, write_xlsx, write_chunk_file, read_chunk_file, xlsx_to_chunk_file, chunk_file_to_xlsx
+from io import StringIO
+from itertools import islice
+from tempfile import TemporaryFile
 import pandas as pd
-from werkzeug.utils import secure_filename
+import pyarrow as pa
+import pyarrow.parquet as pq
 import random
+import os
+import base64
+import csv
+import json
+import time
+
 class TransactionController:
-    def __init__(self, app):
+    # Columnas de la exportación, en orden
+    EXPORT_COLUMNS = [
+        'Fecha', 'Descripción', 'Categoría', 'Color Categoría', 'Tipo Categoría',
+        'Tipo Transacción', 'Cantidad', 'Creado', 'Actualizado'
+    ]
+
+    # Mismas columnas que la exportación, con tipos nativos y diccionario en las de pocos valores
+    PARQUET_SCHEMA = pa.schema([
+        ('Fecha', pa.date32()),
+        ('Descripción', pa.string()),
+        ('Categoría', pa.dictionary(pa.int32(), pa.string())),
+        ('Color Categoría', pa.dictionary(pa.int32(), pa.string())),
+        ('Tipo Categoría', pa.dictionary(pa.int8(), pa.string())),
+        ('Tipo Transacción', pa.dictionary(pa.int8(), pa.string())),
+        ('Cantidad', pa.float64()),
+        ('Creado', pa.timestamp('us')),
+        ('Actualizado', pa.timestamp('us'))
+    ])
+
+    # Columnas por las que se puede ordenar el listado paginado
+    # (amount se sustituye por la cantidad convertida a la moneda del usuario; kind se ordena como texto
+    # porque el ENUM nativo de MySQL ordena por orden de declaración y el cursor compara cadenas)
+    SORT_COLUMNS = {
+        'date': Transaction.date,
+        'amount': Transaction.amount,
+        'description': func.coalesce(Transaction.description, ''),
+        'kind': cast(Transaction.kind, String),
+        'category': func.coalesce(Category.name, '')
+    }
+
+    # Columnas de la respuesta ?format=columnar, como listas paralelas
+    COLUMNAR_COLUMNS = ('id', 'amount', 'date', 'kind', 'category_id', 'description')
+
+    def __init__(self, app, job_manager):
         self.app = app
+        self.jobs = job_manager
+        self.DEFAULT_PAGE_SIZE = 50
+        self.MAX_PAGE_SIZE = 500
+        self.IMPORT_CHUNK_SIZE = 5000
+        self.EXPORT_BATCH_SIZE = 1000
+        self.EXPORT_WIDTH_SAMPLE = 1000
+        self.PARQUET_ROW_GROUP_SIZE = 100000
+        self.TOMBSTONE_RETENTION_DAYS = 30
         self._register_routes()
     
     def _register_routes(self):
@@ -27,56 +83,202 @@ class TransactionController:
         self.app.add_url_rule('/transactions/<int:transaction_id>', view_func=self.delete_transaction, methods=['DELETE'])
         # Recuperar resumen de transacciones
         self.app.add_url_rule('/transactions/summary', view_func=self.get_transactions_summary, methods=['GET'])
+        # Cambios desde la última sincronización
+        self.app.add_url_rule('/transactions/changes', view_func=self.get_transaction_changes, methods=['GET'])
         # Exportar
         self.app.add_url_rule('/transactions/export', view_func=self.export_transactions, methods=['GET'])
         # Importar
         self.app.add_url_rule('/transactions/import', view_func=self.import_transactions, methods=['POST'])
-
-    @contextmanager
-    def _session_scope(self):
-        """Provides transactional scope around a series of operations."""
-        try:
-            yield session
-            session.commit()
-        except Exception as e:
-            session.rollback()
-            raise e
-        finally:
-            session.remove()
     
     @jwt_required()
+    @conditional(transactions_fingerprint)
+    @query_budget(6)
     def get_transactions(self):
         user_id = get_jwt_identity()
         try:
-            with self._session_scope():
-                # Obtenemos todas las transacciones del usuario
-                transactions = session.query(Transaction).filter_by(user_id=user_id).all()
-                
-                # Obtenemos todas las categorías del usuario para evitar N+1 queries
-                categories = session.query(Category).filter_by(user_id=user_id).all()
-                categories_dict = {cat.id: cat for cat in categories}
-                
-                return jsonify([{
-                    'id': t.id,
-                    'amount': t.amount,
-                    'description': t.description,
-                    'date': t.date.isoformat(),
-                    'kind': t.kind.value,
-                    'category': {
-                        'id': categories_dict[t.category_id].id,
-                        'name': categories_dict[t.category_id].name,
-                        'color': categories_dict[t.category_id].color,
-                        'type': categories_dict[t.category_id].type.value,
-                        'created_at': categories_dict[t.category_id].created_at.isoformat()
-                    } if t.category_id and t.category_id in categories_dict else None,
-                    'created_at': t.created_at.isoformat(),
-                    'updated_at': t.updated_at.isoformat()
-                } for t in transactions])
+            _, amount = UserSettingsController._converted_amount(user_id)
+            query = self._build_transactions_query(user_id, request.args, amount)
+            categories = category_directory.get(user_id)
+            
+            response_format = request.args.get('format', 'json')
+            if response_format not in ('json', 'columnar'):
+                raise ValueError('Formato inválido')
+            serialize = self._columnar_transactions if response_format == 'columnar' else self._serialize_transactions
+            
+            # Sin parámetros se mantiene la respuesta clásica con todas las transacciones
+            if not request.args.keys() - {'format'}:
+                return jsonify(serialize(self._fetch_rows(query), categories))
+            
+            limit = min(int(request.args.get('limit', self.DEFAULT_PAGE_SIZE)), self.MAX_PAGE_SIZE)
+            if limit < 1:
+                raise ValueError('limit debe ser mayor que 0')
+            
+            sort_by = request.args.get('sort_by', 'date')
+            sort_order = request.args.get('sort_order', 'desc')
+            if sort_by not in self.SORT_COLUMNS or sort_order not in ('asc', 'desc'):
+                raise ValueError('Ordenación inválida')
+            
+            # El total solo se calcula si se pide expresamente (requiere un COUNT aparte)
+            total = None
+            if request.args.get('include_total', '').lower() in ('1', 'true'):
+                total = query.with_entities(func.count(Transaction.id)).scalar()
+            
+            sort_column = amount if sort_by == 'amount' else self.SORT_COLUMNS[sort_by]
+            descending = sort_order == 'desc'
+            
+            # Paginación por cursor (keyset): continuar tras el último (valor, id) devuelto
+            cursor = request.args.get('cursor')
+            if cursor:
+                last_value, last_id = self._decode_cursor(cursor, sort_by)
+                if descending:
+                    query = query.filter(or_(
+                        sort_column < last_value,
+                        and_(sort_column == last_value, Transaction.id < last_id)
+                    ))
+                else:
+                    query = query.filter(or_(
+                        sort_column > last_value,
+                        and_(sort_column == last_value, Transaction.id > last_id)
+                    ))
+            
+            if descending:
+                query = query.order_by(sort_column.desc(), Transaction.id.desc())
+            else:
+                query = query.order_by(sort_column.asc(), Transaction.id.asc())
+            
+            # Se pide una fila de más para saber si existe una página siguiente
+            rows = self._fetch_rows(query.limit(limit + 1))
+            next_cursor = None
+            if len(rows) > limit:
+                rows = rows[:limit]
+                next_cursor = self._encode_cursor(sort_by, self._sort_value(sort_by, rows[-1]), rows[-1].id)
+            
+            return jsonify({
+                'transactions': serialize(rows, categories),
+                'next_cursor': next_cursor,
+                'total': total
+            })
+        except ValueError:
+            return jsonify({'msg': 'Parámetros de consulta inválidos'}), 400
         except Exception as e:
             print(f"Error al recuperar transacciones: {e}")
             return jsonify({'msg': 'Error al obtener transacciones'}), 500
     
+    def _build_transactions_query(self, user_id, args, amount):
+        """Construye la consulta de transacciones con su cantidad convertida aplicando los filtros en SQL.
+
+        Se leen columnas en lugar de entidades del ORM: las filas son tuplas que se serializan directamente.
+        Los datos de la categoría se añaden desde el directorio de categorías del usuario.
+        """
+        query = session.query(
+            Transaction.id,
+            amount.label('amount'),
+            Transaction.amount.label('original_amount'),
+            Transaction.currency.label('original_currency'),
+            Transaction.description,
+            Transaction.date,
+            Transaction.kind,
+            Transaction.category_id,
+            Transaction.created_at,
+            Transaction.updated_at
+        ).filter(Transaction.user_id == user_id)
+        
+        # El JOIN con category solo hace falta para buscar u ordenar por el nombre de la categoría
+        search = args.get('search', '').strip()
+        if search or args.get('sort_by') == 'category':
+            query = query.outerjoin(
+                Category, Transaction.category_id == Category.id
+            ).add_columns(Category.name.label('category_name'))
+        
+        if args.get('kind'):
+            query = query.filter(Transaction.kind == TransactionKind(args['kind']))
+        if args.get('category'):
+            query = query.filter(Transaction.category_id == int(args['category']))
+        if args.get('date_from'):
+            query = query.filter(Transaction.date >= datetime.strptime(args['date_from'], '%Y-%m-%d').date())
+        if args.get('date_to'):
+            query = query.filter(Transaction.date <= datetime.strptime(args['date_to'], '%Y-%m-%d').date())
+        
+        if search:
+            query = query.filter(or_(
+                Transaction.description.icontains(search, autoescape=True),
+                Category.name.icontains(search, autoescape=True),
+                cast(func.round(amount, 2), String).contains(search, autoescape=True)
+            ))
+        
+        return query
+    
+    @staticmethod
+    def _fetch_rows(query):
+        """Ejecuta la consulta con Core: tuplas de la base de datos sin la capa de carga del ORM"""
+        return session.connection().execute(query.statement).all()
+    
+    @staticmethod
+    def _sort_value(sort_by, row):
+        """Valor de ordenación de una fila, tal y como se guarda en el cursor"""
+        if sort_by == 'date':
+            return row.date.isoformat()
+        if sort_by == 'amount':
+            return row.amount
+        if sort_by == 'description':
+            return row.description or ''
+        if sort_by == 'kind':
+            return row.kind.value
+        return row.category_name or ''
+    
+    @staticmethod
+    def _encode_cursor(sort_by, value, transaction_id):
+        payload = json.dumps([sort_by, value, transaction_id]).encode('utf-8')
+        return base64.urlsafe_b64encode(payload).decode('ascii')
+    
+    @staticmethod
+    def _decode_cursor(cursor, sort_by):
+        try:
+            cursor_sort_by, value, transaction_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        except Exception:
+            raise ValueError('Cursor inválido')
+        
+        if cursor_sort_by != sort_by:
+            raise ValueError('El cursor no corresponde a la ordenación solicitada')
+        
+        if sort_by == 'date':
+            value = datetime.strptime(value, '%Y-%m-%d').date()
+        elif sort_by == 'kind':
+            value = TransactionKind(value).value
+        return value, int(transaction_id)
+    
+    @staticmethod
+    def _serialize_transactions(rows, categories):
+        # Fechas y Enum se dejan tal cual: los codifica orjson (ver serialization.py)
+        return [{
+            'id': row.id,
+            'amount': row.amount,
+            'original_amount': row.original_amount,
+            'original_currency': row.original_currency,
+            'description': row.description,
+            'date': row.date,
+            'kind': row.kind,
+            'category': categories.payloads.get(row.category_id),
+            'created_at': row.created_at,
+            'updated_at': row.updated_at
+        } for row in rows]
+    
+    def _columnar_transactions(self, rows, categories):
+        """Listas paralelas por columna y cada categoría una sola vez, indexada por id"""
+        used = {row.category_id for row in rows} & categories.by_id.keys()
+        return {
+            'columns': columnar(rows, self.COLUMNAR_COLUMNS),
+            'categories': {
+                category_id: {
+                    'name': categories.by_id[category_id].name,
+                    'color': categories.by_id[category_id].color,
+                    'type': categories.by_id[category_id].type
+                } for category_id in used
+            }
+        }
+    
     @jwt_required()
+    @query_budget(8)
     def create_transaction(self):
         user_id = get_jwt_identity()
         data = request.get_json()
@@ -87,224 +289,354 @@ class TransactionController:
             return jsonify({'msg': 'Tipo de transacción inválido'}), 400
         
         try:
-            with self._session_scope():
-                category_id = data.get('category_id')
-                if category_id:
-                    category = session.query(Category).filter_by(id=category_id, user_id=user_id).first()
-                    if not category:
-                        return jsonify({'msg': 'Categoría no encontrada'}), 404
-                
-                # Convertir la fecha a objeto date
-                transaction_date = datetime.strptime(data['date'], '%Y-%m-%d').date()
-                
-                transaction = Transaction(
-                    amount=data['amount'],
-                    description=data.get('description'),
-                    date=transaction_date,
-                    kind=transaction_kind,
-                    category_id=category_id,
-                    user_id=user_id
-                )
-                
-                session.add(transaction)
-                
-                # Actualizar los historiales
-                HistoryController._update_month_history(user_id, transaction_date)
-                HistoryController._update_year_history(user_id, transaction_date)
-                
-                return jsonify({
-                    'msg': 'Transacción creada',
-                    'transaction': {
-                        'id': transaction.id,
-                        'amount': transaction.amount,
-                        'description': transaction.description,
-                        'date': transaction.date.isoformat(),
-                        'kind': transaction.kind.value,
-                        'category_id': transaction.category_id
-                    }
-                }), 201
+            category_id = data.get('category_id')
+            if category_id:
+                category = category_directory.get(user_id).get(category_id)
+                if not category:
+                    return jsonify({'msg': 'Categoría no encontrada'}), 404
+            
+            # Convertir la fecha a objeto date
+            transaction_date = datetime.strptime(data['date'], '%Y-%m-%d').date()
+            
+            # La cantidad se guarda en la moneda que el usuario tiene configurada en este momento
+            currency, _ = UserSettingsController._exchange_rates(user_id)
+            
+            # La versión se incrementa antes de insertar para marcar la fila con la nueva
+            bump_versions(user_id, UserSettings.transactions_version)
+            transaction = Transaction(
+                amount=data['amount'],
+                currency=currency,
+                description=data.get('description'),
+                date=transaction_date,
+                kind=transaction_kind,
+                category_id=category_id,
+                user_id=user_id,
+                sync_version=transactions_version(user_id)
+            )
+            
+            session.add(transaction)
+            session.flush()  # Asegurarse de que el ID se genere
+            
+            # Sumar la transacción a los historiales
+            HistoryController._apply_transaction(user_id, transaction_date, transaction_kind, transaction.amount, currency)
+            response_cache.invalidate_on_commit(session, user_id, TRANSACTION_SCOPES, transaction_date, transaction_date)
+            
+            return jsonify({
+                'msg': 'Transacción creada',
+                'transaction': {
+                    'id': transaction.id,
+                    'amount': transaction.amount,
+                    'currency': transaction.currency,
+                    'description': transaction.description,
+                    'date': transaction.date.isoformat(),
+                    'kind': transaction.kind.value,
+                    'category_id': transaction.category_id
+                }
+            }), 201
         except Exception as e:
             print(f"Error al crear transacción: {e}")
             return jsonify({'msg': 'Error al crear transacción'}), 500
     
     @jwt_required()
+    @query_budget(3)
     def get_transaction(self, transaction_id):
         user_id = get_jwt_identity()
         try:
-            with self._session_scope():
-                transaction = session.query(Transaction).filter_by(id=transaction_id, user_id=user_id).first()
+            transaction = session.query(Transaction).filter_by(id=transaction_id, user_id=user_id).first()
+            
+            if not transaction:
+                return jsonify({'msg': 'Transacción no encontrada'}), 404
+            
+            _, convert = UserSettingsController._conversion_factors(user_id)
                 
-                if not transaction:
-                    return jsonify({'msg': 'Transacción no encontrada'}), 404
-                    
-                return jsonify({
-                    'id': transaction.id,
-                    'amount': transaction.amount,
-                    'description': transaction.description,
-                    'date': transaction.date.isoformat(),
-                    'kind': transaction.kind.value,
-                    'category_id': transaction.category_id,
-                    'created_at': transaction.created_at.isoformat(),
-                    'updated_at': transaction.updated_at.isoformat()
-                })
+            return jsonify({
+                'id': transaction.id,
+                'amount': transaction.amount * convert(transaction.currency),
+                'original_amount': transaction.amount,
+                'original_currency': transaction.currency,
+                'description': transaction.description,
+                'date': transaction.date.isoformat(),
+                'kind': transaction.kind.value,
+                'category_id': transaction.category_id,
+                'created_at': transaction.created_at.isoformat(),
+                'updated_at': transaction.updated_at.isoformat()
+            })
         except Exception as e:
             print(f"Error al obtener transación: {e}")
             return jsonify({'msg': 'Error al obtener transacción'}), 500
     
     @jwt_required()
+    @query_budget(12)
     def update_transaction(self, transaction_id):
         user_id = get_jwt_identity()
         data = request.get_json()
         
         try:
-            with self._session_scope():
-                transaction = session.query(Transaction).filter_by(id=transaction_id, user_id=user_id).first()
-                
-                if not transaction:
-                    return jsonify({'msg': 'Transacción no encontrada'}), 404
-                
-                if 'amount' in data:
-                    transaction.amount = data['amount']
-                if 'description' in data:
-                    transaction.description = data['description']
-                if 'date' in data:
-                    transaction.date = datetime.strptime(data['date'], '%Y-%m-%d').date()
-                if 'kind' in data:
-                    try:
-                        transaction.kind = TransactionKind(data['kind'])
-                    except ValueError:
-                        return jsonify({'msg': 'Tipo de transacción inválido'}), 400
-                if 'category_id' in data:
-                    category_id = data['category_id']
-                    if category_id:
-                        category = session.query(Category).filter_by(id=category_id, user_id=user_id).first()
-                        if not category:
-                            return jsonify({'msg': 'Categoría no encontrada'}), 404
-                    transaction.category_id = category_id
-                
-                return jsonify({
-                    'msg': 'Transacción actualizada',
-                    'transaction': {
-                        'id': transaction.id,
-                        'amount': transaction.amount,
-                        'description': transaction.description,
-                        'date': transaction.date.isoformat(),
-                        'kind': transaction.kind.value,
-                        'category_id': transaction.category_id
-                    }
-                })
-                
+            # Bloqueo de la fila: otra petición simultánea no puede restar los mismos valores previos
+            transaction = session.query(Transaction).filter_by(
+                id=transaction_id, user_id=user_id
+            ).with_for_update().first()
+            
+            if not transaction:
+                return jsonify({'msg': 'Transacción no encontrada'}), 404
+            
+            # La versión se incrementa antes de modificar la fila, que se guarda marcada con la nueva
+            bump_versions(user_id, UserSettings.transactions_version)
+            transaction.sync_version = transactions_version(user_id)
+            
+            # Valores previos para corregir los historiales si cambian
+            old_amount, old_date, old_kind = transaction.amount, transaction.date, transaction.kind
+            old_currency, old_category_id = transaction.currency, transaction.category_id
+            
+            # Una cantidad nueva se introduce en la moneda actual del usuario
+            if 'amount' in data:
+                transaction.amount = data['amount']
+                transaction.currency, _ = UserSettingsController._exchange_rates(user_id)
+            if 'description' in data:
+                transaction.description = data['description']
+            if 'date' in data:
+                transaction.date = datetime.strptime(data['date'], '%Y-%m-%d').date()
+            if 'kind' in data:
+                try:
+                    transaction.kind = TransactionKind(data['kind'])
+                except ValueError:
+                    return jsonify({'msg': 'Tipo de transacción inválido'}), 400
+            if 'category_id' in data:
+                category_id = data['category_id']
+                if category_id:
+                    category = category_directory.get(user_id).get(category_id)
+                    if not category:
+                        return jsonify({'msg': 'Categoría no encontrada'}), 404
+                transaction.category_id = category_id
+            
+            new_values = (transaction.amount, transaction.date, transaction.kind, transaction.currency)
+            if new_values != (old_amount, old_date, old_kind, old_currency):
+                HistoryController._apply_transaction(user_id, old_date, old_kind, -old_amount, old_currency)
+                HistoryController._apply_transaction(
+                    user_id, transaction.date, transaction.kind, transaction.amount, transaction.currency
+                )
+                response_cache.invalidate_on_commit(session, user_id, TRANSACTION_SCOPES, old_date, old_date)
+                response_cache.invalidate_on_commit(session, user_id, TRANSACTION_SCOPES, transaction.date, transaction.date)
+            elif transaction.category_id != old_category_id:
+                # El resumen agrupa por categoría
+                response_cache.invalidate_on_commit(session, user_id, [SUMMARY], transaction.date, transaction.date)
+            
+            return jsonify({
+                'msg': 'Transacción actualizada',
+                'transaction': {
+                    'id': transaction.id,
+                    'amount': transaction.amount,
+                    'currency': transaction.currency,
+                    'description': transaction.description,
+                    'date': transaction.date.isoformat(),
+                    'kind': transaction.kind.value,
+                    'category_id': transaction.category_id
+                }
+            })
+            
         except Exception as e:
             print(f"Error al actualizar transación: {e}")
             return jsonify({'msg': 'Error al actualizar transacción'}), 500
     
     @jwt_required()
+    @query_budget(7)
     def delete_transaction(self, transaction_id):
         user_id = get_jwt_identity()
         try:
-            with self._session_scope():
-                transaction = session.query(Transaction).filter_by(id=transaction_id, user_id=user_id).first()
-                
-                if not transaction:
-                    return jsonify({'msg': 'Transacción no encontrada'}), 404
-                
-                session.delete(transaction)
-                session.flush()
-                
-                # Actualizar los historiales
-                HistoryController._update_month_history(user_id, transaction.date)
-                HistoryController._update_year_history(user_id, transaction.date)
-                
-                return jsonify({'msg': 'Transacción eliminada'})
+            transaction = session.query(Transaction).filter_by(
+                id=transaction_id, user_id=user_id
+            ).with_for_update().first()
+            
+            if not transaction:
+                return jsonify({'msg': 'Transacción no encontrada'}), 404
+            
+            # Si otra petición la eliminó entretanto (SQLite no bloquea la fila) no se resta dos veces
+            deleted = session.query(Transaction).filter_by(
+                id=transaction.id, user_id=user_id
+            ).delete(synchronize_session=False)
+            if not deleted:
+                return jsonify({'msg': 'Transacción no encontrada'}), 404
+            
+            # Registro para la sincronización incremental; los anteriores a la retención ya no se consultan
+            bump_versions(user_id, UserSettings.transactions_version)
+            session.add(TransactionTombstone(
+                user_id=user_id, transaction_id=transaction.id, sync_version=transactions_version(user_id)
+            ))
+            session.query(TransactionTombstone).filter(
+                TransactionTombstone.user_id == user_id,
+                TransactionTombstone.deleted_at < datetime.now() - timedelta(days=self.TOMBSTONE_RETENTION_DAYS)
+            ).delete(synchronize_session=False)
+            
+            # Restar la transacción de los historiales
+            HistoryController._apply_transaction(user_id, transaction.date, transaction.kind, -transaction.amount, transaction.currency)
+            response_cache.invalidate_on_commit(session, user_id, TRANSACTION_SCOPES, transaction.date, transaction.date)
+            
+            return jsonify({'msg': 'Transacción eliminada'})
         except Exception as e:
             print(f"Error al eliminar transación: {e}")
             return jsonify({'msg': 'Error al eliminar transacción'}), 500
     
     @jwt_required()
-    def get_transactions_summary(self):
+    @conditional(transactions_fingerprint)
+    @query_budget(6)
+    def get_transaction_changes(self):
+        """Transacciones creadas o modificadas y ids eliminados desde el token since.
+
+        Sin token, con un token anterior a la retención de eliminaciones o si la moneda del
+        usuario ha cambiado se devuelven todas las transacciones con reset a true.
+
+        El token guarda la transactions_version leída, no una hora: cada escritura marca sus
+        filas con la versión que incrementa y las versiones de un usuario se confirman en orden,
+        así que una transacción que confirma tarde sigue teniendo una versión mayor que el token.
+        """
         user_id = get_jwt_identity()
-        
-        # Obtener parámetros de fecha del request
-        start_date_str = request.args.get('start_date')
-        end_date_str = request.args.get('end_date')
-        
         try:
-            # Parsear fechas o usar valores por defecto (mes actual)
+            currency, amount = UserSettingsController._converted_amount(user_id)
+            
+            # transactions_version de la huella de @conditional: las escrituras con una versión
+            # menor o igual ya están confirmadas en lo que leen las consultas siguientes
+            version = g.etag_fingerprint[0]
             now = datetime.now()
-            if start_date_str:
-                start_date = datetime.strptime(start_date_str, '%Y-%m-%d').date()
-            else:
-                start_date = datetime(now.year, now.month, 1).date()
-                
-            if end_date_str:
-                end_date = datetime.strptime(end_date_str, '%Y-%m-%d').date()
+            
+            token = None
+            if request.args.get('since'):
+                token = self._decode_sync_token(request.args['since'], currency)
+            reset = token is None or token[1] < now - timedelta(days=self.TOMBSTONE_RETENTION_DAYS)
+            
+            query = self._build_transactions_query(user_id, {}, amount)
+            deleted = []
+            if not reset:
+                since_version = token[0]
+                query = query.filter(Transaction.sync_version > since_version)
+                deleted = [transaction_id for (transaction_id,) in session.query(
+                    TransactionTombstone.transaction_id
+                ).filter(
+                    TransactionTombstone.user_id == user_id,
+                    TransactionTombstone.sync_version > since_version
+                )]
+            
+            rows = self._fetch_rows(query.order_by(Transaction.sync_version, Transaction.id))
+            
+            return jsonify({
+                'reset': reset,
+                'changes': self._serialize_transactions(rows, category_directory.get(user_id)),
+                'deleted': deleted,
+                'next_token': self._encode_sync_token(version, now, currency)
+            })
+        except ValueError:
+            return jsonify({'msg': 'Token de sincronización inválido'}), 400
+        except Exception as e:
+            print(f"Error al obtener cambios de transacciones: {e}")
+            return jsonify({'msg': 'Error al obtener cambios de transacciones'}), 500
+    
+    @staticmethod
+    def _encode_sync_token(version, issued_at, currency):
+        payload = json.dumps([version, issued_at.isoformat(), currency]).encode('utf-8')
+        return base64.urlsafe_b64encode(payload).decode('ascii')
+    
+    @staticmethod
+    def _decode_sync_token(token, currency):
+        """(versión, fecha de emisión) del token, o None si se emitió con otra moneda (las
+        cantidades convertidas cambian) o con el formato anterior basado en la fecha"""
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(token.encode('ascii')))
+            if len(payload) == 2:
+                return None
+            version, issued_at, token_currency = payload
+            version, issued_at = int(version), datetime.fromisoformat(issued_at)
+        except Exception:
+            raise ValueError('Token inválido')
+        return (version, issued_at) if token_currency == currency else None
+    
+    @staticmethod
+    def _summary_range(args):
+        """Rango de fechas del resumen; por defecto el mes actual"""
+        # Obtener parámetros de fecha del request
+        start_date_str = args.get('start_date')
+        end_date_str = args.get('end_date')
+        
+        # Parsear fechas o usar valores por defecto (mes actual)
+        now = datetime.now()
+        if start_date_str:
+            start_date = datetime.strptime(start_date_str, '%Y-%m-%d').date()
+        else:
+            start_date = datetime(now.year, now.month, 1).date()
+            
+        if end_date_str:
+            end_date = datetime.strptime(end_date_str, '%Y-%m-%d').date()
+        else:
+            if now.month < 12:
+                end_date = datetime(now.year, now.month + 1, 1).date()
             else:
-                if now.month < 12:
-                    end_date = datetime(now.year, now.month + 1, 1).date()
+                end_date = datetime(now.year + 1, 1, 1).date()
+        
+        return start_date, end_date
+    
+    @jwt_required()
+    @conditional(transactions_fingerprint, key=lambda args: TransactionController._summary_range(args))
+    @response_cache.cached(SUMMARY, date_range=lambda args: TransactionController._summary_range(args))
+    @query_budget(5)
+    def get_transactions_summary(self):
+        user_id = get_jwt_identity()
+        
+        try:
+            start_date, end_date = self._summary_range(request.args)
+            
+            # Totales por tipo y categoría agrupados en la base de datos (una sola consulta, sin JOIN).
+            # Las transacciones sin categoría forman su propio grupo y solo cuentan en los totales.
+            _, amount = UserSettingsController._converted_amount(user_id)
+            rows = session.query(
+                Transaction.kind,
+                Transaction.category_id,
+                func.sum(amount)
+            ).filter(
+                Transaction.user_id == user_id,
+                Transaction.date >= start_date,
+                Transaction.date <= end_date
+            ).group_by(
+                Transaction.kind, Transaction.category_id
+            ).all()
+            categories = category_directory.get(user_id)
+            
+            income = 0
+            expenses = 0
+            # (tipo, nombre) -> resumen; las categorías con el mismo nombre se suman juntas
+            category_summaries = {}
+            
+            for kind, category_id, amount in rows:
+                if kind == TransactionKind.income:
+                    income += amount
                 else:
-                    end_date = datetime(now.year + 1, 1, 1).date()
-            
-            with self._session_scope():
-                # Obtener transacciones en el rango de fechas
-                transactions = session.query(Transaction).filter(
-                    Transaction.user_id == user_id,
-                    Transaction.date >= start_date,
-                    Transaction.date <= end_date
-                ).all()
-                
-                # Calcular totales
-                income = sum(t.amount for t in transactions if t.kind == TransactionKind.income)
-                expenses = sum(t.amount for t in transactions if t.kind == TransactionKind.expense)
-                
-                # Preparar resumen por categorías como arrays de objetos
-                income_categories = []
-                expense_categories = []
-                
-                # Diccionarios temporales para acumular los montos por categoría
-                temp_income = {}
-                temp_expense = {}
-                # Diccionarios para guardar los colores de cada categoría
-                category_colors = {}
-                
-                for t in transactions:
-                    if t.category_id:
-                        category = session.get(Category, t.category_id)
-                        if category:
-                            cat_name = category.name
-                            # Guardamos el color la primera vez que encontramos la categoría
-                            if cat_name not in category_colors:
-                                category_colors[cat_name] = category.color
-                            
-                            if t.kind == TransactionKind.income:
-                                temp_income[cat_name] = temp_income.get(cat_name, 0) + t.amount
-                            else:
-                                temp_expense[cat_name] = temp_expense.get(cat_name, 0) + t.amount
+                    expenses += amount
                 
-                # Convertir los diccionarios temporales a arrays de objetos incluyendo el color
-                income_categories = [{
-                    'category': k, 
-                    'amount': float(v),
-                    'color': category_colors.get(k)
-                } for k, v in temp_income.items()]
+                category = categories.by_id.get(category_id)
+                if category is None:
+                    continue
                 
-                expense_categories = [{
-                    'category': k, 
-                    'amount': float(v),
-                    'color': category_colors.get(k)
-                } for k, v in temp_expense.items()]
-                
-                return jsonify({
-                    'summary': {
-                        'income': float(income),
-                        'expenses': float(expenses),
-                        'balance': float(income - expenses)
-                    },
-                    'categories': {
-                        'income': income_categories,
-                        'expenses': expense_categories
-                    }
+                category_summary = category_summaries.setdefault((kind, category.name), {
+                    'category': category.name,
+                    'amount': 0.0,
+                    'color': category.color
                 })
-                
+                category_summary['amount'] += float(amount)
+                if category.color and (category_summary['color'] is None or category.color < category_summary['color']):
+                    category_summary['color'] = category.color
+            
+            income_categories = [summary for (kind, _), summary in category_summaries.items() if kind == TransactionKind.income]
+            expense_categories = [summary for (kind, _), summary in category_summaries.items() if kind != TransactionKind.income]
+            
+            return jsonify({
+                'summary': {
+                    'income': float(income),
+                    'expenses': float(expenses),
+                    'balance': float(income - expenses)
+                },
+                'categories': {
+                    'income': income_categories,
+                    'expenses': expense_categories
+                }
+            })
+            
         except ValueError as e:
             return jsonify({'msg': 'Formato de fecha inválido. Use YYYY-MM-DD'}), 400
         except Exception as e:
@@ -313,71 +645,174 @@ class TransactionController:
         
     @jwt_required()
     def export_transactions(self):
-        """Exporta las transacciones del usuario a un archivo Excel sin IDs internos"""
+        """Exporta las transacciones del usuario (xlsx, csv, ndjson o parquet) sin IDs internos, en streaming"""
         user_id = get_jwt_identity()
+        export_format = request.args.get('format', 'xlsx').lower()
+        
+        if export_format not in self._export_writers():
+            return jsonify({'msg': 'Formato de exportación no soportado. Use xlsx, csv, ndjson o parquet'}), 400
+        
+        writer, mimetype = self._export_writers()[export_format]
+        filename = f'transacciones_{datetime.now().strftime("%Y%m%d")}.{export_format}'
+        
+        # En segundo plano el archivo se genera en el pool de trabajos y se descarga desde /jobs
+        if self._is_background_request():
+            job = self.jobs.submit(user_id, 'export', self._run_export_job, export_format, filename)
+            return jsonify({'msg': 'Exportación en cola', 'job_id': job.id}), 202
+        
+        def generate():
+            try:
+                # stream_with_context mantiene abierta la sesión de la petición mientras se envían las filas
+                yield from writer(user_id)
+            except Exception as e:
+                print(f"Error al exportar transacciones: {e}")
+                raise
+        
+        return Response(
+            stream_with_context(generate()),
+            mimetype=mimetype,
+            headers={'Content-Disposition': f'attachment; filename={filename}'}
+        )
+    
+    def _export_writers(self):
+        return {
+            'xlsx': (self._stream_xlsx, 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+            'csv': (self._stream_csv, 'text/csv; charset=utf-8'),
+            'ndjson': (self._stream_ndjson, 'application/x-ndjson'),
+            'parquet': (self._stream_parquet, 'application/vnd.apache.parquet')
+        }
+    
+    def _run_export_job(self, job, export_format, filename):
+        """Escribe la exportación en el directorio de trabajos; cualquier proceso la sirve desde /jobs/<id>/download"""
+        writer, mimetype = self._export_writers()[export_format]
+        
+        with self.jobs.temporary_file(f'.{export_format}', job) as output:
+            try:
+                if export_format == 'xlsx':
+                    output.close()
+                    self._write_xlsx_in_process(job, output.name)
+                    job.update_progress(bytes_written=os.path.getsize(output.name))
+                else:
+                    for chunk in writer(job.user_id):
+                        output.write(chunk)
+                        job.update_progress(bytes_written=output.tell())
+            except Exception:
+                output.close()
+                os.remove(output.name)
+                raise
         
+        job.file_path = output.name
+        job.download_name = filename
+        job.mimetype = mimetype
+        job.result = {'msg': 'Exportación completada', 'bytes': job.progress.get('bytes_written', 0)}
+    
+    def _write_xlsx_in_process(self, job, path):
+        """Este hilo lee las filas de la base de datos y un proceso del pool escribe la hoja con openpyxl"""
+        rows = self._export_rows(job.user_id)
+        batches = iter(lambda: list(islice(rows, self.EXPORT_BATCH_SIZE)), [])
+        chunks_path = f'{path}.chunks'
         try:
-            with self._session_scope():
-                # Obtener transacciones con información de categoría
-                transactions = session.query(
-                    Transaction,
-                    Category.name.label('category_name'),
-                    Category.color.label('category_color'),
-                    Category.type.label('category_type')
-                ).outerjoin(
-                    Category, Transaction.category_id == Category.id
-                ).filter(
-                    Transaction.user_id == user_id
-                ).all()
-
-                # Preparar datos para el DataFrame
-                data = []
-                for t, cat_name, cat_color, cat_type in transactions:
-                    data.append({
-                        'Fecha': t.date.strftime('%Y-%m-%d'),
-                        'Descripción': t.description or '',
-                        'Categoría': cat_name or '',
-                        'Color Categoría': cat_color or '',
-                        'Tipo Categoría': cat_type.value if cat_type else '',
-                        'Tipo Transacción': t.kind.value,
-                        'Cantidad': float(t.amount),
-                        'Creado': t.created_at.strftime('%Y-%m-%d %H:%M'),
-                        'Actualizado': t.updated_at.strftime('%Y-%m-%d %H:%M')
-                    })
-
-                # Crear DataFrame y ordenar por fecha
-                df = pd.DataFrame(data)
-                df.sort_values(by='Fecha', ascending=False, inplace=True)
-
-                # Crear archivo Excel en memoria
-                output = BytesIO()
-                with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                    df.to_excel(writer, sheet_name='Transacciones', index=False)
-                    
-                    # Formatear columnas
-                    workbook = writer.book
-                    worksheet = writer.sheets['Transacciones']
-                    
-                    # Ajustar ancho de columnas
-                    for column in df:
-                        column_length = max(df[column].astype(str).map(len).max(), len(column))
-                        col_idx = df.columns.get_loc(column)
-                        worksheet.column_dimensions[chr(65 + col_idx)].width = column_length + 2
-
-                output.seek(0)
-                
-                # Enviar archivo como descarga
-                return send_file(
-                    output,
-                    mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-                    as_attachment=True,
-                    download_name=f'transacciones_{datetime.now().strftime("%Y%m%d")}.xlsx'
-                )
-
-        except Exception as e:
-            print(f"Error al exportar transacciones: {e}")
-            return jsonify({'msg': 'Error al exportar transacciones'}), 500
-
+            job.update_progress(batches_read=write_chunk_file(batches, chunks_path))
+            self.jobs.run_in_process(chunk_file_to_xlsx, chunks_path, path, self.EXPORT_COLUMNS, self.EXPORT_WIDTH_SAMPLE)
+        finally:
+            os.remove(chunks_path)
+    
+    @staticmethod
+    def _is_background_request():
+        return request.values.get('background', '').lower() in ('1', 'true')
+    
+    def _export_query(self, user_id, batch_size):
+        """Consulta de la exportación por fecha descendente, leída de la base de datos por lotes"""
+        _, amount = UserSettingsController._converted_amount(user_id)
+        return session.query(
+            Transaction.date,
+            Transaction.description,
+            Category.name,
+            Category.color,
+            Category.type,
+            Transaction.kind,
+            amount,
+            Transaction.created_at,
+            Transaction.updated_at
+        ).outerjoin(
+            Category, Transaction.category_id == Category.id
+        ).filter(
+            Transaction.user_id == user_id
+        ).order_by(
+            Transaction.date.desc(), Transaction.id.desc()
+        ).yield_per(batch_size)
+    
+    def _export_rows(self, user_id):
+        """Genera las filas de la exportación con el formato de la hoja de cálculo"""
+        rows = self._export_query(user_id, self.EXPORT_BATCH_SIZE)
+        for date, description, cat_name, cat_color, cat_type, kind, amount, created_at, updated_at in rows:
+            yield [
+                date.strftime('%Y-%m-%d'),
+                description or '',
+                cat_name or '',
+                cat_color or '',
+                cat_type.value if cat_type else '',
+                kind.value,
+                float(amount),
+                created_at.strftime('%Y-%m-%d %H:%M'),
+                updated_at.strftime('%Y-%m-%d %H:%M')
+            ]
+    
+    def _stream_csv(self, user_id):
+        rows = self._export_rows(user_id)
+        buffer = StringIO()
+        writer = csv.writer(buffer)
+        # BOM para que Excel reconozca el UTF-8 (tildes en las cabeceras)
+        buffer.write('\ufeff')
+        writer.writerow(self.EXPORT_COLUMNS)
+        
+        for count, row in enumerate(rows, start=1):
+            writer.writerow(row)
+            if count % self.EXPORT_BATCH_SIZE == 0:
+                yield buffer.getvalue().encode('utf-8')
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue().encode('utf-8')
+    
+    def _stream_ndjson(self, user_id):
+        rows = self._export_rows(user_id)
+        lines = []
+        for row in rows:
+            lines.append(dumps(dict(zip(self.EXPORT_COLUMNS, row))))
+            if len(lines) == self.EXPORT_BATCH_SIZE:
+                yield b'\n'.join(lines) + b'\n'
+                lines = []
+        if lines:
+            yield b'\n'.join(lines) + b'\n'
+    
+    def _stream_xlsx(self, user_id):
+        # El formato xlsx es un zip: se guarda en un temporal y se envía por trozos
+        with TemporaryFile() as output:
+            write_xlsx(self._export_rows(user_id), output, self.EXPORT_COLUMNS, self.EXPORT_WIDTH_SAMPLE)
+            yield from self._stream_file(output)
+    
+    def _stream_parquet(self, user_id):
+        rows = iter(self._export_query(user_id, self.PARQUET_ROW_GROUP_SIZE))
+        
+        with TemporaryFile() as output:
+            # Cada lote leído de la base de datos se escribe como un row group
+            with pq.ParquetWriter(output, self.PARQUET_SCHEMA, compression='zstd', use_dictionary=True) as writer:
+                while batch := list(islice(rows, self.PARQUET_ROW_GROUP_SIZE)):
+                    columns = list(zip(*batch))
+                    columns[4] = [cat_type.value if cat_type else None for cat_type in columns[4]]
+                    columns[5] = [kind.value for kind in columns[5]]
+                    writer.write_table(pa.Table.from_arrays(
+                        [pa.array(values, type=field.type) for values, field in zip(columns, self.PARQUET_SCHEMA)],
+                        schema=self.PARQUET_SCHEMA
+                    ))
+            yield from self._stream_file(output)
+    
+    @staticmethod
+    def _stream_file(output):
+        output.seek(0)
+        while chunk := output.read(64 * 1024):
+            yield chunk
+    
     @jwt_required()
     def import_transactions(self):
         """Importa transacciones desde un archivo Excel, creando categorías si no existen"""
@@ -390,116 +825,231 @@ class TransactionController:
         if file.filename == '':
             return jsonify({'msg': 'Nombre de archivo vacío'}), 400
             
-        if not file.filename.lower().endswith(('.xlsx', '.xls')):
-            return jsonify({'msg': 'Formato de archivo no soportado. Use .xlsx o .xls'}), 400
+        filename = file.filename.lower()
+        if not filename.endswith(('.xlsx', '.xls', '.csv', '.parquet')):
+            return jsonify({'msg': 'Formato de archivo no soportado. Use .xlsx, .xls, .csv o .parquet'}), 400
 
-        try:
-            # Leer archivo Excel
-            df = pd.read_excel(file)
-            
-            # Validar columnas requeridas
-            required_columns = {'Fecha', 'Tipo Transacción', 'Cantidad'}
-            if not required_columns.issubset(df.columns):
-                missing = required_columns - set(df.columns)
-                return jsonify({'msg': f'Faltan columnas requeridas: {missing}'}), 400
-
-            # Procesar transacciones
-            success_count = 0
-            errors = []
-            
-            with self._session_scope():
-                # Obtener categorías existentes del usuario
-                user_categories = session.query(Category).filter_by(user_id=user_id).all()
-                category_map = {cat.name.lower(): cat for cat in user_categories}
-                
-                for index, row in df.iterrows():
-                    try:
-                        # Validar y convertir datos
-                        date = pd.to_datetime(row['Fecha']).date()
-                        kind_str = str(row['Tipo Transacción']).strip().lower()
-                        amount = float(row['Cantidad'])
-                        description = str(row.get('Descripción', '')).strip() or None
-                        category_name = str(row.get('Categoría', '')).strip() or None
-                        category_color = str(row.get('Color Categoría', '')).strip() or None
-                        category_type_str = str(row.get('Tipo Categoría', '')).strip() or None
-                        
-                        # Validar tipo de transacción
-                        try:
-                            kind = TransactionKind(kind_str)
-                        except ValueError:
-                            errors.append(f"Fila {index+2}: Tipo de transacción inválido '{kind_str}'")
-                            continue
-                        
-                        # Mapear o crear categoría si existe
-                        category_id = None
-                        if category_name:
-                            category_name_lower = category_name.lower()
-                            
-                            if category_name_lower in category_map:
-                                # Usar categoría existente
-                                category = category_map[category_name_lower]
-                                category_id = category.id
-                            else:
-                                # Validar y crear nueva categoría
-                                if not category_type_str:
-                                    errors.append(f"Fila {index+2}: Falta el tipo de categoría para crear nueva categoría '{category_name}'")
-                                    continue
-                                
-                                try:
-                                    category_type = CategoryType(category_type_str)
-                                except ValueError:
-                                    errors.append(f"Fila {index+2}: Tipo de categoría inválido '{category_type_str}'")
-                                    continue
-                                
-                                # Crear nueva categoría
-                                new_category = Category(
-                                    name=category_name,
-                                    type=category_type,
-                                    color=category_color or self._generate_random_color(),
-                                    user_id=user_id
-                                )
-                                
-                                session.add(new_category)
-                                session.flush()  # Para obtener el ID
-                                
-                                category_id = new_category.id
-                                category_map[category_name_lower] = new_category
-                        
-                        # Crear transacción
-                        transaction = Transaction(
-                            amount=amount,
-                            description=description,
-                            date=date,
-                            kind=kind,
-                            category_id=category_id,
-                            user_id=user_id
-                        )
-                        
-                        session.add(transaction)
-                        success_count += 1
-                        
-                    except Exception as e:
-                        errors.append(f"Fila {index+2}: Error - {str(e)}")
-                        continue
-                
-                # Actualizar historiales si hubo transacciones nuevas
-                if success_count > 0:
-                    dates_to_update = {t.date for t in session.new if isinstance(t, Transaction)}
-                    for date in dates_to_update:
-                        HistoryController._update_month_history(user_id, date)
-                        HistoryController._update_year_history(user_id, date)
-                
-                return jsonify({
-                    'msg': f'Importación completada con {success_count} transacciones procesadas',
-                    'success_count': success_count,
-                    'error_count': len(errors),
-                    'errors': errors if errors else None
-                })
+        # En segundo plano se guarda la subida en un temporal, porque el request se cierra al responder
+        if self._is_background_request():
+            upload = self.jobs.temporary_file(os.path.splitext(filename)[1])
+            file.save(upload)
+            upload.close()
+            job = self.jobs.submit(
+                user_id, 'import', self._run_import_job, upload.name, filename,
+                upload_path=upload.name
+            )
+            return jsonify({'msg': 'Importación en cola', 'job_id': job.id}), 202
 
+        try:
+            result, status = self._run_import(user_id, self._read_import_chunks(file, filename))
+            return jsonify(result), status
         except Exception as e:
             print(f"Error al importar transacciones: {e}")
             return jsonify({'msg': 'Error al procesar archivo Excel'}), 500
 
+    def _run_import_job(self, job, path, filename):
+        if filename.endswith('.xlsx'):
+            # openpyxl lee la hoja en un proceso del pool; este hilo solo valida e inserta los bloques
+            chunks_path = f'{path}.chunks'
+            try:
+                self.jobs.run_in_process(xlsx_to_chunk_file, path, self.IMPORT_CHUNK_SIZE, chunks_path)
+                result, status = self._run_import(job.user_id, read_chunk_file(chunks_path), job)
+            finally:
+                if os.path.exists(chunks_path):
+                    os.remove(chunks_path)
+        else:
+            with open(path, 'rb') as file:
+                result, status = self._run_import(job.user_id, self._read_import_chunks(file, filename), job)
+        
+        job.errors = result.pop('errors', None)
+        job.result = result
+        if status != 200:
+            job.status = 'failed'
+
+    def _run_import(self, user_id, frames, job=None):
+        """Importa los bloques (DataFrames) del archivo; devuelve el cuerpo de la respuesta y su código de estado"""
+        success_count = 0
+        errors = []
+        chunks = []
+        started = time.perf_counter()
+        
+        # Categorías existentes del usuario (se amplía con las que cree la importación)
+        category_map = {name: category.id for name, category in category_directory.get(user_id).by_name.items()}
+        
+        # Las cantidades del archivo se interpretan en la moneda actual del usuario
+        currency, _ = UserSettingsController._exchange_rates(user_id)
+        
+        # Cada bloque se valida e inserta antes de leer el siguiente
+        read_started = time.perf_counter()
+        for chunk_number, df in enumerate(frames, start=1):
+            read_seconds = time.perf_counter() - read_started
+            
+            # Validar columnas requeridas
+            if chunk_number == 1:
+                required_columns = {'Fecha', 'Tipo Transacción', 'Cantidad'}
+                if not required_columns.issubset(df.columns):
+                    missing = required_columns - set(df.columns)
+                    return {'msg': f'Faltan columnas requeridas: {missing}'}, 400
+            
+            import_started = time.perf_counter()
+            chunk_success, chunk_errors = self._import_dataframe(user_id, df, category_map, currency)
+            success_count += chunk_success
+            errors.extend(chunk_errors)
+            
+            chunks.append({
+                'chunk': chunk_number,
+                'rows': len(df),
+                'success_count': chunk_success,
+                'error_count': len(chunk_errors),
+                'read_seconds': round(read_seconds, 3),
+                'import_seconds': round(time.perf_counter() - import_started, 3)
+            })
+            if job:
+                job.update_progress(
+                    chunks=chunk_number,
+                    rows=sum(chunk['rows'] for chunk in chunks),
+                    success_count=success_count,
+                    error_count=len(errors)
+                )
+            read_started = time.perf_counter()
+        
+        return {
+            'msg': f'Importación completada con {success_count} transacciones procesadas',
+            'success_count': success_count,
+            'error_count': len(errors),
+            'errors': errors if errors else None,
+            'chunks': chunks,
+            'elapsed_seconds': round(time.perf_counter() - started, 3)
+        }, 200
+
+    def _read_import_chunks(self, file, filename):
+        """Genera DataFrames de como mucho IMPORT_CHUNK_SIZE filas sin cargar el archivo completo.
+        
+        El índice de cada DataFrame es la posición de la fila de datos en el archivo,
+        de modo que los errores siguen indicando la fila original.
+        """
+        if filename.endswith('.csv'):
+            yield from pd.read_csv(file, chunksize=self.IMPORT_CHUNK_SIZE)
+            return
+        
+        if filename.endswith('.parquet'):
+            parquet_file = pq.ParquetFile(getattr(file, 'stream', file))
+            start = 0
+            for batch in parquet_file.iter_batches(batch_size=self.IMPORT_CHUNK_SIZE):
+                df = batch.to_pandas()
+                df.index = pd.RangeIndex(start, start + len(df))
+                start += len(df)
+                yield df
+            if not start:
+                yield parquet_file.schema_arrow.empty_table().to_pandas()
+            return
+        
+        # El formato .xls antiguo no admite lectura en streaming
+        if filename.endswith('.xls'):
+            yield pd.read_excel(file)
+            return
+        
+        yield from read_xlsx_chunks(file, self.IMPORT_CHUNK_SIZE)
+
+    def _import_dataframe(self, user_id, df, category_map, currency):
+        """Valida e inserta un DataFrame de transacciones por columnas completas.
+        
+        category_map (nombre en minúsculas -> id) se amplía con las categorías creadas.
+        Devuelve el número de transacciones insertadas y la lista de errores por fila.
+        """
+        errors = {}
+        valid = pd.Series(True, index=df.index)
+        
+        def reject(mask, build_message):
+            # Solo se guarda el primer error de cada fila
+            mask = mask & valid
+            for index in df.index[mask]:
+                errors[index] = f"Fila {index + 2}: {build_message(index)}"
+            valid[mask] = False
+        
+        def text_column(name):
+            if name not in df.columns:
+                return pd.Series([None] * len(df), index=df.index, dtype=object)
+            column = df[name].astype('string').str.strip()
+            return column.astype(object).where(column.notna() & (column != ''), None)
+        
+        # Conversión de columnas completas; los valores no convertibles quedan como NaN/NaT
+        dates = pd.to_datetime(df['Fecha'], errors='coerce')
+        reject(dates.isna(), lambda i: f"Fecha inválida '{df.at[i, 'Fecha']}'")
+        
+        kinds = df['Tipo Transacción'].astype('string').str.strip().str.lower()
+        reject(~kinds.isin([kind.value for kind in TransactionKind]), lambda i: f"Tipo de transacción inválido '{kinds[i]}'")
+        
+        amounts = pd.to_numeric(df['Cantidad'], errors='coerce')
+        reject(amounts.isna(), lambda i: f"Cantidad inválida '{df.at[i, 'Cantidad']}'")
+        
+        descriptions = text_column('Descripción')
+        category_names = text_column('Categoría')
+        category_colors = text_column('Color Categoría')
+        category_types = text_column('Tipo Categoría')
+        category_keys = category_names.str.lower()
+        
+        # Categorías nuevas: se crean a partir de la primera fila válida que las define
+        new_category = valid & category_keys.notna() & ~category_keys.isin(list(category_map))
+        valid_type = category_types.isin([category_type.value for category_type in CategoryType])
+        definitions = df.index[new_category & valid_type]
+        definitions = definitions[~category_keys[definitions].duplicated()]
+        
+        uncreatable = new_category & ~category_keys.isin(category_keys[definitions].tolist())
+        reject(uncreatable & category_types.isna(), lambda i: f"Falta el tipo de categoría para crear nueva categoría '{category_names[i]}'")
+        reject(uncreatable, lambda i: f"Tipo de categoría inválido '{category_types[i]}'")
+        
+        if len(definitions):
+            session.execute(insert(Category.__table__), [{
+                'name': category_names[i],
+                'type': CategoryType(category_types[i]),
+                'color': category_colors[i] or self._generate_random_color(),
+                'user_id': user_id
+            } for i in definitions])
+            
+            created = session.query(Category.id, Category.name).filter(
+                Category.user_id == user_id,
+                Category.name.in_(category_names[definitions].tolist())
+            ).all()
+            category_map.update({name.lower(): category_id for category_id, name in created})
+            response_cache.invalidate_on_commit(session, user_id, [CATEGORIES])
+            category_directory.invalidate_on_commit(session, user_id)
+            bump_versions(user_id, UserSettings.categories_version)
+        
+        category_ids = category_keys.map(category_map).astype('Int64')
+        
+        rows = pd.DataFrame({
+            'amount': amounts[valid].astype(float),
+            'currency': currency,
+            'description': descriptions[valid],
+            'date': dates[valid].dt.date,
+            'kind': kinds[valid].map(TransactionKind).astype(object),
+            'category_id': category_ids[valid].astype(object).where(category_ids[valid].notna(), None),
+            'user_id': user_id
+        })
+        
+        if not rows.empty:
+            # Inserción masiva en un único executemany (Core, sin el bulk del ORM)
+            bump_versions(user_id, UserSettings.transactions_version)
+            session.execute(
+                insert(Transaction.__table__).values(sync_version=transactions_version(user_id)),
+                rows.to_dict('records')
+            )
+            
+            # Totales por día para sumar a los historiales
+            is_income = rows['kind'] == TransactionKind.income
+            daily_totals = pd.DataFrame({
+                'date': rows['date'],
+                'income': rows['amount'].where(is_income, 0),
+                'expense': rows['amount'].where(~is_income, 0)
+            }).groupby('date')[['income', 'expense']].sum()
+            HistoryController._apply_daily_totals(user_id, daily_totals, currency)
+            response_cache.invalidate_on_commit(
+                session, user_id, TRANSACTION_SCOPES, daily_totals.index.min(), daily_totals.index.max()
+            )
+        
+        return len(rows), [errors[index] for index in sorted(errors)]
+    
     def _generate_random_color(self):
         """Genera un color hexadecimal aleatorio para nuevas categorías"""
         return f"#{random.randint(0, 0xFFFFFF):06x}"
\ No newline at end of file
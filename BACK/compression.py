@@ -0,0 +1,74 @@
+"""Compresión gzip/brotli de las respuestas según Accept-Encoding.
+
+Las respuestas normales se comprimen si superan COMPRESSION_MIN_SIZE bytes. Las
+respuestas en streaming (exportaciones) se comprimen bloque a bloque mientras se
+envían, sin acumular el cuerpo. Los formatos ya comprimidos (xlsx, parquet) y los
+archivos servidos con send_file se envían tal cual.
+
+El ETag de una respuesta comprimida pasa a ser débil (como hace nginx), de modo
+que If-None-Match sigue funcionando con la comparación débil de etags.py.
+"""
+
+import os
+import zlib
+import brotli
+from flask import request
+
+COMPRESSIBLE_MIMETYPES = frozenset({
+    'application/json', 'application/x-ndjson', 'text/csv', 'text/plain', 'text/html'
+})
+
+
+def init_compression(app):
+    min_size = int(os.getenv('COMPRESSION_MIN_SIZE', 1024))
+    gzip_level = int(os.getenv('COMPRESSION_GZIP_LEVEL', 6))
+    brotli_quality = int(os.getenv('COMPRESSION_BROTLI_QUALITY', 4))
+
+    def compressor(encoding):
+        if encoding == 'br':
+            compressor = brotli.Compressor(quality=brotli_quality)
+            return compressor.process, compressor.finish
+        # wbits 31: formato gzip
+        compressor = zlib.compressobj(gzip_level, zlib.DEFLATED, 31)
+        return compressor.compress, compressor.flush
+
+    def compress_stream(chunks, encoding):
+        compress, finish = compressor(encoding)
+        try:
+            for chunk in chunks:
+                data = compress(chunk.encode('utf-8') if isinstance(chunk, str) else chunk)
+                if data:
+                    yield data
+            yield finish()
+        finally:
+            if hasattr(chunks, 'close'):
+                chunks.close()
+
+    @app.after_request
+    def compress_response(response):
+        if (response.status_code < 200 or response.status_code in (204, 304)
+                or response.mimetype not in COMPRESSIBLE_MIMETYPES
+                or response.direct_passthrough
+                or 'Content-Encoding' in response.headers):
+            return response
+
+        response.vary.add('Accept-Encoding')
+        encoding = request.accept_encodings.best_match(['br', 'gzip'])
+        if not encoding:
+            return response
+
+        if response.is_streamed:
+            response.response = compress_stream(response.response, encoding)
+            response.headers.pop('Content-Length', None)
+        else:
+            body = response.get_data()
+            if len(body) < min_size:
+                return response
+            compress, finish = compressor(encoding)
+            response.set_data(compress(body) + finish())
+
+        response.headers['Content-Encoding'] = encoding
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        return response
@@ -0,0 +1,94 @@
+"""ETag e If-None-Match para los listados grandes.
+
+El ETag no se calcula a partir del cuerpo sino de una huella barata de obtener
+en la base de datos: la versión de datos del usuario (user_settings), el número
+de filas y la última modificación. Si coincide con If-None-Match se responde 304
+sin cargar ni serializar ninguna fila.
+
+Las huellas incluyen la versión de categorías del usuario, que queda en
+g.categories_version para que el directorio de categorías no la consulte de nuevo.
+"""
+
+import hashlib
+from functools import wraps
+from flask import current_app, g, request, Response
+from flask_jwt_extended import get_jwt_identity
+from sqlalchemy import select, func
+from models import session, UserSettings, Transaction, Category
+
+
+def bump_versions(user_id, *columns):
+    """Incrementa las versiones indicadas (p. ej. UserSettings.transactions_version) en la transacción actual"""
+    session.query(UserSettings).filter_by(user_id=user_id).update(
+        {column: column + 1 for column in columns}, synchronize_session=False
+    )
+
+
+def transactions_version(user_id):
+    """Subconsulta con la transactions_version del usuario.
+
+    Tras bump_versions marca las filas escritas en la misma transacción: la fila de
+    user_settings queda bloqueada hasta el commit, así que las versiones de un usuario se
+    confirman en orden y /transactions/changes puede usarlas como cursor.
+    """
+    return select(UserSettings.transactions_version).where(UserSettings.user_id == user_id).scalar_subquery()
+
+
+def _categories_version(user_id):
+    return select(UserSettings.categories_version).where(UserSettings.user_id == user_id).scalar_subquery().label('categories_version')
+
+
+def transactions_fingerprint(user_id):
+    """Versiones, número de transacciones y última modificación (índice user_id, updated_at)"""
+    return session.execute(select(
+        transactions_version(user_id).label('transactions_version'),
+        _categories_version(user_id),
+        select(func.count(Transaction.id)).where(Transaction.user_id == user_id).scalar_subquery(),
+        select(func.max(Transaction.updated_at)).where(Transaction.user_id == user_id).scalar_subquery()
+    )).one()
+
+
+def categories_fingerprint(user_id):
+    return session.execute(select(
+        _categories_version(user_id),
+        select(func.count(Category.id)).where(Category.user_id == user_id).scalar_subquery(),
+        select(func.max(Category.created_at)).where(Category.user_id == user_id).scalar_subquery()
+    )).one()
+
+
+def conditional(fingerprint, key=None):
+    """Decorador para vistas GET con usuario autenticado (va debajo de @jwt_required).
+
+    El ETag combina la huella de fingerprint(user_id) con la ruta y los parámetros y, si se
+    indica, con key(args): lo que además determina la respuesta sin aparecer en la ruta (p. ej.
+    el mes actual que el resumen usa por defecto). Si key lanza ValueError la vista responde
+    sin ETag. La huella queda en g.etag_fingerprint para que la caché de respuestas la incluya
+    en su clave y el cuerpo servido corresponda siempre al ETag.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            try:
+                extra = key(request.args) if key else None
+            except ValueError:
+                return view(*args, **kwargs)
+
+            user_id = get_jwt_identity()
+            row = fingerprint(user_id)
+            g.etag_fingerprint = tuple(row)
+            g.categories_version = row.categories_version
+            state = (str(user_id), request.full_path, g.etag_fingerprint, extra)
+            etag = hashlib.sha256(repr(state).encode('utf-8')).hexdigest()
+
+            # Comparación débil (RFC 9110): la versión comprimida lleva el mismo ETag como W/
+            if request.if_none_match.contains_weak(etag):
+                response = Response(status=304)
+                response.set_etag(etag)
+                return response
+
+            response = current_app.make_response(view(*args, **kwargs))
+            if response.status_code == 200:
+                response.set_etag(etag)
+            return response
+        return wrapper
+    return decorator
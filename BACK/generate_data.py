@@ -0,0 +1,245 @@
+"""Generador de datos sintéticos para pruebas de carga.
+
+Genera con NumPy (sin bucles por fila) transacciones para muchos usuarios con las
+mismas categorías que insert.py, con estacionalidad en las fechas y distribución
+de cantidades configurables. Con la misma semilla se obtienen los mismos datos.
+
+Los datos se cargan directamente en la base de datos (usuarios, configuración,
+categorías, transacciones e historiales mensual y anual coherentes con ellas) o
+se escriben como archivo de prueba con las columnas de transacciones_2_anios.xlsx.
+
+Uso:
+    python generate_data.py --users 1000 --per-user 2000                   # base de datos del .env
+    python generate_data.py --users 1000 --url sqlite:///carga.db           # otra URL (se crea el esquema)
+    python generate_data.py --users 1 --per-user 1000 --output datos.xlsx   # también .csv o .parquet
+
+Los usuarios se llaman <prefijo><n> (email <prefijo><n>@example.com) y tienen
+todos la contraseña indicada; los emails no deben existir ya en la base de datos.
+"""
+
+import argparse
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from sqlalchemy import insert, select
+from models import (
+    engine as default_engine, User, UserSettings, Category, Transaction,
+    MonthHistory, YearHistory, CategoryType, TransactionKind, DEFAULT_CURRENCY, create_database_engine
+)
+from migrations import init_database
+
+# Mismas categorías que insert.py
+CATEGORIES = [
+    {"nombre": "Salario", "color": "#4dff00", "tipo": "save", "tipo_trans": "income"},
+    {"nombre": "Supermercado", "color": "#ff0000", "tipo": "need", "tipo_trans": "expense"},
+    {"nombre": "Ocio", "color": "#0000ff", "tipo": "want", "tipo_trans": "expense"},
+    {"nombre": "Transporte", "color": "#ffa500", "tipo": "need", "tipo_trans": "expense"},
+    {"nombre": "Inversión", "color": "#008000", "tipo": "save", "tipo_trans": "expense"},
+    {"nombre": "Freelance", "color": "#00cccc", "tipo": "save", "tipo_trans": "income"}
+]
+DESCRIPTIONS = ["Pago", "Compra", "Ingreso", "Transferencia", "Suscripción"]
+
+# Mediana y dispersión de la cantidad de cada categoría con --amounts lognormal
+LOGNORMAL_AMOUNTS = {
+    "Salario": (1800, 0.25),
+    "Supermercado": (60, 0.6),
+    "Ocio": (40, 0.8),
+    "Transporte": (25, 0.7),
+    "Inversión": (300, 0.9),
+    "Freelance": (500, 0.7)
+}
+
+INSERT_BATCH_SIZE = 50000
+
+
+def generate(users=1, per_user=1000, days=730, spread=0.3, seasonality=0.2, amounts='uniform', seed=0, end=None):
+    """Genera las transacciones de `users` usuarios en los `days` días anteriores a `end` (hoy por defecto).
+
+    Cada usuario tiene de media per_user transacciones (desviación relativa spread; 0 = exactamente
+    per_user). seasonality es la amplitud de la variación anual del número de transacciones por día,
+    con el máximo en diciembre. amounts es 'uniform' (entre 5 y 1000, como insert.py) o 'lognormal'
+    (por categoría, ver LOGNORMAL_AMOUNTS).
+
+    Devuelve un DataFrame con user (0..users-1), date, created_at, category (posición en CATEGORIES),
+    description y amount, ordenado por usuario y fecha.
+    """
+    rng = np.random.default_rng(seed)
+
+    counts = np.full(users, per_user)
+    if spread:
+        counts = np.maximum(1, rng.normal(per_user, per_user * spread, users).round()).astype(int)
+    total = int(counts.sum())
+
+    end = pd.Timestamp(end or datetime.today()).normalize()
+    calendar = pd.date_range(end=end, periods=days, freq='D')
+    weights = 1 + seasonality * np.cos(2 * np.pi * (calendar.dayofyear.to_numpy() - 350) / 365)
+    day_index = rng.choice(days, size=total, p=weights / weights.sum())
+
+    categories = rng.integers(0, len(CATEGORIES), total)
+    if amounts == 'lognormal':
+        medians, sigmas = np.array([LOGNORMAL_AMOUNTS[category['nombre']] for category in CATEGORIES]).T
+        values = rng.lognormal(np.log(medians[categories]), sigmas[categories])
+    elif amounts == 'uniform':
+        values = rng.uniform(5, 1000, total)
+    else:
+        raise ValueError(f"Distribución de cantidades desconocida: {amounts}")
+
+    dates = calendar[day_index]
+    df = pd.DataFrame({
+        'user': np.repeat(np.arange(users), counts),
+        'date': dates,
+        'created_at': dates + pd.to_timedelta(rng.integers(0, 86400, total), unit='s'),
+        'category': categories,
+        'description': np.array(DESCRIPTIONS)[rng.integers(0, len(DESCRIPTIONS), total)],
+        'amount': values.round(2)
+    })
+    return df.sort_values(['user', 'date', 'created_at'], kind='stable', ignore_index=True)
+
+
+def fixture(df):
+    """Convierte las transacciones generadas a las columnas de transacciones_2_anios.xlsx"""
+    categories = pd.DataFrame(CATEGORIES).iloc[df['category']].reset_index(drop=True)
+    created = df['created_at'].dt.strftime('%Y-%m-%d %H:%M')
+    columns = {
+        'Fecha': df['date'].dt.date,
+        'Descripción': df['description'],
+        'Categoría': categories['nombre'],
+        'Color Categoría': categories['color'],
+        'Tipo Categoría': categories['tipo'],
+        'Tipo Transacción': categories['tipo_trans'],
+        'Cantidad': df['amount'],
+        'Creado': created,
+        'Actualizado': created
+    }
+    if df['user'].nunique() > 1:
+        columns = {'Usuario': df['user'], **columns}
+    return pd.DataFrame(columns)
+
+
+def write_fixture(df, path):
+    data = fixture(df)
+    if path.endswith('.csv'):
+        data.to_csv(path, index=False)
+    elif path.endswith('.parquet'):
+        data.to_parquet(path, index=False)
+    elif path.endswith('.xlsx'):
+        data.to_excel(path, index=False)
+    else:
+        raise ValueError('Formato no soportado. Use .xlsx, .csv o .parquet')
+
+
+def load(engine, df, prefix='usuario', password='Password1!'):
+    """Inserta usuarios, categorías, transacciones e historiales en una sola transacción"""
+    # bcrypt es lento: todos los usuarios comparten el mismo hash
+    from passwords import password_hasher
+    password_hash = password_hasher.hash(password)
+    users = int(df['user'].max()) + 1
+    now = datetime.now()
+
+    with engine.begin() as connection:
+        emails = [f'{prefix}{n}@example.com' for n in range(users)]
+        connection.execute(insert(User.__table__), [
+            {'username': f'{prefix}{n}', 'email': email, 'password': password_hash, 'created_at': now}
+            for n, email in enumerate(emails)
+        ])
+        positions = {email: n for n, email in enumerate(emails)}
+        user_ids = np.empty(users, dtype=np.int64)
+        for user_id, email in connection.execute(
+            select(User.id, User.email).where(User.email.like(f'{prefix}%@example.com'))
+        ):
+            if email in positions:
+                user_ids[positions[email]] = user_id
+
+        connection.execute(insert(UserSettings.__table__), [
+            {'user_id': int(user_id), 'currency': DEFAULT_CURRENCY, 'transactions_version': 0, 'categories_version': 0}
+            for user_id in user_ids
+        ])
+
+        connection.execute(insert(Category.__table__), [
+            {'user_id': int(user_id), 'name': category['nombre'], 'color': category['color'],
+             'type': CategoryType(category['tipo']), 'created_at': now}
+            for user_id in user_ids for category in CATEGORIES
+        ])
+        # (usuario, posición en CATEGORIES) -> id de la categoría
+        category_ids = np.empty((users, len(CATEGORIES)), dtype=np.int64)
+        category_positions = {category['nombre']: index for index, category in enumerate(CATEGORIES)}
+        user_positions = {int(user_id): index for index, user_id in enumerate(user_ids)}
+        for category_id, user_id, name in connection.execute(
+            select(Category.id, Category.user_id, Category.name).where(
+                Category.user_id.between(int(user_ids.min()), int(user_ids.max()))
+            )
+        ):
+            if user_id in user_positions:
+                category_ids[user_positions[user_id], category_positions[name]] = category_id
+
+        kinds = np.array([TransactionKind(category['tipo_trans']) for category in CATEGORIES], dtype=object)
+        user_column = user_ids[df['user'].to_numpy()]
+        transactions = pd.DataFrame({
+            'user_id': user_column,
+            'category_id': category_ids[df['user'].to_numpy(), df['category'].to_numpy()],
+            'kind': kinds[df['category'].to_numpy()],
+            'amount': df['amount'].to_numpy(),
+            'currency': DEFAULT_CURRENCY,
+            'description': df['description'].to_numpy(),
+            'date': df['date'].dt.date.to_numpy(),
+            'created_at': df['created_at'].to_numpy(),
+            'updated_at': df['created_at'].to_numpy()
+        })
+        for start in range(0, len(transactions), INSERT_BATCH_SIZE):
+            # object: valores de Python en lugar de escalares de NumPy, que no todos los drivers aceptan
+            batch = transactions.iloc[start:start + INSERT_BATCH_SIZE].astype(object)
+            connection.execute(insert(Transaction.__table__), batch.to_dict('records'))
+
+        # Historiales con los mismos totales que acumulan los controladores
+        is_income = transactions['kind'] == TransactionKind.income
+        days = pd.DataFrame({
+            'user_id': user_column,
+            'year': df['date'].dt.year.to_numpy(),
+            'month': df['date'].dt.month.to_numpy(),
+            'day': df['date'].dt.day.to_numpy(),
+            'income': transactions['amount'].where(is_income, 0.0),
+            'expense': transactions['amount'].where(~is_income, 0.0)
+        }).groupby(['user_id', 'year', 'month', 'day'], as_index=False)[['income', 'expense']].sum()
+        days['currency'] = DEFAULT_CURRENCY
+        months = days.groupby(['user_id', 'year', 'month', 'currency'], as_index=False)[['income', 'expense']].sum()
+
+        for model, rows in ((MonthHistory, days), (YearHistory, months)):
+            for start in range(0, len(rows), INSERT_BATCH_SIZE):
+                batch = rows.iloc[start:start + INSERT_BATCH_SIZE].astype(object)
+                connection.execute(insert(model.__table__), batch.to_dict('records'))
+
+    return {'users': users, 'transactions': len(transactions), 'month_history': len(days), 'year_history': len(months)}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Genera datos sintéticos de transacciones')
+    parser.add_argument('--users', type=int, default=1, help='Número de usuarios')
+    parser.add_argument('--per-user', type=int, default=1000, help='Transacciones por usuario (media)')
+    parser.add_argument('--spread', type=float, default=0.3, help='Desviación relativa de las transacciones por usuario')
+    parser.add_argument('--days', type=int, default=730, help='Días hacia atrás desde hoy')
+    parser.add_argument('--seasonality', type=float, default=0.2, help='Amplitud de la estacionalidad anual (0 = sin ella)')
+    parser.add_argument('--amounts', choices=['uniform', 'lognormal'], default='uniform', help='Distribución de las cantidades')
+    parser.add_argument('--seed', type=int, default=0, help='Semilla del generador')
+    parser.add_argument('--url', help='URL de SQLAlchemy de la base de datos (por defecto la del .env)')
+    parser.add_argument('--prefix', default='usuario', help='Prefijo de los nombres de usuario')
+    parser.add_argument('--password', default='Password1!', help='Contraseña de todos los usuarios')
+    parser.add_argument('--output', help='Escribe un archivo .xlsx, .csv o .parquet en lugar de cargar la base de datos')
+    args = parser.parse_args()
+
+    started = datetime.now()
+    data = generate(
+        users=args.users, per_user=args.per_user, days=args.days, spread=args.spread,
+        seasonality=args.seasonality, amounts=args.amounts, seed=args.seed
+    )
+    print(f"{len(data)} transacciones generadas en {(datetime.now() - started).total_seconds():.1f} s")
+
+    if args.output:
+        write_fixture(data, args.output)
+        print(f"Archivo generado: {args.output}")
+    else:
+        engine = default_engine
+        if args.url:
+            engine = create_database_engine(args.url)
+            init_database(engine)
+        counts = load(engine, data, prefix=args.prefix, password=args.password)
+        print(f"Cargados {counts} en {(datetime.now() - started).total_seconds():.1f} s")
@@ -0,0 +1,71 @@
+"""Configuración de gunicorn para producción.
+
+Uso:
+    gunicorn -c gunicorn.conf.py
+
+El proceso maestro carga la aplicación una vez (preload_app), prepara el esquema
+y crea por fork GUNICORN_WORKERS procesos, cada uno con GUNICORN_THREADS hilos.
+Tras el fork cada proceso descarta el pool de conexiones heredado y abre el suyo.
+Cada proceso se recicla tras atender GUNICORN_MAX_REQUESTS peticiones (más un
+margen aleatorio de hasta GUNICORN_MAX_REQUESTS_JITTER para no reiniciarlos a la vez).
+
+Las cachés son locales a cada proceso y comprueban las versiones de user_settings,
+así que no sirven datos anteriores a una escritura confirmada en otro proceso. Cada
+proceso escribe sus métricas en METRICS_DIRECTORY (por defecto un directorio
+temporal propio de este servidor) y GET /metrics suma las de todos. Los trabajos en
+segundo plano guardan su estado y sus archivos en JOB_DIRECTORY, que deben compartir
+todos los procesos; los que quedan a medias al reciclar o matar un proceso pasan a
+failed cuando caduca su latido.
+"""
+
+import os
+import tempfile
+
+# Se fija antes de cargar la aplicación: metrics.py lo lee al importarse
+if not os.getenv('METRICS_DIRECTORY'):
+    os.environ['METRICS_DIRECTORY'] = tempfile.mkdtemp(prefix='trirule-metrics-')
+
+wsgi_app = 'index:create_app()'
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:5000')
+
+workers = int(os.getenv('GUNICORN_WORKERS', os.cpu_count() or 2))
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', 4))
+
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 60))                 # Segundos sin responder antes de reiniciar un proceso
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', 30))  # Margen para terminar las peticiones en curso
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', 5))
+
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 1000))     # 0 = sin reciclado
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', 100))
+
+preload_app = os.getenv('GUNICORN_PRELOAD', 'true').lower() in ('1', 'true')
+
+accesslog = os.getenv('GUNICORN_ACCESS_LOG', '-')
+
+
+def on_starting(server):
+    """Crea las tablas y aplica las migraciones una sola vez, en el proceso maestro"""
+    from models import engine
+    from migrations import init_database
+    from metrics import metrics
+    metrics.clear_directory()
+    init_database(engine)
+
+
+def post_fork(server, worker):
+    """Las conexiones abiertas por el maestro no se comparten entre procesos"""
+    from models import dispose_engines
+    dispose_engines()
+
+
+def worker_exit(server, worker):
+    """Guarda las métricas del proceso que termina sin esperar al siguiente volcado"""
+    from metrics import metrics
+    metrics.save()
+
+
+def child_exit(server, worker):
+    """En el maestro: los contadores del proceso terminado pasan a archive.json"""
+    from metrics import metrics
+    metrics.mark_process_dead(worker.pid)
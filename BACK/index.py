@@ -9,7 +9,17 @@ from components.settings import UserSettingsController
 from components.category import CategoryController
 from components.transaction import TransactionController
 from components.history import HistoryController
-from models import Base, engine
+from components.jobs import JobController, JobManager
+from models import engine
+from migrations import init_database
+from unit_of_work import init_unit_of_work
+from cache import response_cache
+from category_directory import category_directory
+from serialization import OrjsonProvider
+from compression import init_compression
+from metrics import init_metrics, metrics_view
+from query_audit import init_query_audit
+from passwords import password_hasher
 from dotenv import load_dotenv
 load_dotenv()
 class TriruleAPI:
@@ -18,9 +28,9 @@ class TriruleAPI:
         self._configure_app()
         self._initialize_extensions()
         self._register_controllers()
-        self._create_tables()
         
     def _configure_app(self):
+        self.app.json = OrjsonProvider(self.app)
         self.app.config['JWT_SECRET_KEY'] = os.getenv('JWT_SECRET_KEY')
         self.app.config['JWT_TOKEN_LOCATION'] = ['cookies']
         self.app.config['JWT_COOKIE_SECURE'] = False
@@ -29,29 +39,53 @@ class TriruleAPI:
         self.app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(days=7)
         
     def _initialize_extensions(self):
+        # Los after_request se ejecutan en orden inverso: las métricas, registradas primero, miden
+        # también el commit y la compresión
+        init_metrics(self.app)
+        init_compression(self.app)
         CORS(self.app, supports_credentials=True)
         self.jwt = JWTManager(self.app)
+        # Registrada antes que la unidad de trabajo para contar también las consultas del commit
+        init_query_audit(self.app)
+        init_unit_of_work(self.app)
         
-    def _create_tables(self):
-        try:
-            Base.metadata.create_all(engine)
-        except Exception as e:
-            print(f"Error en la base de datos: {e}")
-    
     def _register_controllers(self):
         self.app.add_url_rule('/', view_func=lambda: jsonify({'msg': 'API Trirule funcionando'}))
+        # Aciertos y fallos de la caché de respuestas y del directorio de categorías
+        self.app.add_url_rule('/cache/stats', 'cache_stats', view_func=lambda: jsonify({
+            **response_cache.stats(), 'category_directory': category_directory.stats()
+        }))
+        # Métricas en formato Prometheus
+        self.app.add_url_rule('/metrics', 'metrics', view_func=metrics_view)
+        # Cola y latencias del hash de contraseñas
+        self.app.add_url_rule('/passwords/stats', 'password_stats', view_func=lambda: jsonify(password_hasher.stats()))
+        
+        # Pool local para importaciones y exportaciones en segundo plano
+        self.jobs = JobManager()
         
         # Inicializar controladores
         AuthController(self.app)
         UserSettingsController(self.app)
         CategoryController(self.app)
-        TransactionController(self.app)
+        TransactionController(self.app, self.jobs)
         HistoryController(self.app)
+        JobController(self.app, self.jobs)
     
     def run(self, debug=False):
         self.app.run(host="0.0.0.0", debug=debug)
 
+
+def create_app():
+    """Factoría para el servidor WSGI (gunicorn -c gunicorn.conf.py); no toca el esquema, ver migrations.py"""
+    return TriruleAPI().app
+
+
 if __name__ == '__main__':
+    # Servidor de desarrollo: un solo proceso que también prepara el esquema
+    try:
+        init_database(engine)
+    except Exception as e:
+        print(f"Error en la base de datos: {e}")
     api = TriruleAPI()
     api.run(debug=True)
 
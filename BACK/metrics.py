@@ -0,0 +1,375 @@
+"""Métricas de las peticiones y de la base de datos en formato Prometheus.
+
+Por cada endpoint (nombre de la vista, p. ej. get_transactions) se registran
+peticiones por código de estado, un histograma de latencia y las peticiones en
+curso. Los eventos del motor de SQLAlchemy añaden el número de consultas, su
+duración, las filas que informa el driver y la espera para obtener una conexión
+del pool.
+
+Los valores se publican en GET /metrics y, para cada respuesta, en la cabecera
+Server-Timing (total, db y pool en milisegundos). En las respuestas en streaming
+la cabecera solo cubre lo ocurrido hasta empezar a enviar el cuerpo.
+
+Cada proceso acumula sus métricas en memoria. Con METRICS_DIRECTORY (gunicorn.conf.py
+lo fija) un hilo las escribe cada segundo en <pid>.json dentro de ese directorio y
+GET /metrics suma las de todos los procesos, sea cual sea el que atiende la petición.
+Cuando un proceso termina, el maestro de gunicorn pasa sus contadores a archive.json
+para que los totales no disminuyan.
+"""
+
+import json
+import os
+import tempfile
+import time
+import threading
+import uuid
+from collections import defaultdict
+from flask import g, has_app_context, request, Response
+from sqlalchemy import event
+from models import engine, replica_engines
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5)
+
+# Endpoint de las consultas hechas fuera de una petición (trabajos en segundo plano, scripts)
+BACKGROUND = 'background'
+
+# Contadores de los procesos terminados
+ARCHIVE = 'archive.json'
+# Ids de los últimos procesos archivados: una lectura que coincide con el archivado no los cuenta dos veces
+ARCHIVED_IDS = 100
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # etiquetas -> [cuentas por cubo..., +Inf], suma
+        self.counts = defaultdict(lambda: [0] * (len(buckets) + 1))
+        self.sums = defaultdict(float)
+
+    def observe(self, labels, value):
+        counts = self.counts[labels]
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[index] += 1
+        counts[-1] += 1
+        self.sums[labels] += value
+
+
+class Metrics:
+    COUNTERS = ('requests', 'queries', 'query_seconds', 'rows', 'pool_wait_seconds')
+    GAUGES = ('in_flight',)
+    HISTOGRAMS = ('latency', 'query_latency')
+    FLUSH_SECONDS = 1
+
+    def __init__(self, directory=None):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        # Identifica el archivo de este proceso aunque el sistema reutilice su pid
+        self.id = uuid.uuid4().hex
+        self.changed = False
+        self.flusher = None
+        self.requests = defaultdict(int)          # (endpoint, método, estado)
+        self.in_flight = defaultdict(int)         # (endpoint,)
+        self.latency = Histogram(LATENCY_BUCKETS)  # (endpoint, método)
+        self.queries = defaultdict(int)           # (endpoint,)
+        self.query_seconds = defaultdict(float)
+        self.rows = defaultdict(int)
+        self.pool_wait_seconds = defaultdict(float)
+        self.query_latency = Histogram(QUERY_BUCKETS)  # ()
+
+    def after_fork(self):
+        """El proceso hijo empieza sin las métricas del padre (y con un lock que nadie tiene)"""
+        self.lock = threading.Lock()
+        self._reset()
+
+    def request_started(self, endpoint):
+        with self.lock:
+            self.in_flight[(endpoint,)] += 1
+            self.changed = True
+
+    def request_finished(self, endpoint):
+        with self.lock:
+            self.in_flight[(endpoint,)] -= 1
+            self.changed = True
+
+    def observe_request(self, endpoint, method, status, seconds):
+        with self.lock:
+            self.requests[(endpoint, method, str(status))] += 1
+            self.latency.observe((endpoint, method), seconds)
+            self.changed = True
+
+    def observe_query(self, endpoint, seconds, rows):
+        with self.lock:
+            self.queries[(endpoint,)] += 1
+            self.query_seconds[(endpoint,)] += seconds
+            self.rows[(endpoint,)] += max(rows, 0)
+            self.query_latency.observe((), seconds)
+            self.changed = True
+
+    def observe_pool_wait(self, endpoint, seconds):
+        with self.lock:
+            self.pool_wait_seconds[(endpoint,)] += seconds
+            self.changed = True
+
+    def start_flushing(self):
+        """Arranca el hilo que escribe el archivo del proceso.
+
+        Solo lo hacen los procesos que atienden peticiones: el maestro de gunicorn no debe
+        tener hilos propios al crear los procesos por fork.
+        """
+        if not self.directory or self.flusher is not None:
+            return
+        with self.lock:
+            if self.flusher is None:
+                self.flusher = threading.Thread(target=self._flush, name='metrics-flush', daemon=True)
+                self.flusher.start()
+
+    def _flush(self):
+        while True:
+            time.sleep(self.FLUSH_SECONDS)
+            if self.changed:
+                self.save()
+
+    @property
+    def path(self):
+        return os.path.join(self.directory, f'{os.getpid()}.json')
+
+    def snapshot(self):
+        """Estado serializable en JSON: contadores, medidores e histogramas por etiquetas"""
+        with self.lock:
+            self.changed = False
+            state = {'id': self.id}
+            for name in self.COUNTERS + self.GAUGES:
+                state[name] = [[list(labels), value] for labels, value in getattr(self, name).items()]
+            for name in self.HISTOGRAMS:
+                histogram = getattr(self, name)
+                state[name] = [
+                    [list(labels), counts, histogram.sums[labels]] for labels, counts in histogram.counts.items()
+                ]
+            return state
+
+    def merge(self, state, gauges=True):
+        """Suma el estado de otro proceso; los medidores solo si el proceso sigue vivo"""
+        for name in self.COUNTERS + (self.GAUGES if gauges else ()):
+            values = getattr(self, name)
+            for labels, value in state.get(name, []):
+                values[tuple(labels)] += value
+        for name in self.HISTOGRAMS:
+            histogram = getattr(self, name)
+            for labels, counts, total in state.get(name, []):
+                labels = tuple(labels)
+                histogram.counts[labels] = [own + other for own, other in zip(histogram.counts[labels], counts)]
+                histogram.sums[labels] += total
+
+    def save(self):
+        _write_state(self.path, self.snapshot())
+
+    def clear_directory(self):
+        """Vacía METRICS_DIRECTORY al arrancar el servidor: los contadores empiezan de cero"""
+        os.makedirs(self.directory, exist_ok=True)
+        for name in os.listdir(self.directory):
+            if name.endswith(('.json', '.tmp')):
+                os.remove(os.path.join(self.directory, name))
+
+    def mark_process_dead(self, pid):
+        """Pasa a archive.json los contadores e histogramas de un proceso terminado y borra su archivo.
+
+        Solo lo llama el maestro de gunicorn (child_exit), así que archive.json no tiene
+        escrituras concurrentes. Las peticiones en curso del proceso se descartan.
+        """
+        path = os.path.join(self.directory, f'{pid}.json')
+        state = _read_state(path)
+        if state is None:
+            return
+        archive = Metrics()
+        stored = _read_state(os.path.join(self.directory, ARCHIVE)) or {'archived': []}
+        archive.merge(stored, gauges=False)
+        archive.merge(state, gauges=False)
+        archived = archive.snapshot()
+        archived['archived'] = (stored['archived'] + [state['id']])[-ARCHIVED_IDS:]
+        _write_state(os.path.join(self.directory, ARCHIVE), archived)
+        os.remove(path)
+
+    def render(self):
+        """Texto en el formato de exposición de Prometheus (de todos los procesos con METRICS_DIRECTORY)"""
+        if not self.directory:
+            return self._render()
+
+        self.save()
+        # Primero los archivos de los procesos y después el archivo: un proceso archivado
+        # entretanto aparece en archived y no se suma dos veces
+        states = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.json') and name != ARCHIVE:
+                state = _read_state(os.path.join(self.directory, name))
+                if state:
+                    states.append(state)
+        archive = _read_state(os.path.join(self.directory, ARCHIVE)) or {'archived': []}
+
+        total = Metrics()
+        total.merge(archive, gauges=False)
+        for state in states:
+            if state['id'] not in archive['archived']:
+                total.merge(state)
+        return total._render()
+
+    def _render(self):
+        lines = []
+        with self.lock:
+            self._counter(lines, 'trirule_http_requests_total', 'Peticiones atendidas', ('endpoint', 'method', 'status'), self.requests)
+            self._gauge(lines, 'trirule_http_requests_in_flight', 'Peticiones en curso', ('endpoint',), self.in_flight)
+            self._histogram(lines, 'trirule_http_request_duration_seconds', 'Latencia de las peticiones', ('endpoint', 'method'), self.latency)
+            self._counter(lines, 'trirule_db_queries_total', 'Consultas SQL ejecutadas', ('endpoint',), self.queries)
+            self._counter(lines, 'trirule_db_query_seconds_total', 'Tiempo en consultas SQL', ('endpoint',), self.query_seconds)
+            self._counter(lines, 'trirule_db_rows_total', 'Filas devueltas o modificadas según el driver', ('endpoint',), self.rows)
+            self._counter(lines, 'trirule_db_pool_wait_seconds_total', 'Espera para obtener una conexión del pool', ('endpoint',), self.pool_wait_seconds)
+            self._histogram(lines, 'trirule_db_query_duration_seconds', 'Duración de cada consulta SQL', (), self.query_latency)
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def _labels(names, values, extra=''):
+        pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+        if extra:
+            pairs.append(extra)
+        return '{' + ','.join(pairs) + '}' if pairs else ''
+
+    def _counter(self, lines, name, help_text, names, values, kind='counter'):
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        for labels, value in sorted(values.items()):
+            lines.append(f'{name}{self._labels(names, labels)} {value}')
+
+    def _gauge(self, lines, name, help_text, names, values):
+        self._counter(lines, name, help_text, names, values, kind='gauge')
+
+    def _histogram(self, lines, name, help_text, names, histogram):
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} histogram')
+        for labels, counts in sorted(histogram.counts.items()):
+            for bound, count in zip(histogram.buckets + ('+Inf',), counts):
+                bucket = f'le="{bound}"'
+                lines.append(f'{name}_bucket{self._labels(names, labels, bucket)} {count}')
+            lines.append(f'{name}_sum{self._labels(names, labels)} {histogram.sums[labels]}')
+            lines.append(f'{name}_count{self._labels(names, labels)} {counts[-1]}')
+
+
+def _read_state(path):
+    try:
+        with open(path, encoding='utf-8') as state_file:
+            return json.load(state_file)
+    except FileNotFoundError:
+        return None
+
+
+def _write_state(path, state):
+    """Escribe en un temporal y lo sustituye de una vez: nunca se lee un archivo a medias"""
+    descriptor, temporary = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    with os.fdopen(descriptor, 'w', encoding='utf-8') as output:
+        json.dump(state, output)
+    os.replace(temporary, path)
+
+
+metrics = Metrics(os.getenv('METRICS_DIRECTORY'))
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=metrics.after_fork)
+instrumented_engines = set()
+
+
+def _request_stats():
+    """Acumulados de la petición actual, o None fuera de una petición"""
+    if has_app_context():
+        return g.get('db_stats')
+    return None
+
+
+def _current_endpoint():
+    stats = _request_stats()
+    return stats['endpoint'] if stats else BACKGROUND
+
+
+def instrument_engine(engine):
+    """Registra los eventos de consultas y la espera del pool de un motor (una sola vez por motor)"""
+    if engine in instrumented_engines:
+        return
+    instrumented_engines.add(engine)
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        seconds = time.perf_counter() - conn.info['query_started'].pop()
+        rows = cursor.rowcount if cursor.rowcount is not None else -1
+        stats = _request_stats()
+        if stats:
+            stats['queries'] += 1
+            stats['query_seconds'] += seconds
+        metrics.observe_query(_current_endpoint(), seconds, rows)
+
+    def time_checkouts(engine):
+        # El pool no tiene evento previo a la espera: se mide la llamada a connect()
+        connect = engine.pool.connect
+
+        def timed_connect():
+            started = time.perf_counter()
+            try:
+                return connect()
+            finally:
+                seconds = time.perf_counter() - started
+                stats = _request_stats()
+                if stats:
+                    stats['pool_wait_seconds'] += seconds
+                metrics.observe_pool_wait(_current_endpoint(), seconds)
+
+        engine.pool.connect = timed_connect
+
+    time_checkouts(engine)
+    # dispose() sustituye el pool: se vuelve a medir el nuevo
+    event.listen(engine, 'engine_disposed', time_checkouts)
+
+
+def init_metrics(app):
+    for instrumented in [engine] + replica_engines:
+        instrument_engine(instrumented)
+
+    @app.before_request
+    def start_request():
+        endpoint = request.endpoint or 'unmatched'
+        g.db_stats = {
+            'endpoint': endpoint,
+            'started': time.perf_counter(),
+            'queries': 0,
+            'query_seconds': 0.0,
+            'pool_wait_seconds': 0.0
+        }
+        metrics.start_flushing()
+        metrics.request_started(endpoint)
+
+    @app.after_request
+    def record_request(response):
+        stats = g.get('db_stats')
+        if not stats:
+            return response
+        seconds = time.perf_counter() - stats['started']
+        metrics.observe_request(stats['endpoint'], request.method, response.status_code, seconds)
+        response.headers['Server-Timing'] = (
+            f'total;dur={seconds * 1000:.2f}, '
+            f'db;dur={stats["query_seconds"] * 1000:.2f};desc="{stats["queries"]} consultas", '
+            f'pool;dur={stats["pool_wait_seconds"] * 1000:.2f}'
+        )
+        return response
+
+    @app.teardown_request
+    def finish_request(exception=None):
+        stats = g.get('db_stats')
+        if stats:
+            metrics.request_finished(stats['endpoint'])
+
+
+def metrics_view():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
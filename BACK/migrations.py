@@ -0,0 +1,151 @@
+"""Migraciones versionadas del esquema.
+
+Base.metadata.create_all solo crea las tablas que no existen, así que cualquier
+cambio sobre tablas ya creadas (índices, columnas nuevas...) se añade aquí como
+una migración numerada. Las versiones aplicadas se guardan en schema_version.
+
+El esquema se prepara una vez por despliegue, no al arrancar cada proceso:
+    python migrations.py     # o el hook on_starting de gunicorn.conf.py
+"""
+
+from datetime import datetime
+from sqlalchemy import (
+    Table, Column, Integer, String, DateTime, MetaData, select, insert, update, inspect, text, func
+)
+from sqlalchemy.schema import AddConstraint
+from models import (
+    Base, engine as default_engine, User, UserSettings, Category, Transaction, TransactionTombstone, MonthHistory, YearHistory, DEFAULT_CURRENCY
+)
+
+migration_metadata = MetaData()
+
+schema_version = Table(
+    'schema_version', migration_metadata,
+    Column('version', Integer, primary_key=True),
+    Column('description', String(255), nullable=False),
+    Column('applied_at', DateTime, nullable=False)
+)
+
+
+def _index(model, name):
+    return next(index for index in model.__table__.indexes if index.name == name)
+
+
+def _create_indexes(*indexes):
+    def migrate(connection):
+        for index in indexes:
+            index.create(connection, checkfirst=True)
+    return migrate
+
+
+def _add_currency_columns(connection):
+    """Añade la moneda a transacciones e historiales, rellenándola con la moneda actual del usuario"""
+    inspector = inspect(connection)
+    quote = connection.dialect.identifier_preparer.quote
+
+    for model in (Transaction, MonthHistory, YearHistory):
+        table = model.__table__
+        if 'currency' in {column['name'] for column in inspector.get_columns(table.name)}:
+            continue
+        if connection.dialect.name != 'mysql':
+            raise NotImplementedError(f"Migración de moneda no soportada para {connection.dialect.name}")
+
+        connection.execute(text(
+            f"ALTER TABLE {quote(table.name)} ADD COLUMN currency VARCHAR(10) NOT NULL DEFAULT '{DEFAULT_CURRENCY}'"
+        ))
+        # Hasta ahora las cantidades se guardaban en la moneda configurada por el usuario
+        connection.execute(update(table).values(currency=func.coalesce(
+            select(UserSettings.currency).where(UserSettings.user_id == table.c.user_id).scalar_subquery(),
+            DEFAULT_CURRENCY
+        )))
+
+        # Los historiales pasan a tener una fila por moneda
+        if model is not Transaction:
+            new_constraint = next(
+                constraint for constraint in table.constraints
+                if getattr(constraint, 'name', None) and constraint.name.startswith('uq_')
+            )
+            old_columns = [column.name for column in new_constraint.columns if column.name != 'currency']
+            connection.execute(AddConstraint(new_constraint))
+            for constraint in inspector.get_unique_constraints(table.name):
+                if sorted(constraint['column_names']) == sorted(old_columns):
+                    connection.execute(text(f"ALTER TABLE {quote(table.name)} DROP INDEX {quote(constraint['name'])}"))
+
+
+def _add_columns(model, *names):
+    """ALTER TABLE ADD COLUMN con el tipo y el valor por defecto declarados en el modelo"""
+    def migrate(connection):
+        table = model.__table__
+        existing = {column['name'] for column in inspect(connection).get_columns(table.name)}
+        quote = connection.dialect.identifier_preparer.quote
+        for name in names:
+            if name in existing:
+                continue
+            column = table.c[name]
+            connection.execute(text(
+                f"ALTER TABLE {quote(table.name)} ADD COLUMN {quote(name)} "
+                f"{column.type.compile(connection.dialect)} NOT NULL DEFAULT {column.default.arg}"
+            ))
+    return migrate
+
+
+def _run_all(*migrations):
+    def migrate(connection):
+        for migration in migrations:
+            migration(connection)
+    return migrate
+
+
+# (versión, descripción, función que recibe la conexión)
+MIGRATIONS = [
+    (1, 'Índices compuestos para las consultas por usuario', _create_indexes(
+        _index(User, 'ix_user_username'),
+        _index(Category, 'ix_category_user_name'),
+        _index(Transaction, 'ix_transaction_user_date'),
+        _index(Transaction, 'ix_transaction_user_category'),
+        _index(MonthHistory, 'ix_month_history_user_year_month'),
+        _index(YearHistory, 'ix_year_history_user_year'),
+    )),
+    (2, 'Moneda de cada transacción e historiales por moneda', _add_currency_columns),
+    (3, 'Versiones de datos por usuario para los ETag', _run_all(
+        _add_columns(UserSettings, 'transactions_version', 'categories_version'),
+        _create_indexes(_index(Transaction, 'ix_transaction_user_updated')),
+    )),
+    (4, 'Versión de escritura de transacciones y eliminaciones para /transactions/changes', _run_all(
+        _add_columns(Transaction, 'sync_version'),
+        _add_columns(TransactionTombstone, 'sync_version'),
+        _create_indexes(
+            _index(Transaction, 'ix_transaction_user_sync'),
+            _index(TransactionTombstone, 'ix_transaction_tombstone_user_sync'),
+        ),
+    )),
+]
+
+
+def run_migrations(engine):
+    """Aplica, en orden, las migraciones que aún no constan en schema_version"""
+    with engine.begin() as connection:
+        schema_version.create(connection, checkfirst=True)
+        applied = set(connection.scalars(select(schema_version.c.version)))
+
+        for version, description, migrate in MIGRATIONS:
+            if version in applied:
+                continue
+            migrate(connection)
+            connection.execute(insert(schema_version).values(
+                version=version,
+                description=description,
+                applied_at=datetime.now()
+            ))
+            print(f"Migración {version} aplicada: {description}")
+
+
+def init_database(engine):
+    """Crea las tablas que falten y aplica las migraciones pendientes"""
+    Base.metadata.create_all(engine)
+    run_migrations(engine)
+
+
+if __name__ == '__main__':
+    init_database(default_engine)
+    print("Esquema actualizado")
@@ -1,9 +1,12 @@
 import os
 from sqlalchemy import (
     Column, Integer, String, ForeignKey, DateTime, Date, Float,
-    UniqueConstraint, Enum, create_engine
+    UniqueConstraint, Index, Enum, create_engine, event, make_url
 )
-from sqlalchemy.orm import relationship, declarative_base, sessionmaker, scoped_session
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.orm import relationship, declarative_base, sessionmaker, scoped_session, Session
 import enum
 from datetime import datetime
 from dotenv import load_dotenv
@@ -11,16 +14,106 @@ from dotenv import load_dotenv
 # Cargar variables de entorno desde el archivo .env
 load_dotenv()
 
-engine = create_engine(f'mysql+pymysql://{os.getenv("DB_USER")}:{os.getenv("DB_PASSWORD")}@{os.getenv("DB_HOST")}/{os.getenv("DB_NAME")}',
-        pool_pre_ping=True,  # Verifica conexiones antes de usarlas
-        pool_recycle=3600,   # Recicla conexiones cada 1 hora
-        echo=False
-    )
+pool_options = dict(
+    pool_size=int(os.getenv('DB_POOL_SIZE', 5)),         # Conexiones que se mantienen abiertas
+    max_overflow=int(os.getenv('DB_MAX_OVERFLOW', 10)),  # Conexiones extra en picos de carga
+    pool_timeout=int(os.getenv('DB_POOL_TIMEOUT', 30)),  # Segundos de espera por una conexión libre
+    # Ping antes de cada uso; innecesario si DB_POOL_RECYCLE es menor que el wait_timeout del servidor
+    pool_pre_ping=os.getenv('DB_POOL_PRE_PING', 'false').lower() in ('1', 'true'),
+    pool_recycle=int(os.getenv('DB_POOL_RECYCLE', 3600)),  # Recicla conexiones cada 1 hora
+    echo=False
+)
+
+# SQLite: WAL para que las lecturas no bloqueen a las escrituras y pragmas para acceso local rápido
+sqlite_pragmas = dict(
+    journal_mode='WAL',
+    synchronous=os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL'),                   # Seguro con WAL y sin fsync por commit
+    cache_size=-int(os.getenv('SQLITE_CACHE_SIZE_KB', 65536)),               # Negativo: tamaño en KiB
+    mmap_size=int(os.getenv('SQLITE_MMAP_SIZE_MB', 256)) * 1024 * 1024,
+    busy_timeout=int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', 5000)),            # Espera a otra escritura en curso
+    temp_store='MEMORY',
+    foreign_keys='ON'                                                       # Como en MySQL (InnoDB)
+)
+
+DATABASE_URL = os.getenv('DATABASE_URL') or (
+    f'mysql+pymysql://{os.getenv("DB_USER")}:{os.getenv("DB_PASSWORD")}@{os.getenv("DB_HOST")}/{os.getenv("DB_NAME")}'
+)
+
+
+def create_database_engine(url):
+    """Motor para la URL con el pool de conexiones compartidas; con SQLite además los pragmas de cada conexión"""
+    if make_url(url).get_backend_name() != 'sqlite':
+        return create_engine(url, **pool_options)
+
+    # Con un archivo SQLAlchemy usa QueuePool y permite usar cada conexión desde otro hilo
+    sqlite_engine = create_engine(url, **pool_options)
+
+    @event.listens_for(sqlite_engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in sqlite_pragmas.items():
+            cursor.execute(f'PRAGMA {name}={value}')
+        cursor.close()
+
+    return sqlite_engine
+
+
+engine = create_database_engine(DATABASE_URL)
+
+# Réplicas de solo lectura (URLs separadas por comas); sin réplicas todo va al primario
+replica_engines = [
+    create_database_engine(url.strip())
+    for url in os.getenv('DB_REPLICA_URLS', '').split(',') if url.strip()
+]
+
+
+def dispose_engines():
+    """Vacía los pools tras un fork sin cerrar las conexiones heredadas, que siguen siendo del proceso padre"""
+    for database_engine in [engine] + replica_engines:
+        database_engine.dispose(close=False)
+
+
+class RoutingSession(Session):
+    """Sesión que envía las consultas a la réplica guardada en info['replica'].
+
+    Los flush (escrituras del ORM) van siempre al primario, igual que las consultas con un
+    bind explícito (bind_arguments={'bind': engine}) que no admiten el retraso de la réplica.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kw):
+        replica = self.info.get('replica')
+        if replica is not None and bind is None and not self._flushing:
+            return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kw)
+
 
 Base = declarative_base()
-SessionFactory = sessionmaker(bind=engine)
+SessionFactory = sessionmaker(bind=engine, class_=RoutingSession)
 session = scoped_session(SessionFactory)
 
+
+def upsert(model, keys, update):
+    """INSERT que, si ya existe una fila con las columnas keys, la actualiza (ON DUPLICATE KEY / ON CONFLICT).
+
+    update(table, new) devuelve las columnas a actualizar; new son los valores que se intentaban insertar.
+    Se construye sobre la tabla (Core) para poder ejecutarlo con una lista de filas en un único executemany.
+    """
+    dialect = session.get_bind().dialect.name
+    table = model.__table__
+
+    if dialect == 'mysql':
+        statement = mysql_insert(table)
+        return statement.on_duplicate_key_update(**update(table, statement.inserted))
+
+    if dialect in ('sqlite', 'postgresql'):
+        statement = (sqlite_insert if dialect == 'sqlite' else postgresql_insert)(table)
+        return statement.on_conflict_do_update(index_elements=keys, set_=update(table, statement.excluded))
+
+    raise NotImplementedError(f"Upsert no soportado para el dialecto {dialect}")
+
+# Moneda con la que se crean las cuentas y se rellenan los datos previos a la multimoneda
+DEFAULT_CURRENCY = "EUR"
+
 # Enum para el tipo de categoría
 class CategoryType(enum.Enum):
     need = "need"
@@ -35,12 +128,13 @@ class TransactionKind(enum.Enum):
 # -------------------- USER --------------------
 class User(Base):
     __tablename__ = 'user'
+    __table_args__ = (Index('ix_user_username', 'username'),)
 
     id = Column(Integer, primary_key=True)
     username = Column(String(50), nullable=False)
     email = Column(String(120), nullable=False, unique=True)
     password = Column(String(255), nullable=False)
-    created_at = Column(DateTime, default=datetime.now())
+    created_at = Column(DateTime, default=datetime.now)
 
     settings = relationship("UserSettings", back_populates="user", uselist=False)
     categories = relationship("Category", back_populates="user")
@@ -53,17 +147,36 @@ class UserSettings(Base):
     __tablename__ = 'user_settings'
 
     user_id = Column(Integer, ForeignKey('user.id'), primary_key=True)
-    currency = Column(String(10), default="EUR")
+    currency = Column(String(10), default=DEFAULT_CURRENCY)
+    # Versiones de los datos del usuario; cada escritura las incrementa y forman parte de los ETag
+    transactions_version = Column(Integer, nullable=False, default=0)
+    categories_version = Column(Integer, nullable=False, default=0)
 
     user = relationship("User", back_populates="settings")
 
+# -------------------- EXCHANGE RATE --------------------
+class ExchangeRate(Base):
+    """Tipos de cambio de cada usuario: unidades de la moneda por unidad de su moneda de referencia.
+
+    Una moneda sin fila se considera la de referencia (tipo 1).
+    """
+    __tablename__ = 'exchange_rate'
+
+    user_id = Column(Integer, ForeignKey('user.id'), primary_key=True)
+    currency = Column(String(10), primary_key=True)
+    rate = Column(Float, nullable=False)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+
 # -------------------- CATEGORY --------------------
 class Category(Base):
     __tablename__ = 'category'
-    __table_args__ = (UniqueConstraint('name', 'type', 'user_id'),)
+    __table_args__ = (
+        UniqueConstraint('name', 'type', 'user_id'),
+        Index('ix_category_user_name', 'user_id', 'name'),
+    )
 
     id = Column(Integer, primary_key=True)
-    created_at = Column(DateTime, default=datetime.now())
+    created_at = Column(DateTime, default=datetime.now)
     name = Column(String(50), nullable=False)
     color = Column(String(50), nullable=True)
     type = Column(Enum(CategoryType), nullable=False)
@@ -76,11 +189,19 @@ class Category(Base):
 # -------------------- TRANSACTION --------------------
 class Transaction(Base):
     __tablename__ = 'transaction'
+    __table_args__ = (
+        Index('ix_transaction_user_date', 'user_id', 'date'),
+        Index('ix_transaction_user_category', 'user_id', 'category_id'),
+        Index('ix_transaction_user_updated', 'user_id', 'updated_at'),
+        Index('ix_transaction_user_sync', 'user_id', 'sync_version'),
+    )
 
     id = Column(Integer, primary_key=True)
-    created_at = Column(DateTime, default=datetime.now())
-    updated_at = Column(DateTime, default=datetime.now(), onupdate=datetime.now())
+    created_at = Column(DateTime, default=datetime.now)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
     amount = Column(Float, nullable=False)
+    # Moneda en la que se registró la cantidad; se convierte a la moneda del usuario al leer
+    currency = Column(String(10), nullable=False, default=DEFAULT_CURRENCY)
     description = Column(String(255), nullable=True)
     date = Column(Date, nullable=False)
 
@@ -92,16 +213,38 @@ class Transaction(Base):
     category_id = Column(Integer, ForeignKey('category.id'))
     category = relationship("Category", back_populates="transactions")
 
+    # transactions_version del usuario en la escritura que creó o modificó la fila (cursor de /transactions/changes)
+    sync_version = Column(Integer, nullable=False, default=0)
+
+# -------------------- TRANSACTION TOMBSTONE --------------------
+class TransactionTombstone(Base):
+    """Registro de transacciones eliminadas para la sincronización incremental"""
+    __tablename__ = 'transaction_tombstone'
+    __table_args__ = (
+        Index('ix_transaction_tombstone_user_deleted', 'user_id', 'deleted_at'),
+        Index('ix_transaction_tombstone_user_sync', 'user_id', 'sync_version'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey('user.id'), nullable=False)
+    transaction_id = Column(Integer, nullable=False)
+    deleted_at = Column(DateTime, nullable=False, default=datetime.now)
+    sync_version = Column(Integer, nullable=False, default=0)
+
 # -------------------- MONTH HISTORY --------------------
 class MonthHistory(Base):
     __tablename__ = 'month_history'
-    __table_args__ = (UniqueConstraint('user_id', 'day', 'month', 'year'),)
+    __table_args__ = (
+        UniqueConstraint('user_id', 'day', 'month', 'year', 'currency', name='uq_month_history_day_currency'),
+        Index('ix_month_history_user_year_month', 'user_id', 'year', 'month', 'day'),
+    )
 
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey('user.id'), nullable=False)
     day = Column(Integer, nullable=False)
     month = Column(Integer, nullable=False)
     year = Column(Integer, nullable=False)
+    currency = Column(String(10), nullable=False, default=DEFAULT_CURRENCY)
     income = Column(Float, default=0)
     expense = Column(Float, default=0)
 
@@ -110,12 +253,16 @@ class MonthHistory(Base):
 # -------------------- YEAR HISTORY --------------------
 class YearHistory(Base):
     __tablename__ = 'year_history'
-    __table_args__ = (UniqueConstraint('user_id', 'month', 'year'),)
+    __table_args__ = (
+        UniqueConstraint('user_id', 'month', 'year', 'currency', name='uq_year_history_month_currency'),
+        Index('ix_year_history_user_year', 'user_id', 'year', 'month'),
+    )
 
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey('user.id'), nullable=False)
     month = Column(Integer, nullable=False) 
     year = Column(Integer, nullable=False)
+    currency = Column(String(10), nullable=False, default=DEFAULT_CURRENCY)
     income = Column(Float, default=0)
     expense = Column(Float, default=0)
 
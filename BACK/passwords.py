@@ -0,0 +1,97 @@
+"""Hash y verificación de contraseñas con bcrypt fuera del hilo de la petición.
+
+bcrypt consume CPU durante decenas de milisegundos por llamada. Las llamadas se
+ejecutan en un pool de hilos propio (bcrypt libera el GIL mientras calcula) con
+un límite de operaciones en curso: si el pool y su cola están llenos se lanza
+PasswordHasherBusy de inmediato y el controlador responde 503, en lugar de
+acumular peticiones esperando.
+
+El coste (BCRYPT_ROUNDS) se puede cambiar en cualquier momento: los hashes con
+otro coste se siguen verificando y se rehacen al iniciar sesión.
+"""
+
+import os
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import bcrypt
+
+
+class PasswordHasherBusy(Exception):
+    """El pool de hash está saturado"""
+
+
+class PasswordHasher:
+    def __init__(self, workers=None, queue_size=None, rounds=None, samples=1000):
+        workers = workers or int(os.getenv('PASSWORD_HASH_WORKERS', os.cpu_count() or 2))
+        queue_size = queue_size if queue_size is not None else int(os.getenv('PASSWORD_HASH_QUEUE', workers * 4))
+        self.rounds = rounds or int(os.getenv('BCRYPT_ROUNDS', 12))
+        self.workers = workers
+        self.max_pending = workers + queue_size
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='bcrypt')
+        self.slots = threading.BoundedSemaphore(self.max_pending)
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.rejected = 0
+        # operación -> últimas duraciones en segundos (incluida la espera en cola)
+        self.latencies = {'hash': deque(maxlen=samples), 'check': deque(maxlen=samples)}
+
+    def hash(self, password):
+        hashed = self._run('hash', bcrypt.hashpw, password.encode('utf-8'), bcrypt.gensalt(self.rounds))
+        return hashed.decode('utf-8')
+
+    def check(self, password, hashed):
+        return self._run('check', bcrypt.checkpw, password.encode('utf-8'), hashed.encode('utf-8'))
+
+    def needs_rehash(self, hashed):
+        """True si el hash se generó con un coste distinto del configurado ($2b$<coste>$...)"""
+        try:
+            return int(hashed.split('$')[2]) != self.rounds
+        except (IndexError, ValueError):
+            return True
+
+    def _run(self, operation, func, *args):
+        if not self.slots.acquire(blocking=False):
+            with self.lock:
+                self.rejected += 1
+            raise PasswordHasherBusy()
+
+        start = time.perf_counter()
+        with self.lock:
+            self.pending += 1
+        try:
+            return self.executor.submit(func, *args).result()
+        finally:
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                self.pending -= 1
+                self.latencies[operation].append(elapsed)
+            self.slots.release()
+
+    def stats(self):
+        with self.lock:
+            latencies = {operation: sorted(samples) for operation, samples in self.latencies.items()}
+            stats = {
+                'rounds': self.rounds,
+                'workers': self.workers,
+                'max_pending': self.max_pending,
+                'pending': self.pending,
+                'rejected': self.rejected
+            }
+        for operation, samples in latencies.items():
+            stats[operation] = {
+                'count': len(samples),
+                **{f'p{p}_ms': self._percentile(samples, p) for p in (50, 95, 99)}
+            }
+        return stats
+
+    @staticmethod
+    def _percentile(samples, percentile):
+        if not samples:
+            return None
+        index = min(len(samples) - 1, int(len(samples) * percentile / 100))
+        return round(samples[index] * 1000, 2)
+
+
+password_hasher = PasswordHasher()
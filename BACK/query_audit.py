@@ -0,0 +1,115 @@
+"""Detector de consultas N+1 y consultas lentas, para desarrollo y despliegues canary.
+
+Está desactivado salvo que QUERY_AUDIT=1. Durante cada petición agrupa las
+sentencias SQL por su huella (el SQL sin espacios sobrantes y con las listas de
+parámetros y los números reducidos a ?) y al terminar avisa de:
+- las huellas ejecutadas más de QUERY_AUDIT_REPEAT veces (posible N+1);
+- las consultas más lentas que QUERY_AUDIT_SLOW_MS, con sus parámetros y el plan
+  de EXPLAIN, en el momento en que terminan;
+- los endpoints que superan el presupuesto declarado con @query_budget(n).
+
+Con QUERY_AUDIT_STRICT=1 superar el presupuesto o repetir una sentencia convierte
+la respuesta en un 500, de modo que un script de pruebas falle. Las consultas
+hechas mientras se envía una respuesta en streaming no se cuentan.
+"""
+
+import os
+import re
+import time
+from collections import Counter
+from flask import g, has_app_context, jsonify, request
+from sqlalchemy import event
+from models import engine, replica_engines
+
+# Listas de parámetros (IN (?, ?, ?), VALUES (%s, %s)) y literales numéricos
+_PARAMETER_LIST = re.compile(r"\(\s*(?:\?|%s|%\(\w+\)s|:\w+)(?:\s*,\s*(?:\?|%s|%\(\w+\)s|:\w+))*\s*\)")
+_NUMBER = re.compile(r"\b\d+\b")
+
+
+def query_budget(max_queries):
+    """Declara el número máximo de consultas SQL de una vista (va debajo de los demás decoradores)"""
+    def decorator(view):
+        view.query_budget = max_queries
+        return view
+    return decorator
+
+
+def fingerprint(statement):
+    statement = ' '.join(statement.split())
+    return _NUMBER.sub('?', _PARAMETER_LIST.sub('(?)', statement))
+
+
+def _explain(connection, statement, parameters):
+    """Plan de la consulta en una conexión aparte (la actual puede tener un cursor abierto)"""
+    prefix = 'EXPLAIN QUERY PLAN ' if connection.dialect.name == 'sqlite' else 'EXPLAIN '
+    try:
+        with connection.engine.connect() as explain_connection:
+            explain_connection.info['query_audit_skip'] = True
+            rows = explain_connection.exec_driver_sql(prefix + statement, parameters).all()
+        return '\n'.join('    ' + ' | '.join(str(value) for value in row) for row in rows)
+    except Exception as e:
+        return f"    (EXPLAIN no disponible: {e})"
+
+
+def init_query_audit(app):
+    if os.getenv('QUERY_AUDIT', 'false').lower() not in ('1', 'true'):
+        return
+
+    repeat_threshold = int(os.getenv('QUERY_AUDIT_REPEAT', 5))
+    slow_seconds = float(os.getenv('QUERY_AUDIT_SLOW_MS', 100)) / 1000
+    strict = os.getenv('QUERY_AUDIT_STRICT', 'false').lower() in ('1', 'true')
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_audit_started', []).append(time.perf_counter())
+
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        seconds = time.perf_counter() - conn.info['query_audit_started'].pop()
+        if conn.info.get('query_audit_skip'):
+            return
+
+        audit = g.get('query_audit') if has_app_context() else None
+        if audit is not None:
+            audit['queries'] += 1
+            audit['fingerprints'][fingerprint(statement)] += 1
+
+        if seconds > slow_seconds and not executemany and statement.lstrip().upper().startswith('SELECT'):
+            endpoint = audit['endpoint'] if audit is not None else 'background'
+            print(
+                f"[query-audit] {endpoint}: consulta lenta ({seconds * 1000:.1f} ms)\n"
+                f"    {' '.join(statement.split())}\n"
+                f"    parámetros: {parameters!r}\n"
+                f"{_explain(conn, statement, parameters)}"
+            )
+
+    for audited in [engine] + replica_engines:
+        event.listen(audited, 'before_cursor_execute', before_cursor_execute)
+        event.listen(audited, 'after_cursor_execute', after_cursor_execute)
+
+    @app.before_request
+    def start_audit():
+        g.query_audit = {'endpoint': request.endpoint or 'unmatched', 'queries': 0, 'fingerprints': Counter()}
+
+    @app.after_request
+    def check_audit(response):
+        audit = g.pop('query_audit', None)
+        if audit is None:
+            return response
+
+        problems = []
+        for statement, count in audit['fingerprints'].most_common():
+            if count <= repeat_threshold:
+                break
+            problems.append(f"sentencia repetida {count} veces (posible N+1): {statement[:300]}")
+
+        view = app.view_functions.get(request.endpoint)
+        budget = getattr(view, 'query_budget', None)
+        if budget is not None and audit['queries'] > budget:
+            problems.append(f"{audit['queries']} consultas, presupuesto {budget}")
+
+        for problem in problems:
+            print(f"[query-audit] {audit['endpoint']}: {problem}")
+
+        if strict and problems:
+            response = jsonify({'msg': 'Auditoría de consultas fallida', 'problems': problems})
+            response.status_code = 500
+        return response
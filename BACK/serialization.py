@@ -0,0 +1,44 @@
+"""Serialización JSON rápida para todas las respuestas.
+
+OrjsonProvider sustituye al proveedor JSON de Flask, así que jsonify usa orjson:
+las fechas, los datetime y los Enum se codifican directamente (ISO 8601 y su
+valor), sin llamar a isoformat() fila a fila.
+"""
+
+from decimal import Decimal
+import orjson
+from flask.json.provider import JSONProvider
+
+OPTIONS = orjson.OPT_NON_STR_KEYS
+
+
+def _default(value):
+    # SUM/ROUND de MySQL pueden devolver Decimal
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"Tipo no serializable: {type(value).__name__}")
+
+
+def dumps(value):
+    return orjson.dumps(value, default=_default, option=OPTIONS)
+
+
+class OrjsonProvider(JSONProvider):
+    def dumps(self, obj, **kwargs):
+        return dumps(obj).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        # Se codifica directamente a bytes, sin pasar por str
+        return self._app.response_class(dumps(self._prepare_response_obj(args, kwargs)), mimetype='application/json')
+
+
+def columnar(rows, columns):
+    """Convierte filas de SQLAlchemy en un diccionario de listas paralelas con esas columnas"""
+    if not rows:
+        return {column: [] for column in columns}
+    fields = rows[0]._fields
+    transposed = list(zip(*rows))
+    return {column: transposed[fields.index(column)] for column in columns}
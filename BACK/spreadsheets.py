@@ -0,0 +1,97 @@
+"""Lectura y escritura de hojas .xlsx con openpyxl.
+
+openpyxl es Python puro y retiene el GIL, así que en los trabajos en segundo plano
+estas funciones se ejecutan en un proceso aparte (JobManager.run_in_process) y no
+compiten con los hilos que atienden peticiones. Entre procesos los datos viajan
+en archivos de bloques: una secuencia de objetos pickle escritos y leídos por la
+propia aplicación.
+"""
+
+import pickle
+from itertools import chain, islice
+import pandas as pd
+from openpyxl import Workbook, load_workbook
+from openpyxl.utils import get_column_letter
+
+
+def read_xlsx_chunks(file, chunk_size):
+    """Genera DataFrames de como mucho chunk_size filas de la hoja activa sin cargarla completa.
+
+    El índice de cada DataFrame es la posición de la fila de datos en la hoja, de modo
+    que los errores siguen indicando la fila original.
+    """
+    workbook = load_workbook(file, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = next(rows, None) or ()
+        columns = [str(value).strip() if value is not None else '' for value in header]
+
+        chunk = []
+        indexes = []
+        chunk_count = 0
+        for index, row in enumerate(rows):
+            # Las filas vacías se ignoran, igual que hace pandas.read_excel
+            if all(value is None for value in row):
+                continue
+            chunk.append(row[:len(columns)] + (None,) * (len(columns) - len(row)))
+            indexes.append(index)
+            if len(chunk) == chunk_size:
+                yield pd.DataFrame(chunk, columns=columns, index=indexes)
+                chunk_count += 1
+                chunk = []
+                indexes = []
+
+        # Siempre se genera al menos un bloque para poder validar las columnas
+        if chunk or not chunk_count:
+            yield pd.DataFrame(chunk, columns=columns, index=indexes)
+    finally:
+        workbook.close()
+
+
+def write_xlsx(rows, output, columns, width_sample):
+    """Escribe rows (listas de valores en el orden de columns) como una hoja write-only en output"""
+    rows = iter(rows)
+    # Las primeras filas sirven de muestra para estimar el ancho de las columnas
+    sample = list(islice(rows, width_sample))
+
+    workbook = Workbook(write_only=True)
+    worksheet = workbook.create_sheet('Transacciones')
+    for col_idx, column in enumerate(columns):
+        column_length = max([len(column)] + [len(str(row[col_idx])) for row in sample])
+        worksheet.column_dimensions[get_column_letter(col_idx + 1)].width = column_length + 2
+
+    worksheet.append(columns)
+    for row in chain(sample, rows):
+        worksheet.append(row)
+    workbook.save(output)
+
+
+def write_chunk_file(chunks, path):
+    """Guarda los bloques en path; devuelve cuántos se han escrito"""
+    count = 0
+    with open(path, 'wb') as output:
+        for chunk in chunks:
+            pickle.dump(chunk, output, protocol=pickle.HIGHEST_PROTOCOL)
+            count += 1
+    return count
+
+
+def read_chunk_file(path):
+    with open(path, 'rb') as file:
+        while True:
+            try:
+                yield pickle.load(file)
+            except EOFError:
+                return
+
+
+def xlsx_to_chunk_file(xlsx_path, chunk_size, path):
+    """Lee la hoja de xlsx_path y guarda sus bloques (DataFrames) en path"""
+    with open(xlsx_path, 'rb') as file:
+        return write_chunk_file(read_xlsx_chunks(file, chunk_size), path)
+
+
+def chunk_file_to_xlsx(path, xlsx_path, columns, width_sample):
+    """Escribe en xlsx_path las filas de los bloques (listas de filas) guardados en path"""
+    with open(xlsx_path, 'wb') as output:
+        write_xlsx(chain.from_iterable(read_chunk_file(path)), output, columns, width_sample)
@@ -0,0 +1,93 @@
+"""Fixtures comunes: la API real contra una base de datos de pruebas.
+
+Por defecto se usa un SQLite temporal; con TEST_DATABASE_URL se puede apuntar a
+una base de datos vacía de pruebas (p. ej. MySQL). Las variables se fijan antes
+de importar models, que crea el motor al importarse.
+"""
+
+import os
+import sqlite3
+import tempfile
+import uuid
+
+os.environ['DATABASE_URL'] = os.getenv('TEST_DATABASE_URL') or f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'tests.db')}"
+os.environ['DB_REPLICA_URLS'] = ''
+os.environ.setdefault('JWT_SECRET_KEY', 'clave-de-pruebas-' + 'x' * 32)
+os.environ.setdefault('BCRYPT_ROUNDS', '4')
+
+import pytest
+from sqlalchemy import event
+from models import engine, replica_engines, create_database_engine
+from migrations import init_database
+
+PASSWORD = 'Pruebas1!'
+
+
+def pytest_addoption(parser):
+    parser.addoption('--scales', default='1000', help='Transacciones por escala en tests/test_benchmark.py, separadas por comas')
+    parser.addoption('--resources-baseline', help='JSON de pytest-benchmark con las consultas y la memoria de referencia')
+    parser.addoption('--resources-budget', type=float, default=0.2, help='Aumento de memoria permitido respecto a la línea base (0.2 = 20 %%)')
+
+
+@pytest.fixture(scope='session')
+def app():
+    init_database(engine)
+    from index import create_app
+    app = create_app()
+    app.config['TESTING'] = True
+    return app
+
+
+def register(app):
+    """Cliente de pruebas con un usuario nuevo ya autenticado (la cookie del registro)"""
+    client = app.test_client()
+    name = 'u' + uuid.uuid4().hex[:12]
+    response = client.post('/register', json={'username': name, 'email': f'{name}@pruebas.local', 'password': PASSWORD})
+    assert response.status_code == 201, response.json
+    client.user_id = response.json['user']['id']
+    client.email = f'{name}@pruebas.local'
+    return client
+
+
+@pytest.fixture
+def client(app):
+    return register(app)
+
+
+@pytest.fixture
+def statements():
+    """Sentencias SQL (sentencia, parámetros) ejecutadas durante la prueba, sin las executemany"""
+    executed = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if not executemany:
+            executed.append((statement, parameters))
+
+    event.listen(engine, 'before_cursor_execute', record)
+    yield executed
+    event.remove(engine, 'before_cursor_execute', record)
+
+
+@pytest.fixture
+def lagging_replica():
+    """Réplica SQLite que no recibe las escrituras: copia de la base de datos al llamar a sync().
+
+    Mientras dura la prueba las lecturas sin la cookie read_primary van a esta réplica.
+    """
+    if engine.dialect.name != 'sqlite':
+        pytest.skip('La réplica simulada copia un archivo SQLite')
+    path = os.path.join(tempfile.mkdtemp(), 'replica.db')
+
+    def sync():
+        source, target = sqlite3.connect(engine.url.database), sqlite3.connect(path)
+        source.backup(target)
+        source.close()
+        target.close()
+
+    sync()
+    replica = create_database_engine(f'sqlite:///{path}')
+    replica.sync = sync
+    replica_engines.append(replica)
+    yield replica
+    replica_engines.remove(replica)
+    replica.dispose()
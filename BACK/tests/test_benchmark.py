@@ -0,0 +1,211 @@
+"""Benchmark de los endpoints con pytest-benchmark.
+
+Siembra un usuario por escala con transacciones con la forma de
+transacciones_2_anios.xlsx (generate_data.py, a través de la importación) y mide
+cada endpoint, importación y exportaciones incluidas: el tiempo con
+pytest-benchmark y, en extra_info, el número de consultas y la memoria máxima.
+La caché de respuestas se desactiva durante la medición.
+
+pytest.ini desactiva los benchmarks (--benchmark-disable): en la ejecución normal
+cada caso se ejecuta una vez, sin medir. Para medir y comparar con una línea base:
+
+    pytest tests/test_benchmark.py --benchmark-enable --scales=1000,100000 --benchmark-save=base
+    pytest tests/test_benchmark.py --benchmark-enable --scales=1000,100000 \\
+        --benchmark-compare=0001 --benchmark-compare-fail=median:20% \\
+        --resources-baseline=.benchmarks/<máquina>/0001_base.json
+
+--benchmark-compare-fail falla si el tiempo empeora respecto a la línea base;
+--resources-baseline si un caso hace más consultas que en ella o usa más memoria
+que en ella más --resources-budget.
+"""
+
+import io
+import json
+import tracemalloc
+from functools import lru_cache
+import pytest
+from sqlalchemy import event
+from cache import response_cache
+from models import engine
+from generate_data import generate, fixture
+from conftest import register, PASSWORD
+
+CASES = [
+    'GET /check-auth',
+    'GET /profile',
+    'GET /settings',
+    'GET /categories',
+    'GET /categories/<id>',
+    'GET /transactions',
+    'GET /transactions?format=columnar',
+    'GET /transactions?limit=50',
+    'GET /transactions?sort_by=category',
+    'GET /transactions?search',
+    'GET /transactions/<id>',
+    'GET /transactions/summary',
+    'GET /transactions/changes',
+    'GET /history/monthly',
+    'GET /history/yearly',
+    'GET /transactions/export?format=csv',
+    'GET /transactions/export?format=ndjson',
+    'GET /transactions/export?format=xlsx',
+    'GET /transactions/export?format=parquet',
+    'POST /transactions',
+    'PUT /transactions/<id>',
+    'DELETE /transactions/<id>',
+    'PUT /settings',
+    'POST /transactions/import (1000 filas)',
+    'POST /login',
+]
+
+
+def pytest_generate_tests(metafunc):
+    if 'scale' in metafunc.fixturenames:
+        scales = [int(scale) for scale in metafunc.config.getoption('scales').split(',')]
+        metafunc.parametrize('scale', scales, scope='module')
+
+
+def transactions_frame(count, seed=0):
+    """DataFrame con las columnas de transacciones_2_anios.xlsx (dos años hasta hoy)"""
+    return fixture(generate(users=1, per_user=count, spread=0, seed=seed))
+
+
+def parquet_upload(df):
+    buffer = io.BytesIO()
+    df.to_parquet(buffer, index=False)
+    buffer.seek(0)
+    return buffer
+
+
+@lru_cache
+def load_baseline(path):
+    """extra_info de cada caso (por nodeid) de un JSON guardado con --benchmark-save o --benchmark-json"""
+    with open(path, encoding='utf-8') as baseline_file:
+        return {benchmark['fullname']: benchmark['extra_info'] for benchmark in json.load(baseline_file)['benchmarks']}
+
+
+@pytest.fixture(scope='module', autouse=True)
+def uncached_responses():
+    # Las respuestas se miden sin la caché de respuestas (el directorio de categorías sí se usa)
+    ttl = response_cache.ttl
+    response_cache.ttl = 0
+    yield
+    response_cache.ttl = ttl
+
+
+@pytest.fixture(scope='module')
+def seeded(app, scale):
+    """Usuario con `scale` transacciones importadas"""
+    client = register(app)
+    upload = parquet_upload(transactions_frame(scale, seed=scale))
+    response = client.post('/transactions/import', data={'file': (upload, 'seed.parquet')})
+    assert response.status_code == 200, response.json
+    return client
+
+
+@pytest.fixture
+def query_counter():
+    counter = {'queries': 0}
+
+    def count(*args):
+        counter['queries'] += 1
+
+    event.listen(engine, 'before_cursor_execute', count)
+    yield counter
+    event.remove(engine, 'before_cursor_execute', count)
+
+
+def build_cases(client, scale):
+    """Función que devuelve (método, ruta, argumentos) de la petición de cada caso"""
+    category_id = client.get('/categories').json[0]['id']
+    transaction_id = client.get('/transactions?limit=1').json['transactions'][0]['id']
+    created = []
+
+    def fixed(method, path, **kwargs):
+        return lambda: (method, path, kwargs)
+
+    def new_transaction():
+        response = client.post('/transactions', json={'amount': 10, 'kind': 'expense', 'date': '2024-01-01'})
+        created.append(response.json['transaction']['id'])
+
+    def delete_transaction():
+        new_transaction()
+        return 'DELETE', f'/transactions/{created.pop()}', {}
+
+    def update_transaction():
+        if not created:
+            new_transaction()
+        return 'PUT', f'/transactions/{created[-1]}', {'json': {'amount': 20, 'date': '2024-01-02'}}
+
+    import_frame = []
+
+    def import_transactions():
+        if not import_frame:
+            import_frame.append(transactions_frame(1000, seed=scale + 1))
+        return 'POST', '/transactions/import', {'data': {'file': (parquet_upload(import_frame[0]), 'bench.parquet')}}
+
+    return {
+        'GET /check-auth': fixed('GET', '/check-auth'),
+        'GET /profile': fixed('GET', '/profile'),
+        'GET /settings': fixed('GET', '/settings'),
+        'GET /categories': fixed('GET', '/categories'),
+        'GET /categories/<id>': fixed('GET', f'/categories/{category_id}'),
+        'GET /transactions': fixed('GET', '/transactions'),
+        'GET /transactions?format=columnar': fixed('GET', '/transactions?format=columnar'),
+        'GET /transactions?limit=50': fixed('GET', '/transactions?limit=50'),
+        'GET /transactions?sort_by=category': fixed('GET', '/transactions?limit=50&sort_by=category'),
+        'GET /transactions?search': fixed('GET', '/transactions?limit=50&search=Super'),
+        'GET /transactions/<id>': fixed('GET', f'/transactions/{transaction_id}'),
+        'GET /transactions/summary': fixed('GET', '/transactions/summary'),
+        'GET /transactions/changes': fixed('GET', '/transactions/changes'),
+        'GET /history/monthly': fixed('GET', '/history/monthly'),
+        'GET /history/yearly': fixed('GET', '/history/yearly'),
+        'GET /transactions/export?format=csv': fixed('GET', '/transactions/export?format=csv'),
+        'GET /transactions/export?format=ndjson': fixed('GET', '/transactions/export?format=ndjson'),
+        'GET /transactions/export?format=xlsx': fixed('GET', '/transactions/export?format=xlsx'),
+        'GET /transactions/export?format=parquet': fixed('GET', '/transactions/export?format=parquet'),
+        'POST /transactions': fixed('POST', '/transactions', json={
+            'amount': 12.5, 'kind': 'expense', 'date': '2024-01-01', 'category_id': category_id
+        }),
+        'PUT /transactions/<id>': update_transaction,
+        'DELETE /transactions/<id>': delete_transaction,
+        'PUT /settings': fixed('PUT', '/settings', json={'currency': 'EUR'}),
+        'POST /transactions/import (1000 filas)': import_transactions,
+        'POST /login': fixed('POST', '/login', json={'email': client.email, 'password': PASSWORD}),
+    }
+
+
+@pytest.mark.parametrize('case', CASES)
+def test_endpoint(benchmark, request, seeded, scale, case, query_counter):
+    client = seeded
+    build_request = build_cases(client, scale)[case]
+    measured = {}
+
+    def setup():
+        return build_request(), {}
+
+    def call(method, path, kwargs):
+        queries = query_counter['queries']
+        response = client.open(path, method=method, **kwargs)
+        response.get_data()
+        measured['queries'] = query_counter['queries'] - queries
+        assert 200 <= response.status_code < 300, f"{method} {path}: {response.status_code} {response.get_data(as_text=True)[:200]}"
+
+    benchmark.pedantic(call, setup=setup, rounds=request.config.getoption('benchmark_min_rounds'))
+
+    # tracemalloc ralentiza la ejecución: la memoria se mide en otra llamada
+    method, path, kwargs = build_request()
+    tracemalloc.start()
+    try:
+        client.open(path, method=method, **kwargs).get_data()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    benchmark.extra_info.update(queries=measured['queries'], peak_kb=peak // 1024)
+
+    baseline_path = request.config.getoption('resources_baseline')
+    base = load_baseline(baseline_path).get(request.node.nodeid) if baseline_path else None
+    if base:
+        budget = request.config.getoption('resources_budget')
+        assert measured['queries'] <= base['queries'], f"{base['queries']} -> {measured['queries']} consultas"
+        assert peak // 1024 <= base['peak_kb'] * (1 + budget), f"{base['peak_kb']} KB -> {peak // 1024} KB"
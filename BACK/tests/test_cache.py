@@ -0,0 +1,121 @@
+"""Caché de respuestas: nunca sirve datos anteriores a una escritura confirmada."""
+
+from datetime import datetime
+import components.transaction as transaction_module
+from cache import ResponseCache, response_cache, CATEGORIES
+from category_directory import category_directory
+
+
+def test_response_computed_before_invalidation_is_not_stored():
+    cache = ResponseCache(max_entries=10, ttl=60)
+    key = ('1', CATEGORIES, (None, None), (), (0, 0, None))
+
+    generation = cache._generation('1')
+    # Una escritura del usuario se confirma mientras se calcula la respuesta
+    cache.invalidate('1')
+    cache._set(key, generation, (None, None), b'{}', 'application/json')
+    assert cache._get(key) is None
+
+    cache._set(key, cache._generation('1'), (None, None), b'{}', 'application/json')
+    assert cache._get(key) is not None
+
+
+def test_replica_reads_are_not_served_to_the_writer(client, lagging_replica):
+    assert client.put('/settings', json={'currency': 'USD'}).status_code == 200
+
+    # Otro dispositivo del usuario (sin la cookie read_primary) lee la réplica desactualizada
+    client.delete_cookie('read_primary')
+    assert client.get('/settings').json == {'currency': 'EUR'}
+
+    # Quien escribió lee del primario y no recibe la respuesta de la réplica
+    client.set_cookie('read_primary', '1')
+    assert client.get('/settings').json == {'currency': 'USD'}
+
+
+def test_cached_body_matches_its_etag(client, monkeypatch):
+    path = '/history/monthly?year=2024&month=1'
+    first = client.get(path)
+    assert first.json == []
+
+    # Escritura confirmada por otro proceso: la caché de este no se invalida
+    with monkeypatch.context() as patch:
+        patch.setattr(response_cache, 'invalidate', lambda *args, **kwargs: None)
+        assert client.post('/transactions', json={'amount': 10, 'kind': 'expense', 'date': '2024-01-05'}).status_code == 201
+
+    second = client.get(path, headers={'If-None-Match': first.headers['ETag']})
+    assert second.status_code == 200
+    assert second.json[0]['expense'] == 10.0
+    assert client.get(path, headers={'If-None-Match': second.headers['ETag']}).status_code == 304
+
+
+def test_category_directory_ignores_replica_lag(client, lagging_replica):
+    category_id = client.post('/categories', json={'name': 'Nueva', 'color': '#00ff00', 'type': 'need'}).json['category']['id']
+
+    # Una lectura enviada a la réplica, que aún no tiene la categoría, carga el directorio
+    client.delete_cookie('read_primary')
+    assert client.get('/transactions').status_code == 200
+
+    response = client.post('/transactions', json={'amount': 5, 'kind': 'expense', 'date': '2024-01-05', 'category_id': category_id})
+    assert response.status_code == 201, response.json
+
+
+def test_summary_reflects_write_from_another_process(client, monkeypatch):
+    path = '/transactions/summary?start_date=2024-01-01&end_date=2024-01-31'
+    assert client.get(path).json['summary']['expenses'] == 0.0
+
+    # Escritura confirmada por otro proceso: la caché de este no se invalida
+    with monkeypatch.context() as patch:
+        patch.setattr(response_cache, 'invalidate', lambda *args, **kwargs: None)
+        assert client.post('/transactions', json={'amount': 10, 'kind': 'expense', 'date': '2024-01-05'}).status_code == 201
+
+    assert client.get(path).json['summary']['expenses'] == 10.0
+
+
+def test_category_directory_sees_categories_from_another_process(client, monkeypatch):
+    assert client.get('/transactions').status_code == 200
+
+    # Categoría creada por otro proceso: el directorio de este no se invalida
+    with monkeypatch.context() as patch:
+        patch.setattr(category_directory, 'invalidate', lambda user_id: None)
+        category_id = client.post('/categories', json={'name': 'Otra', 'color': '#0000ff', 'type': 'need'}).json['category']['id']
+
+    response = client.post('/transactions', json={'amount': 5, 'kind': 'expense', 'date': '2024-01-05', 'category_id': category_id})
+    assert response.status_code == 201, response.json
+
+
+def _frozen_datetime(now):
+    class FrozenDatetime(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return now
+    return FrozenDatetime
+
+
+def test_default_summary_follows_the_current_month(client, monkeypatch):
+    monkeypatch.setattr(transaction_module, 'datetime', _frozen_datetime(datetime(2024, 3, 31, 23, 59)))
+    assert client.post('/transactions', json={'amount': 10, 'kind': 'expense', 'date': '2024-03-10'}).status_code == 201
+    march = client.get('/transactions/summary')
+    assert march.json['summary']['expenses'] == 10.0
+
+    # Cambio de mes sin escrituras: ni el ETag ni la caché del mes anterior sirven
+    monkeypatch.setattr(transaction_module, 'datetime', _frozen_datetime(datetime(2024, 4, 1, 0, 1)))
+    april = client.get('/transactions/summary', headers={'If-None-Match': march.headers['ETag']})
+    assert april.status_code == 200
+    assert april.json['summary']['expenses'] == 0.0
+    assert client.get('/transactions/summary').json['summary']['expenses'] == 0.0
+
+
+def test_warm_category_directory_makes_no_primary_queries(client, lagging_replica, statements):
+    category_id = client.post('/categories', json={'name': 'Caliente', 'color': '#ff00ff', 'type': 'need'}).json['category']['id']
+    client.post('/transactions', json={'amount': 5, 'kind': 'expense', 'date': '2024-01-05', 'category_id': category_id})
+    lagging_replica.sync()
+    client.delete_cookie('read_primary')
+    paths = ('/transactions?limit=2', '/transactions/changes', '/transactions/summary?start_date=2024-01-01&end_date=2024-01-31')
+    for path in paths:
+        assert client.get(path).status_code == 200
+
+    # La versión de categorías llega con la huella del ETag, leída de la réplica
+    statements.clear()
+    for path in paths:
+        assert client.get(path).status_code == 200
+    assert statements == []
@@ -0,0 +1,34 @@
+"""Motor de SQLite compartido entre hilos."""
+
+import os
+import tempfile
+import threading
+from sqlalchemy import text
+import models
+
+
+def test_sqlite_connections_survive_more_threads_than_pool_size(monkeypatch):
+    monkeypatch.setitem(models.pool_options, 'pool_size', 2)
+    sqlite_engine = models.create_database_engine(f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'hilos.db')}")
+    threads_count = 6
+    connected = threading.Barrier(threads_count)
+    errors = []
+
+    def work():
+        try:
+            with sqlite_engine.connect() as connection:
+                # Todos los hilos tienen su conexión abierta a la vez antes de usarla
+                connected.wait(timeout=10)
+                assert connection.execute(text('PRAGMA journal_mode')).scalar() == 'wal'
+                assert connection.execute(text('PRAGMA foreign_keys')).scalar() == 1
+        except Exception as e:
+            errors.append(repr(e))
+
+    threads = [threading.Thread(target=work) for _ in range(threads_count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    sqlite_engine.dispose()
+
+    assert not errors, errors
@@ -0,0 +1,130 @@
+"""Importaciones y exportaciones en segundo plano (/jobs)."""
+
+import io
+import os
+import time
+import threading
+from datetime import timedelta
+from openpyxl import load_workbook
+from components.jobs import Job, JobManager
+from generate_data import generate, fixture
+
+
+def _wait(client, job_id, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = client.get(f'/jobs/{job_id}').json
+        if job['status'] in ('finished', 'failed'):
+            return job
+        time.sleep(0.1)
+    raise AssertionError(f'El trabajo {job_id} no ha terminado: {job}')
+
+
+def _xlsx_upload(rows):
+    buffer = io.BytesIO()
+    fixture(generate(users=1, per_user=rows, spread=0, seed=1)).to_excel(buffer, index=False)
+    buffer.seek(0)
+    return buffer
+
+
+def test_background_xlsx_import_and_export(client):
+    response = client.post('/transactions/import', data={'background': '1', 'file': (_xlsx_upload(120), 'datos.xlsx')})
+    assert response.status_code == 202
+    job = _wait(client, response.json['job_id'])
+    assert job['status'] == 'finished', job
+    assert job['result']['success_count'] == 120
+
+    response = client.get('/transactions/export?format=xlsx&background=1')
+    assert response.status_code == 202
+    job = _wait(client, response.json['job_id'])
+    assert job['status'] == 'finished', job
+
+    download = client.get(f"/jobs/{job['id']}/download")
+    assert download.status_code == 200
+    rows = list(load_workbook(io.BytesIO(download.get_data()), read_only=True).active.iter_rows(values_only=True))
+    assert rows[0][0] == 'Fecha'
+    assert len(rows) == 121
+
+
+def test_background_xlsx_import_reports_original_rows(client):
+    df = fixture(generate(users=1, per_user=3, spread=0, seed=2))
+    df['Cantidad'] = df['Cantidad'].astype(object)
+    df.loc[1, 'Cantidad'] = 'abc'
+    buffer = io.BytesIO()
+    df.to_excel(buffer, index=False)
+    buffer.seek(0)
+
+    job = _wait(client, client.post('/transactions/import', data={'background': '1', 'file': (buffer, 'datos.xlsx')}).json['job_id'])
+    assert job['result']['success_count'] == 2
+    assert client.get(f"/jobs/{job['id']}/errors").json['errors'] == ["Fila 3: Cantidad inválida 'abc'"]
+
+
+def test_jobs_are_visible_from_other_processes(tmp_path):
+    # Dos procesos del servidor comparten JOB_DIRECTORY
+    creator, other = JobManager(max_workers=1, directory=str(tmp_path)), JobManager(max_workers=1, directory=str(tmp_path))
+
+    def export(job):
+        path = os.path.join(str(tmp_path), 'export.csv')
+        with open(path, 'w') as output:
+            output.write('Fecha\n')
+        job.update_progress(bytes_written=6)
+        job.file_path = path
+        job.result = {'msg': 'Exportación completada', 'bytes': 6}
+
+    job = creator.submit(7, 'export', export)
+    creator.executor.shutdown(wait=True)
+
+    seen = other.get(7, job.id)
+    assert seen.status == 'finished'
+    assert seen.progress == {'bytes_written': 6}
+    assert seen.result == {'msg': 'Exportación completada', 'bytes': 6}
+    assert other.get(8, job.id) is None
+    assert other.get(7, '../' + job.id) is None
+
+    # La purga de cualquier proceso elimina el estado y el archivo de los trabajos caducados
+    other.retention = timedelta(0)
+    other._purge_expired()
+    assert creator.get(7, job.id) is None
+    assert not os.path.exists(seen.file_path)
+
+
+def test_jobs_of_a_dead_process_fail_and_are_purged(tmp_path):
+    directory = str(tmp_path)
+    upload = tmp_path / 'upload.datos.csv'
+    upload.write_text('Fecha\n')
+
+    # Trabajo en curso de un proceso que terminó: nadie renueva su latido
+    job = Job(7, 'import', directory)
+    job.status = 'running'
+    job.upload_path = str(upload)
+    job.save()
+    partial = tmp_path / f'{job.id}.abc.csv'
+    partial.write_text('a medias')
+    old = time.time() - 120
+    os.utime(job.path, (old, old))
+
+    manager = JobManager(max_workers=1, directory=directory, stale_after=timedelta(minutes=1))
+    seen = manager.get(7, job.id)
+    assert seen.status == 'failed'
+    assert seen.finished_at is not None
+
+    manager.retention = timedelta(0)
+    manager._purge_expired()
+    assert manager.get(7, job.id) is None
+    assert not upload.exists()
+    assert not partial.exists()
+
+
+def test_heartbeat_keeps_running_jobs_alive(tmp_path):
+    owner = JobManager(max_workers=1, directory=str(tmp_path))
+    owner.HEARTBEAT_SECONDS = 0.05
+    other = JobManager(max_workers=1, directory=str(tmp_path), stale_after=timedelta(seconds=0.5))
+    release = threading.Event()
+
+    job = owner.submit(7, 'export', lambda job: release.wait(10))
+    time.sleep(1)
+    assert other.get(7, job.id).status == 'running'
+
+    release.set()
+    owner.executor.shutdown(wait=True)
+    assert other.get(7, job.id).status == 'finished'
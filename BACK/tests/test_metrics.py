@@ -0,0 +1,52 @@
+"""Métricas sumadas entre procesos con METRICS_DIRECTORY."""
+
+import multiprocessing
+import os
+import tempfile
+from metrics import Metrics, ARCHIVE
+
+
+def _value(text, line_start):
+    return next((float(line.rsplit(' ', 1)[1]) for line in text.splitlines() if line.startswith(line_start)), None)
+
+
+def _serve_requests(directory, count):
+    worker = Metrics(directory)
+    for _ in range(count):
+        worker.observe_request('get_transactions', 'GET', 200, 0.02)
+    worker.request_started('export_transactions')
+    worker.save()
+
+
+def test_metrics_add_up_across_processes_and_survive_their_exit():
+    directory = tempfile.mkdtemp()
+    scraped = Metrics(directory)
+    scraped.observe_request('get_transactions', 'GET', 200, 0.01)
+
+    # Otro proceso del servidor atiende dos peticiones y termina con una exportación en curso
+    worker = multiprocessing.get_context('spawn').Process(target=_serve_requests, args=(directory, 2))
+    worker.start()
+    worker.join()
+
+    requests = 'trirule_http_requests_total{endpoint="get_transactions",method="GET",status="200"}'
+    latency_count = 'trirule_http_request_duration_seconds_count{endpoint="get_transactions",method="GET"}'
+    in_flight = 'trirule_http_requests_in_flight{endpoint="export_transactions"}'
+    text = scraped.render()
+    assert _value(text, requests) == 3
+    assert _value(text, latency_count) == 3
+    assert _value(text, in_flight) == 1
+
+    # El maestro de gunicorn archiva sus contadores; las peticiones en curso se descartan
+    scraped.mark_process_dead(worker.pid)
+    assert not os.path.exists(os.path.join(directory, f'{worker.pid}.json'))
+    assert os.path.exists(os.path.join(directory, ARCHIVE))
+    text = scraped.render()
+    assert _value(text, requests) == 3
+    assert _value(text, latency_count) == 3
+    assert _value(text, in_flight) is None
+
+
+def test_metrics_without_directory_are_per_process():
+    local = Metrics()
+    local.observe_query('get_categories', 0.001, 2)
+    assert _value(local.render(), 'trirule_db_queries_total{endpoint="get_categories"}') == 1
@@ -0,0 +1,88 @@
+"""Presupuestos de consultas (@query_budget) con QUERY_AUDIT_STRICT=1.
+
+La auditoría solo se registra al crear la aplicación con QUERY_AUDIT=1, así que
+estas pruebas usan una aplicación propia. Antes de cada petición se vacían la
+caché de respuestas y el directorio de categorías: el peor caso es el directorio
+frío, que cuesta una consulta más.
+"""
+
+import pytest
+from cache import response_cache
+from category_directory import category_directory
+from models import engine
+from migrations import init_database
+from conftest import register, PASSWORD
+
+
+@pytest.fixture(scope='module')
+def strict_app():
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setenv('QUERY_AUDIT', '1')
+        monkeypatch.setenv('QUERY_AUDIT_STRICT', '1')
+        init_database(engine)
+        from index import create_app
+        app = create_app()
+    app.config['TESTING'] = True
+    return app
+
+
+@pytest.fixture(scope='module')
+def strict_client(strict_app):
+    client = register(strict_app)
+    category_id = client.post('/categories', json={'name': 'Supermercado', 'color': '#ff0000', 'type': 'need'}).json['category']['id']
+    for day in range(1, 4):
+        client.post('/transactions', json={'amount': 10 + day, 'kind': 'expense', 'date': f'2024-01-{day:02d}', 'category_id': category_id})
+    client.category_id = category_id
+    return client
+
+
+def _cases(client):
+    category_id = client.category_id
+    transaction_id = client.get('/transactions?limit=1').json['transactions'][0]['id']
+    since = client.get('/transactions/changes').json['next_token']
+    return [
+        ('POST', '/login', {'json': {'email': client.email, 'password': PASSWORD}}),
+        ('GET', '/profile', {}),
+        ('GET', '/settings', {}),
+        ('PUT', '/settings', {'json': {'currency': 'EUR'}}),
+        ('GET', '/categories', {}),
+        ('GET', f'/categories/{category_id}', {}),
+        ('PUT', f'/categories/{category_id}', {'json': {'color': '#00ff00'}}),
+        ('GET', '/transactions', {}),
+        ('GET', '/transactions?limit=2&include_total=1', {}),
+        ('GET', '/transactions?limit=2&sort_by=category', {}),
+        ('GET', f'/transactions/{transaction_id}', {}),
+        ('GET', '/transactions/summary', {}),
+        ('GET', '/transactions/changes', {}),
+        ('GET', f'/transactions/changes?since={since}', {}),
+        ('POST', '/transactions', {'json': {'amount': 5, 'kind': 'expense', 'date': '2024-01-09', 'category_id': category_id}}),
+        ('PUT', f'/transactions/{transaction_id}', {'json': {'amount': 20, 'date': '2024-01-02', 'category_id': category_id}}),
+        ('GET', '/history/monthly?year=2024&month=1', {}),
+        ('GET', '/history/yearly?year=2024', {}),
+    ]
+
+
+def test_views_stay_within_budget_with_cold_caches(strict_client):
+    client = strict_client
+    failures = []
+    for method, path, kwargs in _cases(client):
+        response_cache.clear()
+        category_directory.invalidate(client.user_id)
+        response = client.open(path, method=method, **kwargs)
+        if response.status_code == 500:
+            failures.append(f"{method} {path}: {response.json}")
+    assert not failures, '\n'.join(failures)
+
+
+def test_deletes_stay_within_budget_with_cold_caches(strict_client):
+    client = strict_client
+    category_id = client.post('/categories', json={'name': 'Ocio', 'color': '#0000ff', 'type': 'want'}).json['category']['id']
+    transaction_id = client.post('/transactions', json={
+        'amount': 7, 'kind': 'expense', 'date': '2024-01-10', 'category_id': category_id
+    }).json['transaction']['id']
+
+    for path in (f'/transactions/{transaction_id}', f'/categories/{category_id}'):
+        response_cache.clear()
+        category_directory.invalidate(client.user_id)
+        response = client.delete(path)
+        assert response.status_code == 200, response.json
@@ -0,0 +1,131 @@
+"""EXPLAIN de las consultas que hacen los controladores en los endpoints más usados.
+
+Cada caso llama al endpoint con el cliente de pruebas, recoge las sentencias SQL
+que se ejecutan de verdad (con sus parámetros) y falla si el plan de alguna
+recorre una tabla completa.
+"""
+
+import pytest
+from cache import response_cache
+from category_directory import category_directory
+from models import engine
+from conftest import register, PASSWORD
+
+# Sentencias cuyo plan se comprueba (los INSERT no leen la tabla)
+EXPLAINED = ('SELECT', 'UPDATE', 'DELETE')
+
+
+def full_scans(connection, statement, parameters):
+    """Líneas del plan que corresponden a un recorrido completo de una tabla o de un índice"""
+    if connection.dialect.name == 'sqlite':
+        plan = connection.exec_driver_sql(f'EXPLAIN QUERY PLAN {statement}', parameters).all()
+        return [row.detail for row in plan if row.detail.startswith('SCAN') and row.detail != 'SCAN CONSTANT ROW']
+
+    # MySQL: type ALL es un recorrido completo de la tabla e index uno completo del índice
+    plan = connection.exec_driver_sql(f'EXPLAIN {statement}', parameters).mappings().all()
+    return [f"{row['table']} ({row['type']})" for row in plan if row['type'] in ('ALL', 'index')]
+
+
+@pytest.fixture(scope='module')
+def seeded(app):
+    """Usuario con dos categorías, transacciones en varias fechas y una eliminada"""
+    client = register(app)
+    categories = [
+        client.post('/categories', json={'name': name, 'color': '#ff0000', 'type': kind}).json['category']['id']
+        for name, kind in (('Supermercado', 'need'), ('Salario', 'save'))
+    ]
+    transactions = [
+        client.post('/transactions', json={
+            'amount': 10 + day, 'kind': 'expense' if day % 2 else 'income', 'date': f'2024-01-{day:02d}',
+            'description': 'Compra', 'category_id': categories[day % 2]
+        }).json['transaction']['id']
+        for day in range(1, 11)
+    ]
+    client.delete(f'/transactions/{transactions.pop()}')
+    return {'client': client, 'categories': categories, 'transactions': transactions}
+
+
+def _next_page(client, path):
+    return client.get(path).json['next_cursor']
+
+
+def _sync_token(client):
+    return client.get('/transactions/changes').json['next_token']
+
+
+# (nombre, función que recibe los datos sembrados y devuelve (método, ruta, argumentos))
+CASES = [
+    # authentication.py
+    ('login', lambda data: ('POST', '/login', {'json': {'email': data['client'].email, 'password': PASSWORD}})),
+    ('profile', lambda data: ('GET', '/profile', {})),
+    # transaction.py
+    ('get_transactions: todas', lambda data: ('GET', '/transactions', {})),
+    ('get_transactions: columnar', lambda data: ('GET', '/transactions?format=columnar', {})),
+    ('get_transactions: página por fecha', lambda data: ('GET', '/transactions?limit=3&include_total=1', {})),
+    ('get_transactions: página siguiente', lambda data: (
+        'GET', f"/transactions?limit=3&cursor={_next_page(data['client'], '/transactions?limit=3')}", {}
+    )),
+    ('get_transactions: por cantidad', lambda data: ('GET', '/transactions?limit=3&sort_by=amount', {})),
+    ('get_transactions: por categoría', lambda data: ('GET', '/transactions?limit=3&sort_by=category', {})),
+    ('get_transactions: filtro por categoría', lambda data: (
+        'GET', f"/transactions?limit=3&category={data['categories'][0]}", {}
+    )),
+    ('get_transactions: búsqueda', lambda data: ('GET', '/transactions?limit=3&search=Super', {})),
+    ('get_transaction', lambda data: ('GET', f"/transactions/{data['transactions'][0]}", {})),
+    ('get_transactions_summary', lambda data: (
+        'GET', '/transactions/summary?start_date=2024-01-01&end_date=2024-01-31', {}
+    )),
+    ('get_transaction_changes', lambda data: ('GET', '/transactions/changes', {})),
+    ('get_transaction_changes: incremental', lambda data: (
+        'GET', f"/transactions/changes?since={_sync_token(data['client'])}", {}
+    )),
+    ('export_transactions', lambda data: ('GET', '/transactions/export?format=csv', {})),
+    ('create_transaction', lambda data: ('POST', '/transactions', {'json': {
+        'amount': 5, 'kind': 'expense', 'date': '2024-01-15', 'category_id': data['categories'][0]
+    }})),
+    ('update_transaction', lambda data: ('PUT', f"/transactions/{data['transactions'][1]}", {
+        'json': {'amount': 7, 'date': '2024-01-20'}
+    })),
+    ('delete_transaction', lambda data: ('DELETE', f"/transactions/{data['transactions'].pop()}", {})),
+    # history.py
+    ('get_monthly_history', lambda data: ('GET', '/history/monthly?year=2024&month=1', {})),
+    ('get_yearly_history', lambda data: ('GET', '/history/yearly?year=2024', {})),
+    # category.py y settings.py
+    ('get_categories', lambda data: ('GET', '/categories', {})),
+    ('get_settings', lambda data: ('GET', '/settings', {})),
+]
+
+
+@pytest.mark.parametrize('name, build_request', CASES, ids=[name for name, _ in CASES])
+def test_hot_queries_use_indexes(seeded, statements, name, build_request):
+    client = seeded['client']
+    method, path, kwargs = build_request(seeded)
+
+    # Sin cachés, para que el endpoint haga todas sus consultas
+    response_cache.invalidate(client.user_id)
+    category_directory.invalidate(client.user_id)
+    statements.clear()
+
+    response = client.open(path, method=method, **kwargs)
+    response.get_data()
+    assert response.status_code < 300, response.get_data(as_text=True)
+
+    explained = [
+        (statement, parameters) for statement, parameters in statements
+        if statement.lstrip().upper().startswith(EXPLAINED)
+    ]
+    assert explained
+
+    scans = []
+    with engine.connect() as connection:
+        for statement, parameters in explained:
+            scans += [f"{' '.join(statement.split())}\n    -> {scan}" for scan in full_scans(connection, statement, parameters)]
+    assert not scans, '\n'.join(scans)
+
+
+def test_register_uses_indexes(app, statements):
+    register(app)
+    with engine.connect() as connection:
+        for statement, parameters in statements:
+            if statement.lstrip().upper().startswith(EXPLAINED):
+                assert not full_scans(connection, statement, parameters), statement
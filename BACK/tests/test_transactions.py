@@ -0,0 +1,86 @@
+"""Historiales coherentes con las transacciones al modificarlas y eliminarlas, y
+sincronización incremental con /transactions/changes."""
+
+from datetime import date, datetime, timedelta
+from sqlalchemy import insert, update
+from etags import transactions_version
+from models import engine, Transaction, TransactionKind, UserSettings
+
+
+def _day(client, day):
+    rows = client.get('/history/monthly?year=2024&month=1').json
+    return next(({'income': row['income'], 'expense': row['expense']} for row in rows if row['day'] == day), None)
+
+
+def _create(client, amount, kind='expense', date='2024-01-05'):
+    response = client.post('/transactions', json={'amount': amount, 'kind': kind, 'date': date})
+    assert response.status_code == 201, response.json
+    return response.json['transaction']['id']
+
+
+def test_update_moves_amount_between_days(client):
+    transaction_id = _create(client, 30)
+    assert client.put(f'/transactions/{transaction_id}', json={'amount': 12, 'date': '2024-01-06'}).status_code == 200
+
+    assert _day(client, 5) == {'income': 0.0, 'expense': 0.0}
+    assert _day(client, 6) == {'income': 0.0, 'expense': 12.0}
+
+
+def test_update_kind_moves_amount_between_columns(client):
+    transaction_id = _create(client, 30)
+    assert client.put(f'/transactions/{transaction_id}', json={'kind': 'income'}).status_code == 200
+
+    assert _day(client, 5) == {'income': 30.0, 'expense': 0.0}
+
+
+def test_delete_twice_subtracts_once(client):
+    _create(client, 10)
+    transaction_id = _create(client, 25)
+
+    assert client.delete(f'/transactions/{transaction_id}').status_code == 200
+    assert client.delete(f'/transactions/{transaction_id}').status_code == 404
+
+    assert _day(client, 5) == {'income': 0.0, 'expense': 10.0}
+    assert client.get('/history/yearly?year=2024').json[0]['expense'] == 10.0
+
+
+def _changes(client, token=None):
+    response = client.get(f'/transactions/changes?since={token}' if token else '/transactions/changes')
+    assert response.status_code == 200, response.json
+    return response.json
+
+
+def test_changes_return_writes_and_deletes_since_the_token(client):
+    kept = _create(client, 10)
+    deleted = _create(client, 20)
+    token = _changes(client)['next_token']
+
+    created = _create(client, 30)
+    assert client.put(f'/transactions/{kept}', json={'amount': 15}).status_code == 200
+    assert client.delete(f'/transactions/{deleted}').status_code == 200
+
+    changes = _changes(client, token)
+    assert not changes['reset']
+    assert sorted(row['id'] for row in changes['changes']) == sorted([kept, created])
+    assert changes['deleted'] == [deleted]
+    assert _changes(client, changes['next_token'])['changes'] == []
+
+
+def test_changes_include_a_write_that_commits_after_the_token(client):
+    _create(client, 10)
+
+    # Escritura que empezó hace un minuto y confirma después de emitirse el token
+    with engine.connect() as connection:
+        writer = connection.begin()
+        connection.execute(update(UserSettings).where(UserSettings.user_id == client.user_id).values(
+            transactions_version=UserSettings.transactions_version + 1
+        ))
+        connection.execute(insert(Transaction).values(
+            amount=40, date=date(2024, 1, 5), kind=TransactionKind.expense, user_id=client.user_id,
+            updated_at=datetime.now() - timedelta(minutes=1), sync_version=transactions_version(client.user_id)
+        ))
+        token = _changes(client)['next_token']
+        writer.commit()
+
+    changes = _changes(client, token)
+    assert [row['amount'] for row in changes['changes']] == [40.0]
@@ -0,0 +1,68 @@
+"""Ciclo de vida de la sesión de base de datos por petición.
+
+Todas las operaciones de una petición comparten la sesión de models.session:
+- las peticiones de lectura (GET, HEAD, OPTIONS) nunca hacen commit y, si hay
+  réplicas configuradas, se leen de una de ellas;
+- las de escritura hacen un único commit si la respuesta no es un error (< 400)
+  y dejan una cookie para que las lecturas siguientes del mismo cliente vayan al
+  primario durante DB_REPLICA_STICKY_SECONDS (read-your-writes);
+- al cerrar el contexto de la aplicación se descarta lo pendiente y la conexión
+  vuelve al pool. Con stream_with_context esto ocurre al terminar el envío.
+
+Fuera de una petición (trabajos en segundo plano, scripts) se usa session_scope(),
+siempre contra el primario.
+"""
+
+import os
+import random
+from contextlib import contextmanager
+from flask import jsonify, request
+from models import session, replica_engines
+
+READ_ONLY_METHODS = frozenset({'GET', 'HEAD', 'OPTIONS'})
+READ_PRIMARY_COOKIE = 'read_primary'
+
+
+def init_unit_of_work(app):
+    sticky_seconds = int(os.getenv('DB_REPLICA_STICKY_SECONDS', 10))
+
+    @app.before_request
+    def route_reads():
+        if (replica_engines and request.method in READ_ONLY_METHODS
+                and not request.cookies.get(READ_PRIMARY_COOKIE)):
+            session.info['replica'] = random.choice(replica_engines)
+
+    @app.after_request
+    def commit_session(response):
+        if request.method in READ_ONLY_METHODS or response.status_code >= 400:
+            return response
+
+        try:
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            print(f"Error al confirmar la transacción: {e}")
+            response = jsonify({'msg': 'Error al guardar los cambios'})
+            response.status_code = 500
+            return response
+
+        if replica_engines:
+            response.set_cookie(READ_PRIMARY_COOKIE, '1', max_age=sticky_seconds, httponly=True)
+        return response
+
+    @app.teardown_appcontext
+    def remove_session(exception=None):
+        session.remove()
+
+
+@contextmanager
+def session_scope():
+    """Proporciona un contexto transaccional para la sesión fuera de una petición."""
+    try:
+        yield session
+        session.commit()
+    except Exception as e:
+        session.rollback()
+        raise e
+    finally:
+        session.remove()